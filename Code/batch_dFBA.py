@@ -0,0 +1,330 @@
+###################
+# batch_dFBA.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This file runs a batch of dFBA simulations ("reactors") that share a model and scenario but differ in starting concentrations or kinetic parameters
+# dFBA_engine.simulate() runs one reactor at a time and updates every tracked compound with its own Python statements at every step
+# Here all reactors advance together: uptake rates, limits, stop conditions, and mass balances are computed for the whole batch at once as reactors x compounds arrays,
+# and only the LP solves are made one reactor at a time, on the same model. Reactors that stop are dropped from the batch
+###################
+
+# Import packages
+import time
+import contextlib
+import numpy
+import dFBA_engine
+import solve_cache
+import run_metrics
+from loopless_formulation import loopless_solution
+
+###############
+# Settings
+restore_basis = True		# give each reactor back its own GLPK basis before each solve, so results are the same as with dFBA_engine.simulate()
+							# Without it each solve warm-starts from the previous reactor's basis, which is a little faster, but degenerate steps can pick a different optimum
+
+# Settings that decide the layout of the tracking table or the model itself, so every reactor in a batch needs the same ones
+shared_settings = ["scenario", "timepoint_interval", "desired_product", "gene_deletions", "solver_timeout", "compress", "solve_cache", "solve_cache_digits", "solve_cache_size"]
+
+
+##############
+# Solver state
+
+# The GLPK basis (row and column statuses) of a model, or None for other solvers
+# optlang removes constraints lazily, so pending changes (the row loopless_solution() removes) are made first
+def get_basis(model):
+    if "glpk" not in model.solver.interface.__name__:
+        return None
+    import swiglpk
+    model.solver.update()
+    lp = model.solver.problem
+    rows = [swiglpk.glp_get_row_stat(lp, i) for i in range(1, swiglpk.glp_get_num_rows(lp) + 1)]
+    columns = [swiglpk.glp_get_col_stat(lp, j) for j in range(1, swiglpk.glp_get_num_cols(lp) + 1)]
+    return rows, columns
+
+def set_basis(model, basis):
+    if basis is None:
+        return
+    import swiglpk
+    lp = model.solver.problem
+    for i, stat in enumerate(basis[0]):
+        swiglpk.glp_set_row_stat(lp, i + 1, stat)
+    for j, stat in enumerate(basis[1]):
+        swiglpk.glp_set_col_stat(lp, j + 1, stat)
+
+# Bounds are changed the way cobra's Reaction.lower_bound and upper_bound setters do inside a model context (unchanged values are skipped),
+# but without recording the change in the context, which would keep thousands of entries per reactor
+def _set_lower_bound(rxn, value):
+    if rxn._lower_bound != value:
+        rxn._check_bounds(value, rxn._upper_bound)
+        rxn._lower_bound = value
+        rxn.update_variable_bounds()
+
+def _set_upper_bound(rxn, value):
+    if rxn._upper_bound != value:
+        rxn._check_bounds(rxn._lower_bound, value)
+        rxn._upper_bound = value
+        rxn.update_variable_bounds()
+
+# Put reactions back to bounds saved earlier, in one step
+def _restore_bounds(reactions, bounds):
+    for rxn, (lower, upper) in zip(reactions, bounds):
+        if (rxn._lower_bound, rxn._upper_bound) != (lower, upper):
+            rxn._lower_bound = lower
+            rxn._upper_bound = upper
+            rxn.update_variable_bounds()
+
+
+##############
+# Batch
+
+# The layout of the tracking table for a config, in the same order as dFBA_engine.simulate() builds it
+# Returns the compound IDs (without Time, Biomass, and the bioproduct) and their starting concentrations
+def _columns(config):
+    media_components = dict(config["media_components"])
+    for x in dFBA_engine.all_substrates:
+        media_components[x] = config["substrates"].get(x, 0.0)
+    tracked = dict(media_components)
+    tracked.update(config["enviro"])
+    tracked.update(config["outfluxes"])
+    tracked.pop(config.get("desired_product"), None)
+    return list(tracked.keys()), list(tracked.values())
+
+def _check_batch(configs):
+    if len(configs) == 0:
+        raise ValueError("A batch needs at least one config")
+    first = configs[0]
+    for config in configs[1:]:
+        for setting in shared_settings:
+            if config.get(setting) != first.get(setting):
+                raise ValueError("All configs in a batch need the same " + setting)
+        if _columns(config)[0] != _columns(first)[0] or list(config["outfluxes"]) != list(first["outfluxes"]):
+            raise ValueError("All configs in a batch need the same media, enviro, and outflux compounds")
+    for config in configs:
+        if config["n"] < 2:
+            raise ValueError("n must be at least 2")
+
+# Run a batch of dFBA simulations and return a list of tracking dictionaries, one per config, the same as dFBA_engine.simulate() would give for each
+# Every config must have the same scenario, timepoint_interval, desired_product, gene_deletions, and tracked compounds (see shared_settings)
+# Starting concentrations, starting_biomass, kinetics, n, and OE_amount can differ between reactors
+def simulate_batch(models, configs, verbose=False):
+    _check_batch(configs)
+    first = configs[0]
+    if first.get("compress"):
+        compressed = [dFBA_engine.get_compressed_models(models, config) for config in configs]
+        if any(x is not compressed[0] for x in compressed):
+            raise ValueError("All configs in a compressed batch need the same open and closed exchanges")
+        models = compressed[0]
+    scenario = first["scenario"]
+    timepoint_interval = first["timepoint_interval"]
+    desired_product = first.get("desired_product")
+    outfluxes = first["outfluxes"]
+    K = len(configs)
+    n = numpy.array([config["n"] for config in configs])
+
+    # Compound columns and what each one is
+    columns = _columns(first)[0]
+    M = len(columns)
+    position = {x: j for j, x in enumerate(columns)}
+    is_substrate = numpy.array([x in dFBA_engine.all_substrates for x in columns])
+    is_media = numpy.array([x in first["media_components"] or x in dFBA_engine.all_substrates for x in columns])
+    is_enviro = numpy.array([x in first["enviro"] and not is_media[j] for j, x in enumerate(columns)])
+    can_close = is_media | is_enviro
+    flux_IDs = [("DM_" if x in outfluxes else "EX_") + x for x in columns]
+    exchange_columns = [j for j in range(M) if can_close[j]]
+
+    # Kinetic parameters for every reactor and rate-limited compound
+    Vm = numpy.ones((K, M))
+    Ks = numpy.ones((K, M))
+    Ki = numpy.ones((K, M))
+    for k, config in enumerate(configs):
+        for j in numpy.flatnonzero(is_media):
+            Vm[k, j], Ks[k, j], Ki[k, j] = dFBA_engine.get_rate(columns[j], config["kinetics"])
+
+    # History of every reactor: compounds, biomass, and the bioproduct at every step
+    steps = int(n.max())
+    history = numpy.zeros((K, steps, M))
+    biomass = numpy.zeros((K, steps))
+    product = numpy.zeros((K, steps))
+    for k, config in enumerate(configs):
+        history[k, 0] = _columns(config)[1]
+        biomass[k, 0] = config["starting_biomass"]
+
+    active_models = {"model": models["model"]}
+    if models.get("model2") is not None:
+        active_models["model2"] = models["model2"]
+
+    # Reactions whose bounds change from step to step, in each model
+    touched = {}
+    for key, model in active_models.items():
+        touched[key] = [model.reactions.get_by_id(flux_IDs[j]) for j in exchange_columns]
+        if key == "model2":
+            touched[key] += [model.reactions.get_by_id(x) for x in dFBA_engine.aromatic_transport_rxns]
+
+    cache = solve_cache.cache_for_config(first)
+    untimed_solve = loopless_solution if cache is None else cache.solve
+
+    # Reactor steps, solver time, and solve cache lookups go to this process's counters for progress metrics (see run_metrics.py)
+    started = time.perf_counter()
+    cache_before = cache.stats() if cache is not None else None
+    reactor_steps = 0
+    def solve(model):
+        solve_started = time.perf_counter()
+        solution = untimed_solve(model)
+        run_metrics.add_solve(time.perf_counter() - solve_started, solution)
+        return solution
+
+    stop_condition = numpy.zeros(K, dtype = bool)
+    out = [{} for k in range(K)]
+    active = list(range(K))
+    trackings = [None] * K
+
+    # Turn a reactor's history into a tracking dictionary and add the PDC stationary phase, as at the end of simulate()
+    def finish(k, i):
+        length = i + 1 if i in out[k] else i
+        tracking = {}
+        start = configs[k]
+        initial = _columns(start)[1]
+        for j, x in enumerate(columns):
+            values = history[k, :length, j].tolist()
+            # The history array is all floats; the starting value is put back as the config has it (10, not 10.0), as simulate() writes it
+            values[0] = initial[j]
+            tracking[x] = values
+        time = [0]
+        for y in range(1, length):
+            time.append(time[-1] + timepoint_interval)
+        tracking["Time"] = time
+        tracking["Biomass"] = [start["starting_biomass"]] + biomass[k, 1:length].tolist()
+        if scenario == "bioproduct":
+            tracking[desired_product] = [0] + product[k, 1:length].tolist()
+        if scenario == "PDC" and (i - 1) in out[k]:
+            supplied = list(start["substrates"].keys())
+            dFBA_engine.stationary_phase(tracking, out[k][i - 1], i, start["n"], int(stop_condition[k]), supplied, outfluxes, timepoint_interval)
+        trackings[k] = tracking
+        active.remove(k)
+
+    with contextlib.ExitStack() as stack:
+        for key, model in active_models.items():
+            stack.enter_context(model)
+            dFBA_engine.reset_solver_basis(model)
+            model.solver.configuration.timeout = first.get("solver_timeout")
+        dFBA_engine.apply_gene_deletions(models, first.get("gene_deletions", []))
+
+        # Every reactor starts from the model as simulate() would find it
+        original = {key: [(r._lower_bound, r._upper_bound) for r in touched[key]] for key in touched}
+        state = {key: [(original[key], get_basis(active_models[key]))] * K for key in active_models}
+        try:
+            for i in range(1, steps):
+                for k in list(active):
+                    if i >= n[k]:
+                        finish(k, i - 1)
+                    elif stop_condition[k]:
+                        if verbose:
+                            print("Reactor ", k, ": all carbon consumed: ", i)
+                        finish(k, i)
+                if len(active) == 0:
+                    break
+                A = numpy.array(active)
+
+                # Maximum uptake rates, the same arithmetic as dFBA_engine.uptake_rate() for the whole batch
+                previous = history[A, i - 1]
+                previous_biomass = biomass[A, i - 1]
+                low = is_substrate & (previous < 0.0000001)
+                previous[low] = 0.0
+                history[A, i - 1] = previous
+                with numpy.errstate(divide = "ignore", invalid = "ignore"):
+                    rates = numpy.where(is_substrate,
+                                        Vm[A] * (previous / ((previous + Ks[A]) * (1 + previous / Ki[A]))),
+                                        Vm[A] * (previous / (previous + Ks[A])))
+                    rates[low] = 0.0
+                    limited = is_media & (previous < (rates * previous_biomass[:, None] * timepoint_interval))
+                    rates = numpy.where(limited, previous / (previous_biomass[:, None] * timepoint_interval), rates)
+                if scenario == "PDC":
+                    max_rate = (limited & (numpy.array(columns) != "exC00031")).any(axis = 1)
+                else:
+                    max_rate = numpy.zeros(len(A), dtype = bool)
+                if scenario == "bioproduct":
+                    stop_condition[A] |= limited[:, position["exVA"]]
+                # Closed exchanges stay closed, as in simulate(), since each reactor gets its own bounds back before it's solved
+                closed = can_close & (previous <= 0.)
+
+                # One solve per reactor
+                fluxes_by_reactor = []
+                for a, k in enumerate(A):
+                    for key, model in active_models.items():
+                        bounds, basis = state[key][k]
+                        _restore_bounds(touched[key], bounds)
+                        if restore_basis:
+                            set_basis(model, basis)
+                    if scenario == "bioproduct":
+                        dFBA_engine.set_OE_amount(models, configs[k]["OE_amount"])
+                    for j in exchange_columns:
+                        for model in active_models.values():
+                            rxn = model.reactions.get_by_id(flux_IDs[j])
+                            if is_media[j]:
+                                _set_lower_bound(rxn, -1 * rates[a, j])
+                                _set_upper_bound(rxn, 1 * rates[a, j])
+                            if closed[a, j]:
+                                _set_upper_bound(rxn, 0.)
+                                _set_lower_bound(rxn, 0.)
+
+                    fluxes = solve(models["model"]).fluxes
+                    if scenario == "PDC":
+                        for item in dFBA_engine.aromatic_transport_rxns:
+                            rxn = models["model2"].reactions.get_by_id(item)
+                            _set_upper_bound(rxn, 1.0)
+                            _set_lower_bound(rxn, fluxes[item])
+                            _set_upper_bound(rxn, fluxes[item])
+                        fluxes = solve(models["model2"]).fluxes
+                    for key, model in active_models.items():
+                        state[key][k] = ([(r._lower_bound, r._upper_bound) for r in touched[key]], get_basis(model) if restore_basis else None)
+                    out[k][i] = fluxes
+                    out[k].pop(i - 2, None)
+                    fluxes_by_reactor.append(fluxes)
+
+                reactor_steps += len(A)
+
+                # Mass balances for the whole batch
+                F = numpy.array([f[flux_IDs].to_numpy() for f in fluxes_by_reactor])
+                growth = numpy.array([f["biomass"] for f in fluxes_by_reactor])
+                biomass[A, i] = previous_biomass + growth * previous_biomass * timepoint_interval
+                history[A, i] = previous + F * previous_biomass[:, None] * timepoint_interval
+                if scenario == "bioproduct":
+                    secreted = numpy.array([f["DM_" + desired_product] for f in fluxes_by_reactor])
+                    product[A, i] = product[A, i - 1] + secreted * previous_biomass * timepoint_interval
+
+                # Stop conditions, in the same order as simulate()
+                for a, k in enumerate(A):
+                    if scenario == "bioproduct":
+                        if biomass[k, i] - biomass[k, i - 1] == 0:
+                            if verbose:
+                                print("Reactor ", k, ": model solving no longer feasible: ", i)
+                            finish(k, i)
+                            continue
+                    else:
+                        remaining_carbon = 0
+                        for x in configs[k]["substrates"]:
+                            remaining_carbon += history[k, i, position[x]]
+                        if remaining_carbon <= 0:
+                            stop_condition[k] = True
+                    if scenario == "PDC" and history[k, i, position["PDC"]] - history[k, i - 1, position["PDC"]] == 0 and max_rate[a]:
+                        if verbose:
+                            print("Reactor ", k, ": model solving no longer feasible: ", i)
+                        finish(k, i)
+                        continue
+                    if growth[a] < 0.0 and scenario != "PDC":
+                        if verbose:
+                            print("Reactor ", k, ": biomass running in reverse: ", i)
+                        finish(k, i)
+
+            # Reactors that ran all their steps
+            for k in list(active):
+                finish(k, int(n[k]) - 1)
+        finally:
+            for key in touched:
+                _restore_bounds(touched[key], original[key])
+
+    run_metrics.add({"runs": K, "steps": reactor_steps, "run_seconds": time.perf_counter() - started})
+    if cache is not None:
+        run_metrics.add(run_metrics.cache_counters(cache_before, cache.stats()))
+        cache.save_stats()
+    return trackings
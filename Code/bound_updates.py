@@ -0,0 +1,58 @@
+###################
+# bound_updates.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This file sends the bounds of a set of reactions to the solver once per step, and only the ones that changed
+# The dFBA loops set lower_bound and then upper_bound of every exchange in separate calls, twice over for the PDC strain, and each call goes through
+# cobra's bound checks, its model context history, and optlang, even for exhausted substrates held at 0 or environment exchanges that never change
+# Here the bounds of a step are given as arrays, compared with the values last sent, and each changed reaction gets both of its bounds in one update
+###################
+
+# Import packages
+import numpy
+
+
+##############
+# Bound updates
+
+class BoundUpdater:
+    # rxn_IDs are the reactions whose bounds this updater sets; their bounds when it's made are the ones restore() goes back to
+    def __init__(self, model, rxn_IDs):
+        self.rxn_IDs = list(rxn_IDs)
+        self.reactions = [model.reactions.get_by_id(x) for x in self.rxn_IDs]
+        self.index = {x: j for j, x in enumerate(self.rxn_IDs)}
+        self.lower = numpy.array([r._lower_bound for r in self.reactions], dtype = float)
+        self.upper = numpy.array([r._upper_bound for r in self.reactions], dtype = float)
+        self.original = (self.lower.copy(), self.upper.copy())
+        self.sent = 0
+        self.skipped = 0
+
+    # Arrays to fill in with the bounds of the next step, starting from the current ones
+    def bounds(self):
+        return self.lower.copy(), self.upper.copy()
+
+    # Send the bounds of a step; reactions whose bounds are the same as last time aren't touched
+    # Unlike setting lower_bound and upper_bound through cobra, nothing is added to the model's context, so a run inside "with model:" has to call restore() at its end
+    def push(self, lower, upper):
+        changed = numpy.flatnonzero((lower != self.lower) | (upper != self.upper))
+        for j in changed:
+            rxn = self.reactions[j]
+            rxn._check_bounds(lower[j], upper[j])
+            rxn._lower_bound = float(lower[j])
+            rxn._upper_bound = float(upper[j])
+            rxn.update_variable_bounds()
+        self.lower[changed] = lower[changed]
+        self.upper[changed] = upper[changed]
+        self.sent += len(changed)
+        self.skipped += len(self.reactions) - len(changed)
+
+    # Put the bounds back to what they were when the updater was made
+    def restore(self):
+        self.push(*self.original)
+
+    def stats(self):
+        return {"sent": self.sent, "skipped": self.skipped}
+
+# Counts of several updaters added up
+def total_stats(updaters):
+    return {"sent": sum(x.sent for x in updaters), "skipped": sum(x.skipped for x in updaters)}
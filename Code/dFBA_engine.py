@@ -0,0 +1,769 @@
+###################
+# dFBA_engine.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This file holds the dFBA loops from cometabolism_dFBA.py, PDC_dFBA.py, and bioproduct_dFBA.py as importable functions
+# The stand-alone scripts keep their settings at the top of the file and run on import, which makes them hard to reuse
+# Here the same settings are passed in as a config dictionary, so batch scripts (ensembles, sweeps, screens) can run many simulations in worker processes
+###################
+
+# Import packages
+import copy
+import time
+import contextlib
+import logging
+import cobra
+import pandas
+import gpr_index
+import model_compression
+import solve_cache
+import bound_updates
+import run_metrics
+from loopless_formulation import loopless_solution
+logging.basicConfig()
+
+###############
+# Version of the simulation code, stored with every saved result (see result_store.py)
+# Change it whenever an edit to this file or the modules it uses changes simulation results, so older results aren't reused
+engine_version = "2022.1"
+
+# Substrates encoded in the iNovo models. Everything in this list is tracked in every run, usually at 0 mmol/L
+all_substrates = ["exC00031", "expHBA", "exSA", "exS", "exVA", "exPCA", "exV", "exFA", "exGDK", "exSDK", "exSSGGE", "exSRGGE", "exRSGGE", "exRRGGE"]
+
+# Kinetic parameters in mM per min as [Vm, Ks, Ki] - these are estimates from related bacteria in the literature and not experimentally verified
+# Aromatics and glucose are grouped by substrate class, the minerals are listed by exchange ID
+default_kinetics = {"glucose": [0.5, 0.139, 0.139],
+                    "S": [0.582, 0.05, 0.05],
+                    "H": [0.902, 0.05, 0.05],
+                    "G": [0.569, 0.1, 0.1],
+                    "exC00014": [0.5, 0.1, 0.1],		# ammonia
+                    "exC00009": [0.060, 0.002, 0.1],	# phosphate
+                    "exC00059": [0.0017, 0.003, 0.1],	# sulfate
+                    "exC14818": [0.0017, 0.003, 0.1]}	# iron
+
+nonaromatic_substrates = ["exC00031", "exC00243", "exC00033", "exC00022", "exC00095", "exC00181", "exC00208", "exC00185"]
+S_type = ["exSA", "exS", "exSDK"]
+H_type = ["expHBA", "exPCA", "exC00633", "exC00180", "exC00156"]
+G_type = ["exVA", "exV", "exFA", "exGDK", "exSRGGE", "exSSGGE", "exRRGGE", "exRSGGE"]
+
+# Default settings for each of the dFBA scripts
+# The media and outflux recipes differ slightly between scripts, so they are kept separately here
+scenario_defaults = {
+    "cometabolism": {
+        "starting_biomass": 0.001,		# in g/L
+        "timepoint_interval": 30,		# minutes between timepoints
+        "n": 1000,						# number of timesteps
+        # Standard Mineral Base, no carbon, from DSMZ Medium 1185. Iron, ammonia, phosphate, and sulfate.
+        "media_components": {"exC14818": 45.54, "exC00014": 10., "exC00009": 26.1, "exC00059": 8.},
+        # Exchange reactions that are far in excess of others due to diffusion
+        "enviro": {"C00282": 10, "exC00001": 100, "exC00007": 10},
+        # Things the model needs to be allowed to output or it will break
+        "outfluxes": {"C00067": 0, "C00058": 0, "C00033": 0, "C00010": 1, "C00162": 1, "C00132": 0, "C00054": 0, "C00011": 0, "C05198": 0, "C04425": 0, "C00266": 0, "C00153": 0},
+        "kinetics": {}},
+    "PDC": {
+        "starting_biomass": 0.001,
+        "timepoint_interval": 30,
+        "n": 150,
+        "media_components": {"exC14818": 45.54, "exC00014": 10., "exC00009": 26.1, "exC00059": 8.},
+        "enviro": {"C00282": 10, "exC00001": 100, "exC00007": 10},
+        "outfluxes": {"C00162": 1, "C00010": 1, "C00132": 0, "C00054": 0, "PDC": 0, "C00011": 0, "C05198": 0, "C04425": 0, "C00266": 0, "C00153": 0},
+        # PDC_dFBA.py uses a higher Ks and Ki for the S-type aromatics
+        "kinetics": {"S": [0.582, 0.1, 0.1]}},
+    "bioproduct": {
+        "starting_biomass": 0.001,
+        "timepoint_interval": 30,
+        "n": 300,
+        "media_components": {"exC14818": 45.54, "exC00014": 50., "exC00009": 26.1, "exC00059": 8.},
+        "enviro": {"C00282": 10, "exC00001": 100, "exC00007": 10},
+        "outfluxes": {"C00162": 1, "C00010": 1, "C00132": 0, "C00054": 0, "C00011": 0, "C05198": 0, "C04425": 0, "C00266": 0, "C00153": 0},
+        "kinetics": {"S": [0.582, 0.1, 0.1]}},
+}
+
+# Genes knocked out to make the PDC producing strain from Perez et al., 2021
+PDC_strain_deletions = ["SARO_RS14300", "Saro_2864", "SARO_RS14530"]
+aromatic_transport_rxns = ["A031", "A032", "t0003", "t0030", "t0031", "t0032", "t0033", "t0035", "t0036", "t0037", "t0038", "t0039", "t0023"]
+
+# Molecular weights in g/mol, used to convert production rates to g/L/hr
+PDC_molecular_weight = 184.10
+molecular_weights = {"C00489": 132.12, "C06098": 568.88, "C02480": 142.11, "C00158": 192.12, "C00163": 88.11, "C00084": 44.05, "C00116": 92.09, "C00246": 88.11, "C00823": 242.44, "C00146": 94.11, "C00086": 60.06, "C00033": 59.04, "C00189": 61.08}
+
+
+##############
+# Kinetics
+
+# Which kinetic parameter set a compound uses
+def substrate_class(cpd_ID):
+    if cpd_ID in nonaromatic_substrates:
+        return "glucose"
+    elif cpd_ID in S_type:
+        return "S"
+    elif cpd_ID in H_type:
+        return "H"
+    elif cpd_ID in G_type:
+        return "G"
+    return cpd_ID
+
+def get_rate(cpd_ID, kinetics=default_kinetics):
+    Vm, Ks, Ki = kinetics.get(substrate_class(cpd_ID), [0, 0, 0.1])
+    return Vm, Ks, Ki
+
+# Maximum uptake rate for a compound at a given concentration
+# Carbon substrates have substrate inhibition, minerals follow plain Michaelis-Menten kinetics
+def uptake_rate(cpd_ID, concentration, kinetics=default_kinetics, inhibition=True):
+    Vm, Ks, Ki = get_rate(cpd_ID, kinetics)
+    if inhibition:
+        return Vm * (concentration / ((concentration + Ks) * (1 + concentration / Ki)))
+    return Vm * (concentration / (concentration + Ks))
+
+
+##############
+# Configuration
+
+# Build a run configuration from the defaults for a scenario
+# substrates is a dictionary of compound ID: concentration in mmol/L, anything left out starts at 0
+# Any other setting (n, timepoint_interval, kinetics, desired_product, OE_amount, gene_deletions, solver_timeout...) can be passed as a keyword
+# solver_timeout is a time limit in seconds for each solve; GLPK can stall on some knockouts, and a timed-out solve is treated like an infeasible one
+# Kinetics given here are merged over the defaults, so only the classes you want to change need to be listed
+def make_config(scenario, substrates, **settings):
+    if scenario not in scenario_defaults:
+        raise ValueError("Unknown scenario: " + str(scenario))
+    config = copy.deepcopy(scenario_defaults[scenario])
+    config["scenario"] = scenario
+    config["substrates"] = {x: float(substrates[x]) for x in substrates}
+    config["gene_deletions"] = []
+    kinetics = copy.deepcopy(default_kinetics)
+    kinetics.update(config["kinetics"])
+    kinetics.update(copy.deepcopy(settings.pop("kinetics", {})))
+    config["kinetics"] = kinetics
+    config.update(settings)
+    if scenario == "bioproduct" and "desired_product" not in config:
+        raise ValueError("The bioproduct scenario needs a desired_product")
+    return config
+
+# Build a run configuration from the same command line arguments the stand-alone scripts take
+# cometabolism: model followed by substrates, each provided at 1 mmol/L
+# PDC: model, substrate 1, concentration 1, substrate 2, concentration 2
+# bioproduct: model, desired product, overexpression amount (5 mmol/L vanillic acid as in bioproduct_dFBA.py)
+# Returns the model path and the config dictionary
+def config_from_args(scenario, args, **settings):
+    model_path = args[0]
+    if scenario == "cometabolism":
+        substrates = {x: 1.0 for x in args[1:]}
+    elif scenario == "PDC":
+        substrates = {args[1]: float(args[2]), args[3]: float(args[4])}
+    elif scenario == "bioproduct":
+        substrates = {"exVA": 5.0}
+        settings["desired_product"] = args[1]
+        settings["OE_amount"] = float(args[2])
+    else:
+        raise ValueError("Unknown scenario: " + str(scenario))
+    return model_path, make_config(scenario, substrates, **settings)
+
+
+##############
+# Model setup
+
+def load_model(model_path):
+    # There's a small (1e-7) error rate in the standard optimization method, so use the slower but more accurate glpk_exact
+    cobra_config = cobra.Configuration()
+    cobra_config.solver = "glpk_exact"
+    return cobra.io.read_sbml_model(model_path)
+
+def add_SA_constraint(model):
+    SA_flux = model.problem.Constraint(
+        model.reactions.A031.flux_expression - model.reactions.A015.flux_expression * 0.15,
+        lb=0,
+        ub=0, name = 'SA_flux')
+    model.add_cons_vars(SA_flux)
+    return SA_flux
+
+# Apply the permanent, scenario-specific changes to a freshly loaded model
+# Returns a dictionary of models: "model" is always solved, "model2" is the PDC-producing strain when scenario is PDC
+# Anything that changes from run to run (bounds, OE amount, gene deletions) is applied by simulate() inside a model context instead
+def prepare_models(model, scenario, desired_product=None):
+    models = {"model": model}
+
+    if scenario == "cometabolism":
+        add_SA_constraint(model)
+
+    elif scenario == "PDC":
+        model.add_boundary(model.metabolites.get_by_id("PDC"), ub = 1000., type = "demand", reaction_id="DM_PDC")
+        # We don't want the SA constraint in the PDC producing version of the model because with no flux though the PDC degrading portion, all fluxes would be zero
+        model2 = copy.deepcopy(model)
+        add_SA_constraint(model)
+        for gene in PDC_strain_deletions:
+            model2.genes.get_by_id(gene).knock_out()
+        models["model2"] = model2
+
+    elif scenario == "bioproduct":
+        # A033 runs inappropriately if included in the regular model, so only include it in the model if that is the desired pathway
+        if desired_product == "C02480":
+            rxn_to_add = cobra.Reaction("A033", lower_bound = 0.0, upper_bound=1000., name="PCA to catechol")
+            model.add_reactions([rxn_to_add])
+            model.reactions.get_by_id("A033").add_metabolites({"PCA": -1, "C00090": 1, "C00011": 1})
+        # There's already a demand for acetate, so don't add the demand if acetate is the desired product
+        if "DM_" + desired_product not in model.reactions:
+            model.add_boundary(model.metabolites.get_by_id(desired_product), ub=1000., type="demand", reaction_id="DM_" + desired_product)
+        # Constrain that demand to a proportion of the aromatic uptake
+        # The constraint stays in the model, and each run only changes its coefficient on EX_exVA (see set_OE_amount)
+        OE_flux = model.problem.Constraint(
+            model.reactions.get_by_id("DM_" + desired_product).flux_expression,
+            lb=0,
+            ub=0, name = 'OE_flux')
+        model.add_cons_vars(OE_flux)
+        models["OE_flux"] = OE_flux
+
+    elif scenario == "yield":
+        # calculate_biomass_yield.py runs without guaiacol degradation
+        add_SA_constraint(model)
+        model.remove_reactions(["A045"])
+
+    else:
+        raise ValueError("Unknown scenario: " + str(scenario))
+
+    return models
+
+# Set the overexpression amount (moles of product per mole of vanillic acid) on a prepared bioproduct model
+# The constraint is DM_product + OE_amount * EX_exVA = 0, so the solver problem is reused and only one coefficient changes
+def set_OE_amount(models, OE_amount):
+    EX_exVA = models["model"].reactions.EX_exVA
+    models["OE_flux"].set_linear_coefficients({EX_exVA.forward_variable: float(OE_amount), EX_exVA.reverse_variable: -float(OE_amount)})
+
+# Worker processes keep one prepared copy of each model so it's only read from disk once
+_model_cache = {}
+
+def get_models(model_path, scenario, desired_product=None):
+    key = (model_path, scenario, desired_product)
+    if key not in _model_cache:
+        _model_cache[key] = prepare_models(load_model(model_path), scenario, desired_product)
+    return _model_cache[key]
+
+# The gene rules of the base model compiled into a gpr_index.GPRIndex, built the first time it's needed and kept with the models
+def get_gpr_index(models):
+    if "gpr_index" not in models:
+        models["gpr_index"] = gpr_index.GPRIndex.from_model(models["model"])
+    return models["gpr_index"]
+
+# Close every reaction of the base model that the gene deletions disable, the same reactions gene.knock_out() would close
+# Call inside a model context so the bounds are restored afterwards
+# In a compressed model, the lumped reaction a disabled reaction is part of is closed, and blocked reactions are already gone
+def apply_gene_deletions(models, genes):
+    if len(genes) == 0:
+        return
+    compression = models.get("compression", {}).get("model")
+    for rxn_ID in get_gpr_index(models).disabled([genes])[0]:
+        if compression is not None:
+            rxn_ID = compression.reaction_for(rxn_ID)
+            if rxn_ID is None:
+                continue
+        models["model"].reactions.get_by_id(rxn_ID).bounds = (0, 0)
+
+# Compressed copies of prepared models for the medium of a run (see model_compression.py)
+# Returns a dictionary like the one from prepare_models(), plus "compression": model key: Compression for mapping fluxes back
+# Kept with the full models, so runs with the same open and closed exchanges (a sweep over concentrations, for example) reuse it
+def get_compressed_models(models, config):
+    bounds = initial_exchange_bounds(config)
+    medium = (tuple(sorted(x for x in bounds if bounds[x] <= 0)), tuple(sorted(x for x in bounds if bounds[x] > 0)))
+    cached = models.setdefault("compressed", {})
+    if medium not in cached:
+        compressed = {"gpr_index": get_gpr_index(models), "compression": {}}
+        protect = aromatic_transport_rxns if config["scenario"] == "PDC" else []
+        for key in ("model", "model2"):
+            if key in models:
+                compressed[key], compressed["compression"][key] = model_compression.compress(models[key], bounds, free_constraints = ["OE_flux"], protect = protect)
+        if "OE_flux" in models:
+            compressed["OE_flux"] = compressed["model"].constraints["OE_flux"]
+        cached[medium] = compressed
+    return cached[medium]
+
+
+##############
+# dFBA
+
+# GLPK warm-starts every solve from the last basis it found, and with degenerate optima that changes which solution comes back
+# A reused model would then give different answers than a freshly loaded one, so each run starts from the standard basis like a new model does
+def reset_solver_basis(model):
+    if "glpk" in model.solver.interface.__name__:
+        import swiglpk
+        swiglpk.glp_std_basis(model.solver.problem)
+
+def set_exchange_bounds(model, rxn_ID, lower, upper):
+    rxn = model.reactions.get_by_id(rxn_ID)
+    rxn.lower_bound = lower
+    rxn.upper_bound = upper
+
+# Warn if any exchange is operating at its maximum allowed rate
+def _print_limiting(i, model, fluxes, prefix, metabolites):
+    for metabolite in metabolites:
+        rxn = model.reactions.get_by_id(prefix + metabolite)
+        rate = fluxes[prefix + metabolite]
+        if (rate == rxn.upper_bound and rate != 0) or (rate == rxn.lower_bound and rate != 0):
+            print(str(i) + ": " + metabolite + " uptake rate is limiting" + ": " + str(rate))
+
+# Run one dFBA simulation and return the tracking dictionary (compound: list of concentrations over time)
+# This follows the loops in the stand-alone scripts step for step, including their stop conditions
+# All changes to the models are made inside a model context, so the same prepared models can be reused for the next run
+# flux_callback, if given, is called after every solve with the timestep, the key of the model solved ("model" or "model2"), and the fluxes
+# With "compress": True in the config, the loop solves a compressed model for the run's medium; the results are the same, and flux_callback still gets full-model fluxes
+# With "solve_cache" in the config, solves of an LP that was already solved come from solve_cache.py instead
+# dual_callback, if given, is called after every solve with the timestep, the model key, and the solution, whose reduced_costs (tracked exchanges,
+# and the PDC strain's aromatic transports) and shadow_prices (SA_flux, OE_flux) are from the growth LP. Those solves don't use the solve cache
+def simulate(models, config, verbose=False, flux_callback=None, dual_callback=None):
+    if config.get("compress"):
+        models = get_compressed_models(models, config)
+    compression = models.get("compression", {})
+    scenario = config["scenario"]
+    Novo_model = models["model"]
+    Novo_model2 = models.get("model2")
+    timepoint_interval = config["timepoint_interval"]
+    n = config["n"]
+    kinetics = config["kinetics"]
+    desired_product = config.get("desired_product")
+
+    substrates = {x: [0.0] for x in all_substrates}
+    for x in config["substrates"]:
+        substrates[x] = [config["substrates"][x]]
+    supplied = list(config["substrates"].keys())
+
+    media_components = {x: [config["media_components"][x]] for x in config["media_components"]}
+    media_components.update(substrates) # Add carbon sources to the basic medium recipe
+    enviro = {x: [config["enviro"][x]] for x in config["enviro"]}
+    outfluxes = {x: [config["outfluxes"][x]] for x in config["outfluxes"]}
+
+    # Combine all tracked items and add time to the tracking dictionary
+    tracking = copy.deepcopy(media_components)
+    tracking.update(enviro)
+    tracking.update(outfluxes)
+    tracking["Time"] = [0]
+    tracking["Biomass"] = [config["starting_biomass"]]
+    if scenario == "bioproduct":
+        tracking[desired_product] = [0]
+
+    active_models = [Novo_model] if Novo_model2 is None else [Novo_model, Novo_model2]
+    cache = solve_cache.cache_for_config(config)
+    solve = loopless_solution if cache is None else cache.solve
+    if dual_callback is not None:
+        dual_names = (dual_reactions(config), ["SA_flux", "OE_flux"])
+        def solve(model):
+            return loopless_solution(model, dual_names)
+
+    # Steps, solver time, and solve cache lookups go to this process's counters for progress metrics (see run_metrics.py)
+    started = time.perf_counter()
+    cache_before = cache.stats() if cache is not None else None
+    steps = 0
+    untimed_solve = solve
+    def solve(model):
+        solve_started = time.perf_counter()
+        solution = untimed_solve(model)
+        run_metrics.add_solve(time.perf_counter() - solve_started, solution)
+        return solution
+
+    with contextlib.ExitStack() as stack:
+        for model in active_models:
+            stack.enter_context(model)
+            reset_solver_basis(model)
+            model.solver.configuration.timeout = config.get("solver_timeout")
+
+        # Gene deletions of choice go in the base model only (the PDC strain deletions are already made)
+        apply_gene_deletions(models, config.get("gene_deletions", []))
+
+        if scenario == "bioproduct":
+            set_OE_amount(models, config["OE_amount"])
+
+        # The exchange bounds of each step go to the solver in one pass per model, and only the ones that changed (see bound_updates.py)
+        # They're put back before the model contexts close, since the updaters don't use them
+        exchanges = ["EX_" + x for x in list(media_components) + list(enviro)]
+        exchange_updaters = [bound_updates.BoundUpdater(model, exchanges) for model in active_models]
+        transport_updater = bound_updates.BoundUpdater(Novo_model2, aromatic_transport_rxns) if scenario == "PDC" else None
+        updaters = exchange_updaters + ([transport_updater] if transport_updater is not None else [])
+        for updater in updaters:
+            stack.callback(updater.restore)
+
+        # Only the last two flux solutions are kept; the PDC stationary phase needs the one before the last
+        out = {}
+        stop_condition = 0
+
+        for i in range(1, n):
+            if stop_condition == 1:
+                if verbose:
+                    print("All carbon consumed: ", i)
+                break
+
+            max_rate = 0
+            lower, upper = exchange_updaters[0].bounds()
+            for metabolite in tracking:
+
+                if metabolite in substrates or metabolite in media_components:
+
+                    if metabolite in substrates:
+                        if tracking[metabolite][i - 1] < 0.0000001:
+                            r = 0.0
+                            tracking[metabolite][i - 1] = 0.0
+                        else:
+                            r = uptake_rate(metabolite, tracking[metabolite][i - 1], kinetics)
+                    else:
+                        r = uptake_rate(metabolite, tracking[metabolite][i - 1], kinetics, inhibition=False)
+
+                    if tracking[metabolite][i - 1] < (r * tracking["Biomass"][i - 1] * timepoint_interval):
+                        if verbose:
+                            print("Maximum allowed rate exceeds remaining concentration of substrate - resetting max rate ", i, "; ", metabolite, "; ", r)
+                        r = tracking[metabolite][i - 1] / (tracking["Biomass"][i - 1] * timepoint_interval)
+                        if scenario == "PDC" and metabolite != "exC00031":
+                            max_rate = 1
+                        if scenario == "bioproduct" and metabolite == "exVA":
+                            stop_condition = 1
+
+                    j = exchange_updaters[0].index["EX_" + metabolite]
+                    lower[j] = -1 * r
+                    upper[j] = 1 * r
+
+                if tracking[metabolite][i - 1] <= 0. and metabolite not in ("Time", "Biomass", desired_product) and metabolite not in outfluxes:
+                    j = exchange_updaters[0].index["EX_" + metabolite]
+                    lower[j] = 0.
+                    upper[j] = 0.
+
+            for updater in exchange_updaters:
+                updater.push(lower, upper)
+
+            # loopless_solution re-optimizes the model itself, so there's no need to call optimize() first
+            # It's the faster version in loopless_formulation.py, which gives the same solutions as cobra's
+            solution = solve(Novo_model)
+            fluxes = solution.fluxes
+            if flux_callback is not None:
+                flux_callback(i, "model", compression["model"].expand(fluxes) if "model" in compression else fluxes)
+            if dual_callback is not None:
+                dual_callback(i, "model", solution)
+
+            # Constrain aromatic transport in the PDC-producing model and solve for biomass
+            if scenario == "PDC":
+                # Both bounds are set at once, so there's no need to open the upper bound first as the stand-alone script does
+                transport_fluxes = fluxes[aromatic_transport_rxns].to_numpy(dtype = float)
+                transport_updater.push(transport_fluxes, transport_fluxes)
+                solution = solve(Novo_model2)
+                fluxes = solution.fluxes
+                if flux_callback is not None:
+                    flux_callback(i, "model2", compression["model2"].expand(fluxes) if "model2" in compression else fluxes)
+                if dual_callback is not None:
+                    dual_callback(i, "model2", solution)
+
+            out[i] = fluxes
+            out.pop(i - 2, None)
+            steps += 1
+
+            # Track biomass
+            tracking["Biomass"].append(tracking["Biomass"][i - 1] + fluxes["biomass"] * tracking["Biomass"][i - 1] * timepoint_interval)
+
+            if verbose:
+                _print_limiting(i, Novo_model, fluxes, "EX_", media_components)
+                _print_limiting(i, Novo_model, fluxes, "EX_", enviro)
+                _print_limiting(i, Novo_model, fluxes, "DM_", outfluxes)
+
+            # Mass balance items in tracking
+            for metabolite in tracking:
+                if metabolite == "Time":
+                    tracking["Time"].append(tracking["Time"][-1] + timepoint_interval)
+                elif metabolite == "Biomass" or metabolite == desired_product:
+                    continue
+                elif metabolite in outfluxes:
+                    tracking[metabolite].append(tracking[metabolite][i - 1] + fluxes["DM_" + metabolite] * tracking["Biomass"][i - 1] * timepoint_interval)
+                else:
+                    tracking[metabolite].append(tracking[metabolite][i - 1] + fluxes["EX_" + metabolite] * tracking["Biomass"][i - 1] * timepoint_interval)
+
+            if scenario == "bioproduct":
+                tracking[desired_product].append(tracking[desired_product][i - 1] + fluxes["DM_" + desired_product] * tracking["Biomass"][i - 1] * timepoint_interval)
+
+                if tracking["Biomass"][i] - tracking["Biomass"][i - 1] == 0:
+                    if verbose:
+                        print("Model solving no longer feasible: ", i)
+                    break
+
+            else:
+                remaining_carbon = 0
+                for x in supplied:
+                    remaining_carbon += tracking[x][i]
+                if remaining_carbon <= 0:
+                    stop_condition = 1
+
+            if scenario == "PDC" and tracking["PDC"][i] - tracking["PDC"][i - 1] == 0 and max_rate == 1:
+                if verbose:
+                    print("Model solving no longer feasible: ", i)
+                break
+
+            # Biomass can run in reverse when glpk_exact is not enabled
+            if fluxes["biomass"] < 0.0:
+                if verbose:
+                    print(i)
+                    print("Biomass running in reverse")
+                # The PDC strain keeps going, since it can still convert aromatics without growing
+                if scenario != "PDC":
+                    break
+
+    if scenario == "PDC" and (i - 1) in out:
+        stationary_phase(tracking, out[i - 1], i, n, stop_condition, supplied, outfluxes, timepoint_interval)
+
+    if verbose:
+        print("Bound updates: ", bound_updates.total_stats(updaters))
+
+    run_metrics.add({"runs": 1, "steps": steps, "run_seconds": time.perf_counter() - started})
+    if cache is not None:
+        run_metrics.add(run_metrics.cache_counters(cache_before, cache.stats()))
+        cache.save_stats()
+        if verbose:
+            print("Solve cache: ", cache.stats())
+
+    return tracking
+
+# Reactions whose reduced costs are reported to dual_callback: every exchange the run tracks, and the aromatic transports the PDC strain is held to
+def dual_reactions(config):
+    reactions = ["EX_" + x for x in list(config["media_components"]) + all_substrates + list(config["enviro"])]
+    reactions += ["DM_" + x for x in config["outfluxes"]]
+    if config["scenario"] == "bioproduct":
+        reactions.append("DM_" + config["desired_product"])
+    if config["scenario"] == "PDC":
+        reactions += aromatic_transport_rxns
+    return list(dict.fromkeys(reactions))
+
+# There may come a point where the PDC model is no longer able to solve for the required aromatic fluxes, biomass, and the NGAM
+# However, we know from laboratory experiments that Novo will continue to consume aromatic and produce PDC even when it can no longer make biomass
+# To simulate this, once the model can no longer operate, we assume that fluxes continue as in the last solvable timepoint and that no further biomass is produced.
+# i is the step the dFBA loop stopped at, and last_fluxes the solution of the step before it
+def stationary_phase(tracking, last_fluxes, i, n, stop_condition, supplied, outfluxes, timepoint_interval):
+    for y in range(i, n):
+        for metabolite in tracking:
+            if stop_condition == 1:
+                break
+            if metabolite == "Time":
+                tracking["Time"].append(tracking["Time"][-1] + timepoint_interval)
+            elif metabolite == "Biomass":
+                tracking["Biomass"].append(tracking["Biomass"][-1])
+            elif metabolite in outfluxes:
+                tracking[metabolite].append(tracking[metabolite][y - 1] + last_fluxes["DM_" + metabolite] * tracking["Biomass"][y - 1] * timepoint_interval)
+            else:
+                tracking[metabolite].append(tracking[metabolite][y - 1] + last_fluxes["EX_" + metabolite] * tracking["Biomass"][y - 1] * timepoint_interval)
+            remaining_carbon = 0
+            for x in supplied:
+                remaining_carbon += tracking[x][y]
+            if remaining_carbon <= 0:
+                stop_condition = 1
+
+
+##############
+# Static FBA
+
+# Maximum uptake rates at the first timestep, the same ones simulate() sets before its first solve
+# Returns a dictionary of exchange reaction ID: rate, where the bounds are -rate to rate
+def initial_exchange_bounds(config):
+    biomass = config["starting_biomass"]
+    timepoint_interval = config["timepoint_interval"]
+    substrates = {x: 0.0 for x in all_substrates}
+    substrates.update(config["substrates"])
+    bounds = {}
+
+    for metabolite in list(config["media_components"].keys()) + list(substrates.keys()):
+        if metabolite in substrates:
+            concentration = substrates[metabolite]
+            r = 0.0 if concentration < 0.0000001 else uptake_rate(metabolite, concentration, config["kinetics"])
+        else:
+            concentration = config["media_components"][metabolite]
+            r = uptake_rate(metabolite, concentration, config["kinetics"], inhibition=False)
+        if concentration < r * biomass * timepoint_interval:
+            r = concentration / (biomass * timepoint_interval)
+        bounds["EX_" + metabolite] = r
+
+    for metabolite in config["enviro"]:
+        if config["enviro"][metabolite] <= 0.:
+            bounds["EX_" + metabolite] = 0.
+    return bounds
+
+# One (not loopless) FBA solve at the starting conditions of a run, with the same constraints the first dFBA step has
+# For the PDC scenario the aromatic transports of the strain are coupled to the wild type solution, as in simulate()
+# free_constraints is a list of constraint names (SA_flux, for example) whose bounds are opened for this solve only
+# Returns a dictionary of model key ("model" or "model2"): cobra Solution, the strain is only solved if the wild type is optimal
+def static_solutions(models, config, free_constraints=()):
+    scenario = config["scenario"]
+    Novo_model = models["model"]
+    Novo_model2 = models.get("model2")
+    active_models = [Novo_model] if Novo_model2 is None else [Novo_model, Novo_model2]
+    solutions = {}
+
+    # Constraint bounds aren't tracked by model contexts, so they're put back by hand
+    freed = [Novo_model.constraints[x] for x in free_constraints if x in Novo_model.constraints]
+    saved = [(x.lb, x.ub) for x in freed]
+    try:
+        with contextlib.ExitStack() as stack:
+            for model in active_models:
+                stack.enter_context(model)
+                reset_solver_basis(model)
+                model.solver.configuration.timeout = config.get("solver_timeout")
+            apply_gene_deletions(models, config.get("gene_deletions", []))
+            if scenario == "bioproduct":
+                set_OE_amount(models, config["OE_amount"])
+            for constraint in freed:
+                constraint.lb = None
+                constraint.ub = None
+
+            bounds = initial_exchange_bounds(config)
+            for model in active_models:
+                for rxn_ID in bounds:
+                    set_exchange_bounds(model, rxn_ID, -1 * bounds[rxn_ID], bounds[rxn_ID])
+
+            solutions["model"] = Novo_model.optimize()
+            if scenario == "PDC" and solutions["model"].status == "optimal":
+                for item in aromatic_transport_rxns:
+                    rxn = Novo_model2.reactions.get_by_id(item)
+                    rxn.upper_bound = 1.0
+                    rxn.lower_bound = solutions["model"].fluxes[item]
+                    rxn.upper_bound = solutions["model"].fluxes[item]
+                solutions["model2"] = Novo_model2.optimize()
+    finally:
+        for constraint, (lb, ub) in zip(freed, saved):
+            constraint.lb = None
+            constraint.ub = ub
+            constraint.lb = lb
+    return solutions
+
+# Same as static_solutions(), but returns only the Solution of the last model solved
+def static_solution(models, config):
+    solutions = static_solutions(models, config)
+    return solutions.get("model2", solutions["model"])
+
+
+##############
+# Biomass yield
+
+# Medium of calculate_biomass_yield.py, which has less ammonia than the dFBA scripts
+yield_media_components = {"exC14818": 45.54, "exC00014": 1.0, "exC00009": 26.1, "exC00059": 8.}
+
+# Biomass yield in mgDW/mmol of carbon from one optimization, as in calculate_biomass_yield.py
+# models come from get_models(model_path, "yield"), substrates is a dictionary of compound ID: concentration (the script uses 1 mmol/L)
+# Uptake rates are the kinetic rates at those concentrations divided by 1000, as in the script
+# Returns the yield and the loopless fluxes
+def biomass_yield(models, substrates, kinetics=default_kinetics, media_components=yield_media_components):
+    model = models["model"]
+    concentrations = dict(media_components)
+    concentrations.update({x: 0.0 for x in all_substrates})
+    concentrations.update(substrates)
+    with model:
+        reset_solver_basis(model)
+        for metabolite in concentrations:
+            r = uptake_rate(metabolite, concentrations[metabolite], kinetics, inhibition = metabolite in all_substrates) / 1000
+            set_exchange_bounds(model, "EX_" + metabolite, -1 * r, 1 * r)
+        fluxes = loopless_solution(model).fluxes
+
+    carbon_flux = 0
+    for x in all_substrates:
+        carbon_flux = carbon_flux + fluxes["EX_" + x]
+    return fluxes["biomass"] / (carbon_flux) * -1000, fluxes
+
+
+##############
+# Pre-screen
+
+# Runs whose starting conditions are infeasible, or that can't grow, are dead ends that otherwise only show up after a full dFBA run
+# Which outcomes to skip in batch runs, by scenario
+# The PDC strain keeps converting aromatics without growing (see the stationary phase in simulate()), so no growth is still worth running there
+prescreen_skip = {"cometabolism": ["infeasible", "no growth"],
+                  "PDC": ["infeasible"],
+                  "bioproduct": ["infeasible", "no growth"]}
+
+# glpk_exact can stall on a single solve near the edge of feasibility, so the pre-screen gets a time limit (seconds) if the config has none
+prescreen_timeout = 30
+
+# Classify a run as "infeasible", "no growth", or "viable" from one static FBA at its starting conditions
+# Returns (status, reason)
+def prescreen(models, config, growth_threshold=1e-9):
+    if config.get("solver_timeout") is None:
+        config = dict(config)
+        config["solver_timeout"] = prescreen_timeout
+    solutions = static_solutions(models, config)
+    if solutions["model"].status != "optimal":
+        return "infeasible", _infeasible_reason(models, config, solutions["model"].status)
+    if "model2" in solutions and solutions["model2"].status != "optimal":
+        return "infeasible", "PDC strain can't carry the aromatic transport fluxes of the wild type (solver status " + solutions["model2"].status + ")"
+
+    growth = solutions.get("model2", solutions["model"]).fluxes["biomass"]
+    if growth <= growth_threshold:
+        bounds = initial_exchange_bounds(config)
+        if all(bounds["EX_" + x] == 0 for x in config["substrates"]):
+            return "no growth", "no substrate available at the start"
+        return "no growth", "biomass flux " + str(growth)
+    return "viable", "biomass flux " + str(growth)
+
+# Find which of the usual suspects makes the starting conditions infeasible by relaxing them one at a time
+def _infeasible_reason(models, config, status):
+    if status == "time_limit":
+        return "solver timed out"
+    bounds = initial_exchange_bounds(config)
+    if all(bounds["EX_" + x] == 0 for x in config["substrates"]):
+        return "no substrate available at the start"
+    if "SA_flux" in models["model"].constraints:
+        if static_solutions(models, config, free_constraints = ["SA_flux"])["model"].status == "optimal":
+            return "SA_flux constraint (S compounds can't be consumed in the required proportion)"
+    if config["scenario"] == "bioproduct" and config["OE_amount"] != 0:
+        relaxed = dict(config)
+        relaxed["OE_amount"] = 0.0
+        if static_solutions(models, relaxed)["model"].status == "optimal":
+            return "OE_amount too high"
+    if len(config.get("gene_deletions", [])) > 0:
+        relaxed = dict(config)
+        relaxed["gene_deletions"] = []
+        if static_solutions(models, relaxed)["model"].status == "optimal":
+            return "gene deletions"
+    return "solver status " + status
+
+def should_simulate(status, config):
+    return status not in prescreen_skip[config["scenario"]]
+
+# Summary of a run that was skipped by the pre-screen, with the same keys summarize() would give and no values
+def skipped_summary(config):
+    keys = ["time_to_depletion", "final_biomass", "max_biomass"]
+    if config["scenario"] in ("PDC", "bioproduct"):
+        keys = keys + ["max_product", "time_of_halted_production", "mmol_L_hr", "g_L_hr"]
+    return {x: float("nan") for x in keys}
+
+
+##############
+# Output
+
+def tracking_to_dataframe(tracking):
+    return pandas.DataFrame.from_dict(tracking, orient = "index").transpose()
+
+# Run one simulation straight from a model file, for using the scenarios as library functions
+# Settings are the same keywords as make_config(). Returns the results dataframe (the table the scripts write) and the summary metrics
+def run_scenario(model_path, scenario, substrates, verbose=False, **settings):
+    config = make_config(scenario, substrates, **settings)
+    models = get_models(model_path, scenario, config.get("desired_product"))
+    tracking = simulate(models, config, verbose)
+    return tracking_to_dataframe(tracking), summarize(tracking, config)
+
+# Summary metrics for a finished run
+# Production rates are calculated the same way as the printouts at the end of PDC_dFBA.py and bioproduct_dFBA.py
+def summarize(tracking, config):
+    df = tracking_to_dataframe(tracking)
+    timepoint_interval = config["timepoint_interval"]
+    summary = {}
+
+    remaining_carbon = df[list(config["substrates"].keys())].sum(axis = 1, min_count = 1)
+    depleted = remaining_carbon[remaining_carbon <= 0]
+    summary["time_to_depletion"] = df["Time"][depleted.index[0]] if len(depleted) > 0 else float("nan")
+    summary["final_biomass"] = df["Biomass"].dropna().iloc[-1]
+    summary["max_biomass"] = df["Biomass"].max()
+
+    if config["scenario"] == "PDC":
+        product = "PDC"
+        molecular_weight = PDC_molecular_weight
+    elif config["scenario"] == "bioproduct":
+        product = config["desired_product"]
+        molecular_weight = molecular_weights.get(product, float("nan"))
+    else:
+        return summary
+
+    product_values = df[product]
+    max_product = product_values.max()
+    max_time_minutes = (product_values.idxmax() + 1) * timepoint_interval
+    product_rate = max_product / (max_time_minutes / 60)
+    summary["max_product"] = max_product
+    summary["time_of_halted_production"] = max_time_minutes
+    summary["mmol_L_hr"] = product_rate
+    summary["g_L_hr"] = product_rate * molecular_weight / 1000
+    return summary
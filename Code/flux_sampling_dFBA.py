@@ -0,0 +1,281 @@
+###################
+# flux_sampling_dFBA.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script samples the fluxes a model allows near its optimum, at chosen dFBA timepoints or at the bounds at the start of a run
+# A single loopless optimum, or an FVA range, doesn't show which routes are used together, e.g. S-type versus G-type demethylation in the vanAB and
+# hypothetical demethylation variants; a uniform sample of the optimal fluxes does
+# Sampling is hit-and-run (cobra's ACHR sampler), with several independent chains per timepoint run in parallel processes
+# Each chain streams its samples to its own binary file as it goes, and the statistics are computed from the files a chunk at a time
+###################
+
+# Import packages
+import sys
+import os
+import json
+import multiprocessing
+import numpy
+import pandas
+from cobra.sampling import ACHRSampler
+from cobra.flux_analysis.loopless import loopless_solution
+import dFBA_engine
+import flux_variability_dFBA
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes
+chains = 4						# independent chains per timepoint and model
+samples = 1000					# samples kept per chain
+thinning = 100					# hit-and-run steps between kept samples
+batch = 100						# samples per write to a chain's file
+fraction_of_optimum = 0.99		# biomass is held at or above this fraction of its optimum (use 0 to sample every feasible flux)
+remove_loops = False			# remove loops from each sample with cobra's loopless_solution (one more LP per sample)
+seed = 2022						# chains get their seeds from this, the timepoint, and the model
+hold_tolerance = 1e-9			# relative, see run_chain
+bins = 1000						# histogram bins per reaction for the medians and percentiles
+output_path = "sampling_"		# prefix for the output folders and files
+
+# Usage:
+# > python flux_sampling_dFBA.py <timepoints> <scenario> <arguments of the scenario's script>
+# timepoints is as in flux_variability_dFBA.py (83,84 or every:k), or start to sample the bounds at the start of a run without running dFBA
+# For example:
+# > python flux_sampling_dFBA.py 40,80 cometabolism iNovo_vanAB_2022.xml exVA
+# > python flux_sampling_dFBA.py start cometabolism iNovo_hypo_demeth_2022.xml exVA exSA
+# To recompute the statistics of a folder of samples:
+# > python flux_sampling_dFBA.py stats sampling_t40_model
+#
+# Each timepoint and model gets a folder, <output_path>t<timepoint>_<model>, with:
+#	header.json - the reactions (columns), the data type, and the settings of the run
+#	chain_<k>.bin - the samples of one chain: rows of float32 fluxes (mmol/gDW/min) in the order of the header's reactions, with no header of its own
+#		numpy.memmap(path, dtype = "<f4", mode = "r").reshape(-1, len(reactions)) reads it without loading it
+#	stats.csv - one row per reaction: mean, sd, min, p2.5, median, p97.5, max (percentiles from a histogram with the bins above),
+#		active (fraction of samples with flux), forward (fraction of samples with positive flux), r_hat, and ess
+# Convergence: r_hat is the split R-hat of Gelman and Rubin over the chains (near 1 once the chains agree, above 1.1 is usually too soon),
+# and ess is the effective sample size of all chains together, from batch means. Reactions whose flux is fixed get NaN for both
+# Samples are of the polytope, so they can contain loops unless remove_loops is on; loop-free samples are no longer uniform
+
+
+##############
+# Workers
+
+_worker = {}
+
+def init_worker(model_path, config):
+    _worker["models"] = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    _worker["config"] = config
+
+# One chain: sets the model to the bounds it had at a step, then streams samples to the chain's file
+# Returns the timepoint, model key, chain, and samples written
+def run_chain(task):
+    i, key, bounds, folder, chain, chain_seed = task
+    models = _worker["models"]
+    model = models[key]
+    config = _worker["config"]
+    path = os.path.join(folder, "chain_" + str(chain) + ".bin")
+    written = 0
+    with model:
+        dFBA_engine.reset_solver_basis(model)
+        model.solver.configuration.timeout = config.get("solver_timeout")
+        for rxn_ID in bounds:
+            rxn = model.reactions.get_by_id(rxn_ID)
+            if rxn.bounds != bounds[rxn_ID]:
+                rxn.bounds = bounds[rxn_ID]
+        if config["scenario"] == "bioproduct":
+            dFBA_engine.set_OE_amount(models, config["OE_amount"])
+        # The sampler works on a copy of the model, whose bounds are rounded to 15 digits; with the exact solver that can make fluxes held
+        # to one value (the PDC strain's aromatic transports) infeasible, so those are held within hold_tolerance instead
+        for rxn in model.reactions:
+            if rxn.lower_bound == rxn.upper_bound and rxn.lower_bound != 0:
+                rxn.bounds = (rxn.lower_bound - abs(rxn.lower_bound) * hold_tolerance, rxn.upper_bound + abs(rxn.upper_bound) * hold_tolerance)
+        growth = model.slim_optimize(error_value = 0.0)
+        if fraction_of_optimum > 0 and growth > 0:
+            model.reactions.get_by_id("biomass").lower_bound = fraction_of_optimum * growth
+
+        sampler = ACHRSampler(model, thinning = thinning, seed = int(chain_seed))
+        with open(path, "wb") as f:
+            while written < samples:
+                fluxes = sampler.sample(min(batch, samples - written))
+                if remove_loops:
+                    fluxes = pandas.DataFrame([loopless_solution(model, fluxes = row).fluxes for index, row in fluxes.iterrows()])
+                f.write(fluxes.to_numpy(dtype = "<f4").tobytes())
+                f.flush()
+                written += len(fluxes)
+    return i, key, chain, written
+
+
+##############
+# Run
+
+def folder_name(i, key):
+    return output_path + "t" + str(i) + "_" + key
+
+def write_header(folder, i, key, reactions, growth):
+    os.makedirs(folder, exist_ok = True)
+    header = {"reactions": reactions, "dtype": "<f4", "timepoint": i, "model": key, "chains": chains, "samples": samples, "thinning": thinning,
+              "fraction_of_optimum": fraction_of_optimum, "growth": growth, "remove_loops": remove_loops, "seed": seed}
+    with open(os.path.join(folder, "header.json"), "w") as f:
+        json.dump(header, f, indent = 1)
+
+# One task per chain, with seeds that depend only on the timepoint and model, so results don't depend on which worker runs a chain
+def chain_tasks(i, key, model, folder):
+    bounds = {r.id: r.bounds for r in model.reactions}
+    seeds = numpy.random.SeedSequence([seed, max(i, 0), ["model", "model2"].index(key)]).generate_state(chains)
+    return [(i, key, bounds, folder, chain, seeds[chain]) for chain in range(chains)]
+
+# The bounds of the first step of a run (as in dFBA_engine.static_solutions), for sampling without running dFBA
+# Calls record(0, key, fluxes) while each model has them; the PDC strain's aromatic transports are held to the wild type's optimum
+def start_bounds(models, config, record):
+    active = [x for x in ("model", "model2") if x in models]
+    bounds = dFBA_engine.initial_exchange_bounds(config)
+    with models["model"]:
+        dFBA_engine.apply_gene_deletions(models, config.get("gene_deletions", []))
+        for rxn_ID in bounds:
+            dFBA_engine.set_exchange_bounds(models["model"], rxn_ID, -1 * bounds[rxn_ID], bounds[rxn_ID])
+        record(0, "model", None)
+        fluxes = models["model"].optimize().fluxes
+    if "model2" in active:
+        with models["model2"]:
+            for rxn_ID in bounds:
+                dFBA_engine.set_exchange_bounds(models["model2"], rxn_ID, -1 * bounds[rxn_ID], bounds[rxn_ID])
+            for rxn_ID in dFBA_engine.aromatic_transport_rxns:
+                models["model2"].reactions.get_by_id(rxn_ID).bounds = (fluxes[rxn_ID], fluxes[rxn_ID])
+            record(0, "model2", None)
+
+# Samples at the chosen timepoints; timepoints is as in flux_variability_dFBA.py, or "start"
+# Returns the tracking dictionary (None for "start") and the list of sample folders
+# As in flux_variability_dFBA.run(), the bounds are read from the full models, so compress isn't allowed
+def run(model_path, config, timepoints, processes = processes):
+    if config.get("compress"):
+        raise ValueError("Sampling needs the full model's bounds at each step, run it without compress")
+    models = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    folders = []
+    pending = []
+
+    with multiprocessing.Pool(processes, initializer = init_worker, initargs = (model_path, config)) as pool:
+        # Called after every solve, while the model still has the bounds of this step
+        def record(i, key, step_fluxes):
+            if timepoints == "start" or flux_variability_dFBA.selected(i, timepoints):
+                model = models[key]
+                folder = folder_name(i, key)
+                write_header(folder, i, key, [r.id for r in model.reactions], step_fluxes["biomass"] if step_fluxes is not None else None)
+                folders.append(folder)
+                for task in chain_tasks(i, key, model, folder):
+                    pending.append(pool.apply_async(run_chain, (task,)))
+
+        if timepoints == "start":
+            tracking = None
+            start_bounds(models, config, record)
+        else:
+            tracking = dFBA_engine.simulate(models, config, flux_callback = record)
+            print("dFBA finished, waiting for ", len(pending), " sampling chains")
+        for job in pending:
+            i, key, chain, written = job.get()
+            print("Finished chain ", chain, " of ", key, " at ", i, ": ", written, " samples")
+    return tracking, folders
+
+
+##############
+# Statistics
+
+def read_header(folder):
+    with open(os.path.join(folder, "header.json")) as f:
+        return json.load(f)
+
+# The samples of one chain, as a read-only array on the file (samples x reactions); only the rows used are read
+def chain_samples(folder, chain, header = None):
+    header = header if header is not None else read_header(folder)
+    path = os.path.join(folder, "chain_" + str(chain) + ".bin")
+    if os.path.getsize(path) == 0:
+        return numpy.zeros((0, len(header["reactions"])), dtype = header["dtype"])
+    return numpy.memmap(path, dtype = header["dtype"], mode = "r").reshape(-1, len(header["reactions"]))
+
+# Per-reaction statistics and convergence diagnostics of a sample folder, reading each chain a batch of rows at a time
+# Each chain is split in half for R-hat, and each half into batches of about sqrt(length) samples for the batch means of the effective sample size
+def sample_stats(folder, tolerance = 1e-9):
+    header = read_header(folder)
+    arrays = [chain_samples(folder, k, header) for k in range(header["chains"])]
+    m = min(len(x) for x in arrays) // 2
+    if m < 2:
+        raise ValueError("Too few samples in " + folder + " for statistics")
+    size = max(1, int(numpy.sqrt(m)))
+    R = len(header["reactions"])
+
+    # First pass: sums of each half-chain, batch means, extremes, and how often each reaction carries flux
+    means = []
+    variances = []
+    batch_variances = []
+    low = numpy.full(R, numpy.inf)
+    high = numpy.full(R, -numpy.inf)
+    active = numpy.zeros(R)
+    forward = numpy.zeros(R)
+    for X in arrays:
+        for start in (0, m):
+            total = numpy.zeros(R)
+            squares = numpy.zeros(R)
+            batch_means = []
+            for first in range(start, start + m, size):
+                chunk = numpy.asarray(X[first:min(first + size, start + m)], dtype = float)
+                total += chunk.sum(axis = 0)
+                squares += (chunk ** 2).sum(axis = 0)
+                low = numpy.minimum(low, chunk.min(axis = 0))
+                high = numpy.maximum(high, chunk.max(axis = 0))
+                active += (numpy.abs(chunk) > tolerance).sum(axis = 0)
+                forward += (chunk > tolerance).sum(axis = 0)
+                if len(chunk) == size:
+                    batch_means.append(chunk.mean(axis = 0))
+            mean = total / m
+            means.append(mean)
+            variances.append(numpy.maximum(squares - m * mean ** 2, 0) / (m - 1))
+            batch_variances.append(numpy.var(batch_means, axis = 0, ddof = 1) if len(batch_means) > 1 else numpy.full(R, numpy.nan))
+    means = numpy.array(means)
+    N = m * len(means)
+
+    W = numpy.mean(variances, axis = 0)
+    B = m * numpy.var(means, axis = 0, ddof = 1)
+    fixed = high - low <= tolerance
+    with numpy.errstate(divide = "ignore", invalid = "ignore"):
+        r_hat = numpy.sqrt(((m - 1) / m * W + B / m) / W)
+        ess = N * W / (size * numpy.mean(batch_variances, axis = 0))
+    r_hat[fixed] = numpy.nan
+    ess[fixed] = numpy.nan
+
+    # Second pass: a histogram of each reaction between its extremes, for the percentiles
+    width = numpy.where(fixed, 1.0, high - low)
+    counts = numpy.zeros(R * bins)
+    offsets = numpy.arange(R) * bins
+    for X in arrays:
+        for start in (0, m):
+            for first in range(start, start + m, size * 10):
+                chunk = numpy.asarray(X[first:min(first + size * 10, start + m)], dtype = float)
+                index = numpy.clip(((chunk - low) / width * bins).astype(int), 0, bins - 1)
+                numpy.add.at(counts, (index + offsets).ravel(), 1)
+    cumulative = numpy.cumsum(counts.reshape(R, bins), axis = 1)
+
+    def percentile(q):
+        found = numpy.argmax(cumulative >= q * N, axis = 1)
+        return numpy.where(fixed, low, low + (found + 0.5) / bins * width)
+
+    return pandas.DataFrame({"reaction": header["reactions"], "mean": means.mean(axis = 0), "sd": numpy.sqrt(((N - len(means)) * W + (len(means) - 1) * B) / (N - 1)),
+                             "min": low, "p2.5": percentile(0.025), "median": percentile(0.5), "p97.5": percentile(0.975), "max": high,
+                             "active": active / N, "forward": forward / N, "r_hat": r_hat, "ess": ess})
+
+def print_diagnostics(folder, stats):
+    varied = stats.dropna(subset = ["r_hat"])
+    print(folder, ": ", len(varied), " of ", len(stats), " reactions vary;  max R-hat ", round(varied["r_hat"].max(), 3),
+          ", reactions with R-hat above 1.1: ", int((varied["r_hat"] > 1.1).sum()), ", min ESS ", round(varied["ess"].min(), 1))
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "stats":
+        folders = sys.argv[2:]
+    else:
+        timepoints = "start" if sys.argv[1] == "start" else flux_variability_dFBA.parse_timepoints(sys.argv[1])
+        model_path, config = dFBA_engine.config_from_args(sys.argv[2], sys.argv[3:])
+        tracking, folders = run(model_path, config, timepoints)
+        if tracking is not None:
+            dFBA_engine.tracking_to_dataframe(tracking).to_csv(output_path + "dFBA_results.csv")
+
+    for folder in folders:
+        stats = sample_stats(folder)
+        stats.to_csv(os.path.join(folder, "stats.csv"), index = False)
+        print_diagnostics(folder, stats)
@@ -0,0 +1,132 @@
+###################
+# flux_variability_dFBA.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script runs one dFBA simulation and, at chosen timepoints, flux variability analysis (FVA) of the model at that step
+# It replaces uncommenting the "if i == 84 or i == 83: ... to_csv" lines in the dFBA scripts, which only save one of many possible optimal flux vectors
+# Its output is the usual dFBA results table plus a flux trajectory table with every reaction's flux at every step and its FVA range where one was run
+###################
+
+# Import packages
+import sys
+import os
+import multiprocessing
+import pandas
+from cobra.flux_analysis import flux_variability_analysis
+import dFBA_engine
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of FVA worker processes
+fraction_of_optimum = 1.0		# FVA keeps the objective at this fraction of its optimum (1.0 = only alternative optimal solutions)
+output_path = "FVA_"			# prefix for the output files
+
+# Usage:
+# > python flux_variability_dFBA.py <timepoints> <scenario> <arguments of the scenario's script>
+# timepoints is a comma-separated list of steps (83,84), or every:k for every k-th step
+# For example:
+# > python flux_variability_dFBA.py 83,84 PDC iNovo_base_2022.xml exVA 3.0 exC00031 2.0
+# > python flux_variability_dFBA.py every:50 cometabolism iNovo_base_2022.xml exVA
+#
+# FVA over all reactions is two LPs per reaction, so it's run in a pool of worker processes while the simulation keeps going
+# At each chosen step the bounds of every reaction are copied and sent to the workers, split into one job per worker
+# The dFBA run always solves the full model (compress in the config is an error), since those are the bounds that are copied
+# For the PDC scenario both the wild type model and the PDC strain are analyzed (model and model2 in the output)
+
+
+##############
+# Workers
+
+_worker = {}
+
+def init_worker(model_path, config):
+    _worker["models"] = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    _worker["config"] = config
+
+# FVA on one model with the bounds it had at a dFBA step
+def run_FVA(task):
+    i, key, bounds, reactions = task
+    models = _worker["models"]
+    model = models[key]
+    with model:
+        dFBA_engine.reset_solver_basis(model)
+        model.solver.configuration.timeout = _worker["config"].get("solver_timeout")
+        for rxn_ID in bounds:
+            rxn = model.reactions.get_by_id(rxn_ID)
+            if rxn.bounds != bounds[rxn_ID]:
+                rxn.bounds = bounds[rxn_ID]
+        if _worker["config"]["scenario"] == "bioproduct":
+            dFBA_engine.set_OE_amount(models, _worker["config"]["OE_amount"])
+        result = flux_variability_analysis(model, reaction_list = reactions, fraction_of_optimum = fraction_of_optimum, processes = 1)
+    return i, key, result
+
+
+##############
+# Run
+
+# timepoints is a list of steps, or ("every", k)
+def selected(i, timepoints):
+    if isinstance(timepoints, tuple):
+        return i % timepoints[1] == 0
+    return i in timepoints
+
+def parse_timepoints(text):
+    if text.startswith("every:"):
+        return ("every", int(text.split(":")[1]))
+    return [int(x) for x in text.split(",") if x != ""]
+
+# Returns the tracking dictionary and the flux trajectory dataframe (timepoint, model, reaction, flux, minimum, maximum)
+# The bounds sent to the workers are read from the full models, which a compressed run (see dFBA_engine.simulate) never changes, so compress isn't allowed
+def run(model_path, config, timepoints, processes = processes):
+    if config.get("compress"):
+        raise ValueError("FVA needs the full model's bounds at each step, run it without compress")
+    models = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    fluxes = {}
+    pending = []
+
+    with multiprocessing.Pool(processes, initializer = init_worker, initargs = (model_path, config)) as pool:
+        # Called after every solve, while the model still has the bounds of this step
+        def record(i, key, step_fluxes):
+            fluxes[(i, key)] = step_fluxes
+            if selected(i, timepoints):
+                model = models[key]
+                bounds = {r.id: r.bounds for r in model.reactions}
+                reactions = [r.id for r in model.reactions]
+                chunk = -(-len(reactions) // processes)
+                for start in range(0, len(reactions), chunk):
+                    pending.append(pool.apply_async(run_FVA, ((i, key, bounds, reactions[start:start + chunk]),)))
+
+        tracking = dFBA_engine.simulate(models, config, flux_callback = record)
+        print("dFBA finished, waiting for ", len(pending), " FVA jobs")
+        ranges = {}
+        for job in pending:
+            i, key, result = job.get()
+            ranges.setdefault((i, key), []).append(result)
+
+    frames = []
+    for (i, key) in sorted(fluxes):
+        df = pandas.DataFrame({"flux": fluxes[(i, key)]})
+        if (i, key) in ranges:
+            df = df.join(pandas.concat(ranges[(i, key)]))
+        else:
+            df["minimum"] = float("nan")
+            df["maximum"] = float("nan")
+        df.index.name = "reaction"
+        df = df.reset_index()
+        df.insert(0, "model", key)
+        df.insert(0, "timepoint", i)
+        frames.append(df)
+    return tracking, pandas.concat(frames, ignore_index = True)
+
+
+if __name__ == "__main__":
+    timepoints = parse_timepoints(sys.argv[1])
+    model_path, config = dFBA_engine.config_from_args(sys.argv[2], sys.argv[3:])
+
+    tracking, trajectory = run(model_path, config, timepoints)
+    dFBA_engine.tracking_to_dataframe(tracking).to_csv(output_path + "dFBA_results.csv")
+    trajectory.to_csv(output_path + "flux_trajectory.csv", index = False)
+
+    analyzed = trajectory.dropna(subset = ["minimum"])
+    print("Timepoints analyzed: ", sorted(set(analyzed["timepoint"])))
+    print("Reactions with alternative optimal fluxes: ", len(analyzed[(analyzed["maximum"] - analyzed["minimum"]).abs() > 1e-9]))
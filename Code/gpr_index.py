@@ -0,0 +1,141 @@
+###################
+# gpr_index.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This file compiles the gene-reaction rules of a model into boolean matrices, so the reactions disabled by any set of gene knockouts can be found without touching the model
+# gene.knock_out() in COBRApy re-evaluates the rules one gene at a time and changes the model, which then has to be restored
+# Here every rule is rewritten as an OR of enzyme complexes (genes joined by AND), giving a gene x complex and a complex x reaction incidence table
+# A complex is broken if any of its genes is knocked out, and a reaction is disabled if all of its complexes are broken
+###################
+
+# Import packages
+import re
+import numpy
+import pandas
+
+###############
+# Rule parsing
+# Rules are written like the genes column of the reaction input files, e.g. "SARO_RS14300 and SARO_RS14275 or Saro_1233"
+# and binds tighter than or, as in COBRApy. Every other word (including placeholders like spontaneous) is treated as a gene ID, also as in COBRApy
+
+def _tokenize(rule):
+    return re.findall(r"\(|\)|[^\s()]+", rule)
+
+# Returns the rule as a list of complexes, each a frozenset of gene IDs
+def rule_to_complexes(rule):
+    if rule is None or (isinstance(rule, float) and numpy.isnan(rule)):
+        return []
+    tokens = _tokenize(str(rule))
+    if len(tokens) == 0:
+        return []
+    position = [0]
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else None
+
+    def expression():
+        complexes = term()
+        while peek() is not None and peek().lower() == "or":
+            position[0] += 1
+            complexes = complexes + term()
+        return complexes
+
+    def term():
+        complexes = factor()
+        while peek() is not None and peek().lower() == "and":
+            position[0] += 1
+            right = factor()
+            complexes = [a | b for a in complexes for b in right]
+        return complexes
+
+    def factor():
+        token = peek()
+        if token is None:
+            raise ValueError("Unexpected end of gene rule: " + str(rule))
+        position[0] += 1
+        if token == "(":
+            complexes = expression()
+            if peek() != ")":
+                raise ValueError("Unbalanced parentheses in gene rule: " + str(rule))
+            position[0] += 1
+            return complexes
+        if token == ")" or token.lower() in ("and", "or"):
+            raise ValueError("Unexpected " + token + " in gene rule: " + str(rule))
+        return [frozenset([token])]
+
+    complexes = expression()
+    if position[0] != len(tokens):
+        raise ValueError("Could not read gene rule: " + str(rule))
+
+    # A complex that contains another one adds nothing (a or (a and b) is just a)
+    complexes = set(complexes)
+    return [c for c in complexes if not any(other < c for other in complexes)]
+
+
+##############
+# Index
+
+class GPRIndex:
+    # rules is a dictionary of reaction ID: gene rule. Reactions with no rule can never be disabled
+    def __init__(self, rules):
+        complexes_by_reaction = {rxn: rule_to_complexes(rules[rxn]) for rxn in rules}
+        self.reactions = list(rules.keys())
+        self.genes = sorted(set(g for rxn in complexes_by_reaction for c in complexes_by_reaction[rxn] for g in c))
+        self.complexes = sorted(set(c for rxn in complexes_by_reaction for c in complexes_by_reaction[rxn]), key = lambda x: sorted(x))
+        self.gene_position = {g: i for i, g in enumerate(self.genes)}
+        complex_position = {c: i for i, c in enumerate(self.complexes)}
+
+        # float32 so the products below go through BLAS
+        self.gene_complex = numpy.zeros((len(self.genes), len(self.complexes)), dtype = numpy.float32)
+        for j, c in enumerate(self.complexes):
+            for g in c:
+                self.gene_complex[self.gene_position[g], j] = 1
+        self.complex_reaction = numpy.zeros((len(self.complexes), len(self.reactions)), dtype = numpy.float32)
+        for k, rxn in enumerate(self.reactions):
+            for c in complexes_by_reaction[rxn]:
+                self.complex_reaction[complex_position[c], k] = 1
+        self.has_rule = self.complex_reaction.sum(axis = 0) > 0
+
+        # Reactions each gene takes part in, for finding genes that share reactions
+        self.gene_reactions = {g: set() for g in self.genes}
+        for k, rxn in enumerate(self.reactions):
+            for c in complexes_by_reaction[rxn]:
+                for g in c:
+                    self.gene_reactions[g].add(rxn)
+
+    @classmethod
+    def from_model(cls, model):
+        return cls({r.id: r.gene_reaction_rule for r in model.reactions})
+
+    # Reads the genes column of a reaction input file like the ones in Model_builds/Input_files/
+    @classmethod
+    def from_reaction_file(cls, rxn_path):
+        reactions = pandas.read_csv(rxn_path, sep = "\t", header = None)
+        reactions.columns = ["rxnID", "reversibility", "cpds", "names", "genes", "sbo"]
+        return cls({row["rxnID"].strip(): row["genes"] for index, row in reactions.iterrows()})
+
+    # Boolean matrix with one row per gene set and a column per gene
+    def knockout_matrix(self, gene_sets):
+        knockouts = numpy.zeros((len(gene_sets), len(self.genes)), dtype = numpy.float32)
+        for i, genes in enumerate(gene_sets):
+            for g in genes:
+                if g not in self.gene_position:
+                    raise KeyError(g)
+                knockouts[i, self.gene_position[g]] = 1
+        return knockouts
+
+    # Boolean matrix with one row per gene set and a column per reaction, True where the reaction is disabled
+    # Gene sets are processed in chunks so long lists of pairs don't build huge intermediate matrices
+    def disabled_matrix(self, gene_sets, chunk_size = 4096):
+        disabled = numpy.zeros((len(gene_sets), len(self.reactions)), dtype = bool)
+        for start in range(0, len(gene_sets), chunk_size):
+            knockouts = self.knockout_matrix(gene_sets[start:start + chunk_size])
+            broken = (knockouts @ self.gene_complex) > 0
+            working = (~broken).astype(numpy.float32) @ self.complex_reaction
+            disabled[start:start + chunk_size] = (working == 0) & self.has_rule
+        return disabled
+
+    # List of frozensets of the reactions disabled by each gene set
+    def disabled(self, gene_sets):
+        reactions = numpy.array(self.reactions, dtype = object)
+        return [frozenset(reactions[row]) for row in self.disabled_matrix(gene_sets)]
@@ -0,0 +1,391 @@
+###################
+# inovo.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script is a single command line entry point for building the model and running its simulations
+# The stand-alone scripts keep their settings at the top of the file and run everything on import, so each change means editing a file
+# Here every setting is a typed option, and cobra, pandas, and the models are only imported once a subcommand needs them, so --help and bad arguments return right away
+# Installed with pip (see Run_instructions.md), it's available as the inovo command; otherwise run it as python inovo.py
+###################
+
+# Import packages
+import sys
+import os
+import argparse
+
+# Usage:
+# > inovo build <compounds file> <reactions file> <output model path> [--compare <reactions file> ...]
+# > inovo yield <model> <substrate> [<substrate> ...]
+# > inovo cometab <model> <substrate> [<substrate> ...]
+# > inovo pdc <model> <substrate 1> <concentration 1> <substrate 2> <concentration 2>
+# > inovo bioproduct <model> <product> <OE amount>
+# > inovo sweep <scenario> <model> --substrate exVA=3 --grid exC00031=0.5,1,2,4
+# > inovo sweep <scenario> <model> --substrate exVA=3 --grid exC00031=0.5,1,2,4 --metrics sweep_metrics.prom
+# > inovo sweep <scenario> <model> --substrate exVA=3 --grid exC00031=0.5,1,2,4 --queue <shared folder> [--submit-only]
+# > inovo worker <shared folder>
+# > inovo queue <shared folder> [--merge <output csv>] [--metrics <metrics file>]
+# > inovo <subcommand> --help
+# The positional arguments are the same as the matching script's, the options change what the scripts have in their EDIT THIS SECTION
+# The simulations themselves are library functions in dFBA_engine.py (run_scenario, biomass_yield, simulate)
+
+build_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Model_builds", "build_iNovo.py")
+scenario_names = {"cometab": "cometabolism", "pdc": "PDC", "bioproduct": "bioproduct"}
+
+
+##############
+# Argument types
+
+# For times and amounts the engine divides by or steps through, where 0 would stall the run
+def positive_float(text):
+    value = float(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("must be more than 0: " + text)
+    return value
+
+# For concentrations, kinetic parameters, and OE amounts, where 0 is a valid setting
+def non_negative_float(text):
+    value = float(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError("must not be negative: " + text)
+    return value
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1: " + text)
+    return value
+
+# ID=number, for substrate concentrations
+def concentration(text):
+    if "=" not in text:
+        raise argparse.ArgumentTypeError("use compound ID=mmol/L, e.g. exVA=3.0: " + text)
+    cpd_ID, value = text.split("=", 1)
+    return cpd_ID, non_negative_float(value)
+
+# CLASS=Vm,Ks,Ki, for kinetic parameters
+def kinetic_parameters(text):
+    if "=" not in text or len(text.split("=", 1)[1].split(",")) != 3:
+        raise argparse.ArgumentTypeError("use class=Vm,Ks,Ki, e.g. G=0.569,0.1,0.1: " + text)
+    name, values = text.split("=", 1)
+    return name, [non_negative_float(x) for x in values.split(",")]
+
+# NAME=v1,v2,... or NAME=start:stop:step, for sweep grids. NAME is a compound ID or OE_amount
+def grid_values(text):
+    if "=" not in text:
+        raise argparse.ArgumentTypeError("use name=v1,v2,... or name=start:stop:step: " + text)
+    name, values = text.split("=", 1)
+    if ":" in values:
+        parts = values.split(":")
+        if len(parts) != 3:
+            raise argparse.ArgumentTypeError("a range is start:stop:step: " + text)
+        start, stop, step = [float(x) for x in parts]
+        if step <= 0:
+            raise argparse.ArgumentTypeError("the step must be positive: " + text)
+        count = int(round((stop - start) / step)) + 1
+        return name, [round(start + i * step, 12) for i in range(count)]
+    return name, [float(x) for x in values.split(",") if x != ""]
+
+def add_run_options(parser, output):
+    parser.add_argument("--n", type = positive_int, help = "number of timesteps (default: the script's)")
+    parser.add_argument("--timepoint-interval", type = positive_float, help = "minutes between timepoints (default 30)")
+    parser.add_argument("--starting-biomass", type = positive_float, help = "in g/L (default 0.001)")
+    parser.add_argument("--gene-deletion", action = "append", default = [], metavar = "GENE", help = "gene to knock out, can be given more than once")
+    parser.add_argument("--kinetics", action = "append", type = kinetic_parameters, default = [], metavar = "CLASS=Vm,Ks,Ki", help = "kinetic parameters for a substrate class (glucose, S, H, G) or mineral exchange ID")
+    parser.add_argument("--solver-timeout", type = positive_float, help = "seconds allowed per solve")
+    parser.add_argument("--compress", action = "store_true", help = "solve a compressed model for the medium (see model_compression.py)")
+    parser.add_argument("--verbose", action = "store_true", help = "print the rate and stop messages the scripts print")
+    parser.add_argument("--output", default = output, help = "results file (default " + output + ")")
+    parser.add_argument("--solve-cache", nargs = "?", const = True, metavar = "PATH", help = "reuse the solutions of LPs that were already solved (see solve_cache.py), shared between processes through PATH if it's given")
+    parser.add_argument("--cache-digits", type = positive_int, metavar = "DIGITS", help = "round the exchange bounds in the solve cache's keys to this many significant digits, so nearby LPs share solutions (default: exact bounds only)")
+    parser.add_argument("--store", metavar = "PATH", help = "SQLite result store (see result_store.py), runs already in it are read from it instead of simulated")
+
+# Settings for dFBA_engine.make_config() from the options that were given
+def run_settings(args):
+    settings = {}
+    if args.n is not None:
+        settings["n"] = args.n
+    if args.timepoint_interval is not None:
+        settings["timepoint_interval"] = args.timepoint_interval
+    if args.starting_biomass is not None:
+        settings["starting_biomass"] = args.starting_biomass
+    if len(args.gene_deletion) > 0:
+        settings["gene_deletions"] = args.gene_deletion
+    if len(args.kinetics) > 0:
+        settings["kinetics"] = dict(args.kinetics)
+    if args.solver_timeout is not None:
+        settings["solver_timeout"] = args.solver_timeout
+    if args.compress:
+        settings["compress"] = True
+    if args.solve_cache is not None:
+        settings["solve_cache"] = args.solve_cache
+        if args.cache_digits is not None:
+            settings["solve_cache_digits"] = args.cache_digits
+    return settings
+
+
+##############
+# Subcommands
+
+# The build script lives in Model_builds/, next to Code/; pip only installs the modules in Code/, so it's only there in a copy of the repository
+def run_build(args):
+    import runpy
+    if not os.path.isfile(build_script):
+        raise SystemExit("inovo build needs Model_builds/build_iNovo.py, which isn't installed with the inovo command. It was looked for at "
+                         + os.path.normpath(build_script) + "; run inovo build from a copy of the repository, installed with pip install -e .")
+    argv = sys.argv
+    sys.argv = [build_script, args.compounds, args.reactions, args.output] + args.compare
+    # build_iNovo.py imports balance_audit.py from its own folder
+    sys.path.insert(0, os.path.dirname(build_script))
+    try:
+        runpy.run_path(build_script, run_name = "__main__")
+    finally:
+        sys.argv = argv
+
+def run_yield(args):
+    import dFBA_engine
+    models = dFBA_engine.get_models(args.model, "yield")
+    kinetics = dict(dFBA_engine.default_kinetics)
+    kinetics.update(dict(args.kinetics))
+    value, fluxes = dFBA_engine.biomass_yield(models, {x: args.concentration for x in args.substrates}, kinetics)
+    fluxes.to_csv(args.output)
+    print("Biomass yield, mgDW/mmol: ")
+    print(value)
+
+def run_simulation(args, scenario, substrates, **settings):
+    import dFBA_engine
+    settings.update(run_settings(args))
+    if args.store is None:
+        df, summary = dFBA_engine.run_scenario(args.model, scenario, substrates, verbose = args.verbose, **settings)
+    else:
+        import result_store
+        with result_store.ResultStore(args.store) as store:
+            tracking, summary = result_store.cached_run(args.model, dFBA_engine.make_config(scenario, substrates, **settings), store, verbose = args.verbose)
+        df = dFBA_engine.tracking_to_dataframe(tracking)
+    df.to_csv(args.output)
+    for x in summary:
+        print(x, ": ", summary[x])
+
+def run_cometab(args):
+    run_simulation(args, "cometabolism", {x: args.concentration for x in args.substrates})
+
+def run_pdc(args):
+    run_simulation(args, "PDC", {args.substrate1: args.concentration1, args.substrate2: args.concentration2})
+
+def run_bioproduct(args):
+    substrates = dict(args.substrate) if len(args.substrate) > 0 else {"exVA": 5.0}
+    run_simulation(args, "bioproduct", substrates, desired_product = args.product, OE_amount = args.OE_amount)
+
+# Sweep workers keep their prepared models between points
+_worker = {}
+
+def init_sweep_worker(model_path, scenario, desired_product, store_path):
+    import dFBA_engine
+    _worker["model_path"] = model_path
+    _worker["models"] = dFBA_engine.get_models(model_path, scenario, desired_product)
+    if store_path is not None:
+        import result_store
+        _worker["store"] = result_store.ResultStore(store_path)
+
+# Also returns how much the worker's run counters grew, for the metrics file (see run_metrics.py)
+def run_sweep_point(task):
+    import dFBA_engine
+    import run_metrics
+    point, config = task
+    before = run_metrics.snapshot()
+    status, reason = dFBA_engine.prescreen(_worker["models"], config)
+    if not dFBA_engine.should_simulate(status, config):
+        summary = dFBA_engine.skipped_summary(config)
+    elif "store" in _worker:
+        import result_store
+        tracking, summary = result_store.cached_run(_worker["model_path"], config, _worker["store"], _worker["models"])
+    else:
+        tracking = dFBA_engine.simulate(_worker["models"], config)
+        summary = dFBA_engine.summarize(tracking, config)
+    return point, status, reason, summary, run_metrics.since(before)
+
+# The grid names and (point, config) of every combination of the grid values
+def sweep_tasks(args):
+    import itertools
+    import dFBA_engine
+    scenario = scenario_names[args.scenario]
+    if scenario == "bioproduct" and args.product is None:
+        raise SystemExit("The bioproduct scenario needs --product")
+    names = [name for name, values in args.grid]
+    base = dict(args.substrate)
+    settings = run_settings(args)
+    if scenario == "bioproduct":
+        settings["desired_product"] = args.product
+        settings["OE_amount"] = args.OE_amount
+        if len(base) == 0:
+            base = {"exVA": 5.0}
+
+    tasks = []
+    for point in itertools.product(*[values for name, values in args.grid]):
+        substrates = dict(base)
+        point_settings = dict(settings)
+        for name, value in zip(names, point):
+            if name == "OE_amount":
+                point_settings["OE_amount"] = value
+            else:
+                substrates[name] = value
+        tasks.append((point, dFBA_engine.make_config(scenario, substrates, **point_settings)))
+    return scenario, names, settings, tasks
+
+# Every combination of the grid values, each run in a worker process after the static FBA pre-screen
+# With --queue, the points go in a work queue folder instead (see work_queue.py), and workers on any computer that can see it can run them
+def run_sweep(args):
+    import multiprocessing
+    import pandas
+    import dFBA_engine
+    import run_metrics
+    if args.queue is not None:
+        return run_queued_sweep(args)
+    scenario, names, settings, tasks = sweep_tasks(args)
+
+    import time
+    started = time.time()
+    rows = []
+    metric_names = []
+    metrics = run_metrics.RunMetrics(args.metrics, len(tasks))
+    with multiprocessing.Pool(args.processes, initializer = init_sweep_worker, initargs = (args.model, scenario, settings.get("desired_product"), args.store)) as pool:
+        for count, (point, status, reason, summary, counters) in enumerate(pool.imap_unordered(run_sweep_point, tasks)):
+            rows.append(list(point) + [status, reason] + [summary[x] for x in summary])
+            metric_names = list(summary.keys())
+            metrics.job_done(counters, skipped = not dFBA_engine.should_simulate(status, {"scenario": scenario}))
+            print("Finished ", count + 1, " of ", len(tasks), ": ", dict(zip(names, point)), " ", status)
+    metrics.close()
+    df = pandas.DataFrame(rows, columns = names + ["prescreen", "prescreen_reason"] + metric_names).sort_values(names)
+    df.to_csv(args.output, index = False)
+    print(df)
+    if isinstance(settings.get("solve_cache"), str):
+        import solve_cache
+        stats = solve_cache.file_stats(settings["solve_cache"], since = started)
+        print("Solve cache hit rate: ", stats["hit_rate"], " (", stats["memory_hits"] + stats["file_hits"], " of ", stats["memory_hits"] + stats["file_hits"] + stats["misses"] + stats["skipped"], " solves)")
+
+# Paths in the jobs are absolute, since workers on other computers may run from other folders
+# Points that are already done in the queue aren't added again, so running the same command resumes an interrupted sweep
+def run_queued_sweep(args):
+    import work_queue
+    if isinstance(args.solve_cache, str):
+        args.solve_cache = os.path.abspath(args.solve_cache)
+    scenario, names, settings, tasks = sweep_tasks(args)
+    queue = work_queue.WorkQueue(args.queue)
+    queue.create({"names": names, "store": os.path.abspath(args.store) if args.store is not None else None})
+    if queue.settings()["names"] != names:
+        raise SystemExit("The queue in " + args.queue + " is for a grid over " + ", ".join(queue.settings()["names"]))
+    added, done = queue.submit(work_queue.sweep_jobs(args.model, tasks))
+    print("Added ", added, " jobs to ", args.queue, " (", done, " already done)")
+    if args.submit_only:
+        return
+    work_queue.work_processes(args.queue, args.processes, metrics_path = args.metrics)
+    write_queue_results(args.queue, args.output)
+
+def write_queue_results(path, output):
+    import work_queue
+    df = work_queue.merge(path)
+    df.to_csv(output, index = False)
+    print(df)
+    print("Results of ", len(df), " jobs written to ", output)
+
+def run_worker(args):
+    import work_queue
+    work_queue.work_processes(args.queue, args.processes, wait = not args.no_wait, metrics_path = args.metrics)
+
+def run_queue(args):
+    import work_queue
+    queue = work_queue.WorkQueue(args.queue)
+    if not queue.exists():
+        raise SystemExit("No work queue in " + args.queue)
+    if args.requeue:
+        print("Put ", queue.requeue_stale(), " jobs of stopped workers back in the queue")
+    work_queue.print_progress(args.queue)
+    if args.metrics is not None:
+        import run_metrics
+        run_metrics.write_metrics(args.metrics, run_metrics.queue_metrics(queue))
+    if args.merge is not None:
+        write_queue_results(args.queue, args.merge)
+
+
+##############
+# Command line
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog = "inovo", description = "Build the iNovo479 model and run its simulations")
+    subcommands = parser.add_subparsers(dest = "command", required = True, metavar = "subcommand")
+
+    build = subcommands.add_parser("build", help = "build a model from compound and reaction files (Model_builds/build_iNovo.py)")
+    build.add_argument("compounds", help = "compounds file, e.g. Input_files/minimal_compounds_2022-03-03.csv")
+    build.add_argument("reactions", help = "reactions file, e.g. Input_files/minimal_reactions_2022-02-11.txt")
+    build.add_argument("output", help = "path and name of the model to write")
+    build.add_argument("--compare", action = "append", default = [], metavar = "REACTIONS_FILE",
+                       help = "reactions file of another model variant to check the mass balance of and compare with (can be repeated)")
+    build.set_defaults(run = run_build)
+
+    biomass_yield = subcommands.add_parser("yield", help = "biomass yield from one or more substrates (calculate_biomass_yield.py)")
+    biomass_yield.add_argument("model")
+    biomass_yield.add_argument("substrates", nargs = "+", metavar = "substrate")
+    biomass_yield.add_argument("--concentration", type = non_negative_float, default = 1.0, help = "mmol/L of each substrate (default 1)")
+    biomass_yield.add_argument("--kinetics", action = "append", type = kinetic_parameters, default = [], metavar = "CLASS=Vm,Ks,Ki")
+    biomass_yield.add_argument("--output", default = "Model_fluxes.csv")
+    biomass_yield.set_defaults(run = run_yield)
+
+    cometab = subcommands.add_parser("cometab", help = "dFBA of several substrates consumed together (cometabolism_dFBA.py)")
+    cometab.add_argument("model")
+    cometab.add_argument("substrates", nargs = "+", metavar = "substrate")
+    cometab.add_argument("--concentration", type = non_negative_float, default = 1.0, help = "mmol/L of each substrate (default 1)")
+    add_run_options(cometab, "dFBA_results.csv")
+    cometab.set_defaults(run = run_cometab)
+
+    pdc = subcommands.add_parser("pdc", help = "dFBA of PDC production from two substrates (PDC_dFBA.py)")
+    pdc.add_argument("model")
+    pdc.add_argument("substrate1")
+    pdc.add_argument("concentration1", type = non_negative_float)
+    pdc.add_argument("substrate2")
+    pdc.add_argument("concentration2", type = non_negative_float)
+    add_run_options(pdc, "PDC_dFBA_results.csv")
+    pdc.set_defaults(run = run_pdc)
+
+    bioproduct = subcommands.add_parser("bioproduct", help = "dFBA of an overexpressed bioproduct (bioproduct_dFBA.py)")
+    bioproduct.add_argument("model")
+    bioproduct.add_argument("product", help = "compound ID of the product, e.g. C00033")
+    bioproduct.add_argument("OE_amount", type = non_negative_float, help = "moles of product per mole of vanillic acid")
+    bioproduct.add_argument("--substrate", action = "append", type = concentration, default = [], metavar = "ID=MMOL", help = "substrates (default exVA=5)")
+    add_run_options(bioproduct, "bioproduct_dFBA_results.csv")
+    bioproduct.set_defaults(run = run_bioproduct)
+
+    sweep = subcommands.add_parser("sweep", help = "run a scenario over a grid of concentrations or OE amounts in parallel")
+    sweep.add_argument("scenario", choices = ["cometab", "pdc", "bioproduct"])
+    sweep.add_argument("model")
+    sweep.add_argument("--grid", action = "append", type = grid_values, required = True, metavar = "NAME=VALUES", help = "compound ID or OE_amount with values v1,v2,... or start:stop:step, can be given more than once")
+    sweep.add_argument("--substrate", action = "append", type = concentration, default = [], metavar = "ID=MMOL", help = "substrates that stay the same at every point")
+    sweep.add_argument("--product", help = "bioproduct compound ID")
+    sweep.add_argument("--OE-amount", type = non_negative_float, default = 0.0, help = "bioproduct OE amount when it isn't on the grid")
+    sweep.add_argument("--processes", type = positive_int, default = os.cpu_count())
+    sweep.add_argument("--queue", metavar = "FOLDER", help = "put the points in a work queue folder on a shared filesystem (see work_queue.py) and work on it; run it again to resume")
+    sweep.add_argument("--submit-only", action = "store_true", help = "with --queue, only add the points, for inovo worker to run")
+    sweep.add_argument("--metrics", metavar = "PATH", help = "keep a metrics file of the progress up to date (see run_metrics.py), in Prometheus text format if PATH ends in .prom, JSON otherwise")
+    add_run_options(sweep, "sweep_results.csv")
+    sweep.set_defaults(run = run_sweep)
+
+    worker = subcommands.add_parser("worker", help = "run the jobs of a work queue folder, on any computer that can see it")
+    worker.add_argument("queue")
+    worker.add_argument("--processes", type = positive_int, default = os.cpu_count())
+    worker.add_argument("--no-wait", action = "store_true", help = "stop when there are no waiting jobs, instead of waiting to pick up the jobs of workers that stop")
+    worker.add_argument("--metrics", metavar = "PATH", help = "keep a metrics file of the whole queue's progress up to date while working (see run_metrics.py)")
+    worker.set_defaults(run = run_worker)
+
+    queue = subcommands.add_parser("queue", help = "progress of a work queue folder, and its results so far")
+    queue.add_argument("queue")
+    queue.add_argument("--merge", metavar = "OUTPUT", help = "write the results of the finished jobs, in the same format as inovo sweep")
+    queue.add_argument("--requeue", action = "store_true", help = "put jobs of workers that stopped back in the queue now")
+    queue.add_argument("--metrics", metavar = "PATH", help = "write a metrics file of the queue's progress (see run_metrics.py)")
+    queue.set_defaults(run = run_queue)
+    return parser
+
+def main(argv = None):
+    args = make_parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
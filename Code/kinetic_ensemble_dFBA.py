@@ -0,0 +1,284 @@
+###################
+# kinetic_ensemble_dFBA.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script runs an ensemble of dFBA simulations with kinetic parameters sampled from user-given distributions
+# The Vm/Ks/Ki values in get_rate are estimates from related bacteria, so this shows how much the predictions depend on them
+# Its output is a table of percentile bands over time and a table of summary metrics for every run
+###################
+
+# Import packages
+import sys
+import os
+import csv
+import multiprocessing
+import numpy
+import pandas
+import dFBA_engine
+import batch_dFBA
+import run_metrics
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes
+seed = 1						# random seed for sampling kinetic parameters
+percentiles = [5, 25, 50, 75, 95]
+band_variables = []				# tracked compounds to report bands for, in addition to biomass, the substrates, and the product
+batch_size = 1					# members each worker runs together with batch_dFBA.py (they advance in lockstep, results are the same as one at a time)
+compress_model = False			# solve a compressed model for the medium (see model_compression.py), faster but degenerate steps can pick a different optimum
+output_path = "ensemble_"		# prefix for the output files
+metrics_path = None				# metrics file kept up to date while the ensemble runs (see run_metrics.py), e.g. "ensemble_metrics.prom"; None for none
+
+# Usage:
+# > python kinetic_ensemble_dFBA.py <distributions file> <number of runs> <scenario> <arguments of the scenario's script>
+# The scenario is cometabolism, PDC, or bioproduct, followed by the same arguments cometabolism_dFBA.py, PDC_dFBA.py, or bioproduct_dFBA.py take
+# For example:
+# > python kinetic_ensemble_dFBA.py example_kinetic_distributions.csv 200 PDC iNovo_base_2022.xml exVA 3.0 exC00031 2.0
+#
+# The distributions file is a csv with the columns class, parameter, distribution, value1, value2
+# class is a substrate class from dFBA_engine.py (glucose, S, H, G) or a mineral exchange ID (exC00014 etc.)
+# parameter is Vm, Ks, or Ki
+# distribution is one of:
+#	normal		value1 = mean (above 0), value2 = standard deviation (samples below zero are drawn again)
+#	lognormal	value1 = median, value2 = standard deviation of the log
+#	uniform		value1 = low, value2 = high
+# Parameters not listed in the file keep their default values
+# Each member gets a static FBA pre-screen first; members that are infeasible (or can't grow, except in the PDC scenario) are listed in the runs table but left out of the bands
+
+
+##############
+# Sampling
+
+parameter_index = {"Vm": 0, "Ks": 1, "Ki": 2}
+
+def read_distributions(path):
+    distributions = pandas.read_csv(path)
+    distributions.columns = [x.strip() for x in distributions.columns]
+    for index, row in distributions.iterrows():
+        if row["parameter"] not in parameter_index:
+            raise ValueError("Unknown kinetic parameter on line " + str(index) + ": " + str(row["parameter"]))
+        if row["distribution"] not in ("normal", "lognormal", "uniform"):
+            raise ValueError("Unknown distribution on line " + str(index) + ": " + str(row["distribution"]))
+        # Negative samples of a normal distribution are drawn again, which never ends if its mean isn't above zero
+        if row["distribution"] == "normal" and not (row["value1"] > 0 and row["value2"] >= 0):
+            raise ValueError("A normal distribution needs a mean above 0 and a standard deviation of at least 0, on line " + str(index) + ": "
+                             + str(row["class"]) + " " + str(row["parameter"]))
+    return distributions
+
+def draw(rng, distribution, value1, value2):
+    if distribution == "normal":
+        if not value1 > 0:
+            raise ValueError("A normal distribution needs a mean above 0, not " + str(value1))
+        value = rng.normal(value1, value2)
+        while value <= 0:
+            value = rng.normal(value1, value2)
+        return value
+    elif distribution == "lognormal":
+        return rng.lognormal(numpy.log(value1), value2)
+    return rng.uniform(value1, value2)
+
+# Returns a kinetics dictionary with the sampled values written over the run's defaults
+def sample_kinetics(rng, distributions, kinetics):
+    sample = {x: list(kinetics[x]) for x in kinetics}
+    for index, row in distributions.iterrows():
+        if row["class"] not in sample:
+            sample[row["class"]] = list(dFBA_engine.get_rate(row["class"], kinetics))
+        sample[row["class"]][parameter_index[row["parameter"]]] = draw(rng, row["distribution"], row["value1"], row["value2"])
+    return sample
+
+
+##############
+# Streaming statistics
+# Runs are folded in one at a time so that thousands of trajectories never sit in memory together
+
+# The P-squared algorithm (Jain and Chlamtac, 1985) estimates a quantile from five markers without storing the observations
+# This version updates a whole array of quantiles (every timepoint of every tracked compound) at once
+class StreamingQuantile:
+    def __init__(self, p, shape):
+        self.p = p
+        self.count = 0
+        self.first = numpy.zeros((5,) + shape)
+        self.heights = None
+        self.positions = None
+        self.desired = numpy.array([1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5])
+        self.increments = numpy.array([0, p / 2, p, (1 + p) / 2, 1])
+
+    def add(self, x):
+        if self.count < 5:
+            self.first[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                self.heights = numpy.sort(self.first, axis = 0)
+                self.positions = numpy.ones_like(self.heights) * numpy.arange(1, 6).reshape((5,) + (1,) * x.ndim)
+            return
+
+        self.count += 1
+        q = self.heights
+        npos = self.positions
+        q[0] = numpy.minimum(q[0], x)
+        q[4] = numpy.maximum(q[4], x)
+        # Cell the observation falls in, then shift the markers above it
+        k = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])
+        for j in range(1, 5):
+            npos[j] += (k < j)
+        self.desired = self.desired + self.increments
+
+        for j in range(1, 4):
+            d = self.desired[j] - npos[j]
+            move = ((d >= 1) & (npos[j + 1] - npos[j] > 1)) | ((d <= -1) & (npos[j - 1] - npos[j] < -1))
+            if not move.any():
+                continue
+            s = numpy.where(d >= 0, 1.0, -1.0)
+            # Piecewise-parabolic prediction, falling back to linear if it would leave the neighboring markers
+            parabolic = q[j] + s / (npos[j + 1] - npos[j - 1]) * (
+                (npos[j] - npos[j - 1] + s) * (q[j + 1] - q[j]) / (npos[j + 1] - npos[j]) +
+                (npos[j + 1] - npos[j] - s) * (q[j] - q[j - 1]) / (npos[j] - npos[j - 1]))
+            neighbor_q = numpy.where(s > 0, q[j + 1], q[j - 1])
+            neighbor_n = numpy.where(s > 0, npos[j + 1], npos[j - 1])
+            linear = q[j] + s * (neighbor_q - q[j]) / (neighbor_n - npos[j])
+            adjusted = numpy.where((q[j - 1] < parabolic) & (parabolic < q[j + 1]), parabolic, linear)
+            q[j] = numpy.where(move, adjusted, q[j])
+            npos[j] = numpy.where(move, npos[j] + s, npos[j])
+
+    def value(self):
+        if self.count < 5:
+            return numpy.percentile(self.first[:self.count], self.p * 100, axis = 0)
+        return self.heights[2]
+
+# Running mean, standard deviation, minimum, maximum, and percentiles of an array-valued observation
+class StreamingBands:
+    def __init__(self, shape, percentiles):
+        self.count = 0
+        self.mean = numpy.zeros(shape)
+        self.m2 = numpy.zeros(shape)
+        self.minimum = numpy.full(shape, numpy.inf)
+        self.maximum = numpy.full(shape, -numpy.inf)
+        self.quantiles = {p: StreamingQuantile(p / 100, shape) for p in percentiles}
+
+    def add(self, x):
+        # Welford's update for the mean and variance
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.minimum = numpy.minimum(self.minimum, x)
+        self.maximum = numpy.maximum(self.maximum, x)
+        for p in self.quantiles:
+            self.quantiles[p].add(x)
+
+    def to_dataframe(self, times, variables):
+        sd = numpy.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else numpy.zeros_like(self.mean)
+        columns = {"Time": numpy.repeat(times, len(variables)),
+                   "variable": numpy.tile(variables, len(times)),
+                   "mean": self.mean.ravel(),
+                   "sd": sd.ravel(),
+                   "min": self.minimum.ravel()}
+        for p in self.quantiles:
+            columns["p" + str(p)] = self.quantiles[p].value().ravel()
+        columns["max"] = self.maximum.ravel()
+        return pandas.DataFrame(columns)
+
+
+##############
+# Workers
+
+# Every worker loads and prepares the model once, then reuses it for all of its runs
+_worker = {}
+
+def init_worker(model_path, config, variables):
+    _worker["models"] = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    _worker["config"] = config
+    _worker["variables"] = variables
+
+# Runs are padded to the full number of timesteps with their last values, since concentrations stay put once a run stops
+def trajectory_array(tracking, variables, rows):
+    df = dFBA_engine.tracking_to_dataframe(tracking)
+    df = df.reindex(range(rows)).ffill()
+    return df[variables].to_numpy(dtype = float)
+
+# A group of batch_size members, run together in one batch
+# Members the static FBA pre-screen rules out are not simulated and have no trajectory
+# Also returns how much the worker's run counters grew, for the metrics file
+def run_members(tasks):
+    before = run_metrics.snapshot()
+    results = []
+    configs = []
+    for index, kinetics in tasks:
+        config = dict(_worker["config"])
+        config["kinetics"] = kinetics
+        config["compress"] = compress_model
+        status, reason = dFBA_engine.prescreen(_worker["models"], config)
+        if dFBA_engine.should_simulate(status, config):
+            configs.append(config)
+            results.append([index, kinetics, status, reason, None, None])
+        else:
+            results.append([index, kinetics, status, reason, dFBA_engine.skipped_summary(config), None])
+    if len(configs) > 0:
+        simulated = [x for x in results if x[4] is None]
+        for result, config, tracking in zip(simulated, configs, batch_dFBA.simulate_batch(_worker["models"], configs)):
+            result[4] = dFBA_engine.summarize(tracking, config)
+            result[5] = trajectory_array(tracking, _worker["variables"], config["n"])
+    return results, run_metrics.since(before)
+
+def ensemble_variables(config):
+    variables = ["Biomass"] + list(config["substrates"].keys())
+    if config["scenario"] == "PDC":
+        variables.append("PDC")
+    elif config["scenario"] == "bioproduct":
+        variables.append(config["desired_product"])
+    return variables + [x for x in band_variables if x not in variables]
+
+# Run the ensemble and write the per-run table as results come back
+# Returns the bands dataframe, or None if the pre-screen skipped every run
+def run_ensemble(model_path, config, distributions, runs, output_path = output_path, processes = processes, seed = seed):
+    rng = numpy.random.default_rng(seed)
+    variables = ensemble_variables(config)
+    tasks = [(i, sample_kinetics(rng, distributions, config["kinetics"])) for i in range(runs)]
+    batches = [tasks[start:start + batch_size] for start in range(0, runs, batch_size)]
+    sampled = [(row["class"], row["parameter"]) for index, row in distributions.iterrows()]
+
+    bands = StreamingBands((config["n"], len(variables)), percentiles)
+    metric_names = None
+    finished = 0
+    skipped = 0
+    metrics = run_metrics.RunMetrics(metrics_path, runs)
+
+    with open(output_path + "runs.csv", "w", newline = "") as runs_file:
+        writer = csv.writer(runs_file)
+        with multiprocessing.Pool(processes, initializer = init_worker, initargs = (model_path, config, variables)) as pool:
+            for members, counters in pool.imap_unordered(run_members, batches):
+                for index, kinetics, status, reason, summary, trajectory in members:
+                    if metric_names is None:
+                        metric_names = list(summary.keys())
+                        writer.writerow(["run"] + [c + "_" + p for c, p in sampled] + ["prescreen", "prescreen_reason"] + metric_names)
+                    writer.writerow([index] + [kinetics[c][parameter_index[p]] for c, p in sampled] + [status, reason] + [summary[x] for x in metric_names])
+                    finished += 1
+                    if trajectory is None:
+                        skipped += 1
+                    else:
+                        bands.add(trajectory)
+                    if finished % 10 == 0:
+                        print("Finished runs: ", finished, " of ", runs, ", skipped by the pre-screen: ", skipped)
+                metrics.jobs_done(len(members), counters, skipped = len([x for x in members if x[5] is None]))
+    metrics.close()
+
+    if bands.count == 0:
+        print("Every run was skipped by the pre-screen, see ", output_path + "runs.csv")
+        return None
+    times = numpy.arange(config["n"]) * config["timepoint_interval"]
+    df = bands.to_dataframe(times, variables)
+    df.to_csv(output_path + "bands.csv", index = False)
+    return df
+
+
+if __name__ == "__main__":
+    distributions = read_distributions(sys.argv[1])
+    runs = int(sys.argv[2])
+    model_path, config = dFBA_engine.config_from_args(sys.argv[3], sys.argv[4:])
+
+    run_ensemble(model_path, config, distributions, runs)
+
+    # The per-run metrics are small, so print their spread straight from the file
+    results = pandas.read_csv(output_path + "runs.csv")
+    metrics = [x for x in ["g_L_hr", "time_to_depletion", "final_biomass"] if x in results.columns]
+    print(results[metrics].describe(percentiles = [p / 100 for p in percentiles]))
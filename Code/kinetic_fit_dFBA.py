@@ -0,0 +1,309 @@
+###################
+# kinetic_fit_dFBA.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script fits the kinetic parameters of the substrate classes (glucose, S, H, G) to experimental time courses and biomass yields
+# The Vm/Ks/Ki values in get_rate are estimates from related bacteria in the literature and not experimentally verified
+# Each candidate parameter set is scored by running dFBA for every experiment and comparing the output with the measurements
+# Candidates are evaluated in parallel, a generation at a time, and the first generations use a cheaper engine (longer timesteps, a compressed model)
+# Repeated candidates are only evaluated once, and with a result store (see result_store.py) runs are kept between fits
+###################
+
+# Import packages
+import sys
+import os
+import math
+import multiprocessing
+import numpy
+import pandas
+import dFBA_engine
+import result_store
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes
+seed = 1						# random seed for drawing candidates
+population = 16					# candidate parameter sets per generation, all evaluated in parallel
+elite = 4						# best candidates of a generation that the next one is drawn around
+coarse_generations = 6			# generations scored with the cheaper engine
+full_generations = 4			# generations scored with the scripts' own timestep and model (at least 1)
+coarse_timestep_factor = 2		# the cheaper engine takes timesteps this many times longer (and that many times fewer of them)
+coarse_compress = True			# the cheaper engine solves a compressed model for the medium (see model_compression.py)
+smoothing = 0.7					# how far each generation moves toward its elite, between 0 and 1
+default_relative_error = 0.1	# measurement error where the data doesn't give one, as a fraction of the largest value of that series
+store_path = None				# a result store file (see result_store.py) to keep every dFBA run in, or None
+output_path = "fit_"			# prefix for the output files
+
+# Usage:
+# > python kinetic_fit_dFBA.py <parameters file> <experiments file> <observations file> [<yields file>]
+# For example:
+# > python kinetic_fit_dFBA.py example_fit_parameters.csv example_fit_experiments.csv example_fit_observations.csv ../Model_results/biomass_yields.csv
+#
+# The parameters file is a csv with the columns class, parameter, low, high, and optionally start
+# class is a substrate class from dFBA_engine.py (glucose, S, H, G) or a mineral exchange ID, parameter is Vm, Ks, or Ki
+# The parameter is searched between low and high on a log scale, starting from start or the scenario's default; parameters not listed keep their defaults
+#
+# The experiments file is a csv with the columns experiment, scenario, model, substrates, and optionally desired_product and OE_amount
+# substrates is a list of compound ID=mmol/L separated by spaces, e.g. "exSA=1.0 exVA=1.0 expHBA=1.0"
+# The observations file is a csv with the columns experiment, Time (minutes), variable (a column of the results table, e.g. Biomass or exVA), value,
+# and optionally sd, the measurement's standard deviation
+# The yields file is a csv like Model_results/biomass_yields.csv: Substrate, Data_Type, Yield, Error. Only the Experimental rows with a yield are used,
+# and the substrate names are matched to compound IDs with yield_substrates below; rows of substrates that aren't in it are left out
+#
+# The misfit is the sum of squared (predicted - measured) / sd over every observation and yield
+# Predictions at measured times are interpolated between timepoints and held at the last value once a run stops
+# A candidate the pre-screen rules out for an experiment, or that gives no yield for a substrate, has an infinite misfit
+# Output files:
+#	<output_path>history.csv - every candidate that was scored: generation, engine, parameter values, misfit
+#	<output_path>parameters.csv - the best parameter set scored with the full engine, as class, parameter, value
+#	<output_path>predictions.csv - measured and predicted values for the best parameter set
+
+# Names in biomass_yields.csv and the compounds they stand for
+# GGE isn't here: the yield model doesn't grow on any of its isomers alone, so it has no yield to compare
+yield_substrates = {"D-glucose": "exC00031", "p-Hydroxybenozoic acid": "expHBA", "Syringic acid": "exSA", "Syringaldehyde": "exS",
+                    "Vanillic acid": "exVA", "Protocatechuic acid": "exPCA", "Vanillin": "exV", "Ferulic acid": "exFA",
+                    "G-diketone": "exGDK", "S-diketone": "exSDK"}
+yield_model_path = "iNovo_base_2022.xml"	# model the yields are calculated with, as in calculate_biomass_yield.py
+
+
+##############
+# Input files
+
+parameter_index = {"Vm": 0, "Ks": 1, "Ki": 2}
+
+def read_parameters(path):
+    parameters = pandas.read_csv(path)
+    parameters.columns = [x.strip() for x in parameters.columns]
+    for index, row in parameters.iterrows():
+        if row["parameter"] not in parameter_index:
+            raise ValueError("Unknown kinetic parameter on line " + str(index) + ": " + str(row["parameter"]))
+        if not 0 < row["low"] < row["high"]:
+            raise ValueError("low must be above 0 and below high on line " + str(index))
+    return parameters
+
+# Returns a dictionary of experiment name: (model path, config)
+def read_experiments(path):
+    experiments = {}
+    for index, row in pandas.read_csv(path).iterrows():
+        substrates = {}
+        for item in str(row["substrates"]).split():
+            cpd_ID, value = item.split("=")
+            substrates[cpd_ID] = float(value)
+        settings = {}
+        if "desired_product" in row and not pandas.isna(row["desired_product"]):
+            settings["desired_product"] = row["desired_product"]
+            settings["OE_amount"] = float(row.get("OE_amount", 0.0))
+        experiments[str(row["experiment"])] = (row["model"], dFBA_engine.make_config(row["scenario"], substrates, **settings))
+    return experiments
+
+# Adds an sd column where the data doesn't give one
+def read_observations(path, experiments):
+    observations = pandas.read_csv(path)
+    observations["experiment"] = observations["experiment"].astype(str)
+    missing = set(observations["experiment"]) - set(experiments)
+    if len(missing) > 0:
+        raise ValueError("Observations for experiments that aren't in the experiments file: " + ", ".join(sorted(missing)))
+    if "sd" not in observations.columns:
+        observations["sd"] = float("nan")
+    scale = observations.groupby(["experiment", "variable"])["value"].transform(lambda x: x.abs().max())
+    observations["sd"] = observations["sd"].fillna(default_relative_error * scale)
+    observations.loc[observations["sd"] <= 0, "sd"] = default_relative_error
+    return observations
+
+def read_yields(path):
+    yields = pandas.read_csv(path, encoding = "utf-8-sig")
+    yields = yields[(yields["Data_Type"] == "Experimental") & yields["Yield"].notna()].copy()
+    unknown = [x for x in yields["Substrate"] if x not in yield_substrates]
+    if len(unknown) > 0:
+        print("Leaving out yields of substrates that aren't in yield_substrates: ", ", ".join(unknown))
+        yields = yields[yields["Substrate"].isin(yield_substrates)].copy()
+    yields["sd"] = yields["Error"].fillna(default_relative_error * yields["Yield"])
+    return yields
+
+
+##############
+# Candidates
+
+# The kinetics dictionary of an experiment with a candidate's values written over it
+def candidate_kinetics(kinetics, parameters, values):
+    kinetics = {x: list(kinetics[x]) for x in kinetics}
+    for (index, row), value in zip(parameters.iterrows(), values):
+        if row["class"] not in kinetics:
+            kinetics[row["class"]] = list(dFBA_engine.get_rate(row["class"], kinetics))
+        kinetics[row["class"]][parameter_index[row["parameter"]]] = value
+    return kinetics
+
+def starting_values(parameters):
+    values = []
+    for index, row in parameters.iterrows():
+        if "start" in row and not pandas.isna(row["start"]):
+            values.append(row["start"])
+        else:
+            values.append(dFBA_engine.get_rate(row["class"])[parameter_index[row["parameter"]]])
+    return numpy.clip(values, parameters["low"].to_numpy(dtype = float), parameters["high"].to_numpy(dtype = float))
+
+
+##############
+# Workers
+
+_worker = {}
+
+def init_worker(experiments, parameters, store_path):
+    _worker["experiments"] = experiments
+    _worker["parameters"] = parameters
+    _worker["store"] = result_store.ResultStore(store_path) if store_path is not None else None
+
+# The cheaper engine covers the same time in fewer, longer steps
+def engine_config(config, engine):
+    config = dict(config)
+    if engine == "coarse":
+        config["timepoint_interval"] = config["timepoint_interval"] * coarse_timestep_factor
+        config["n"] = int(math.ceil(config["n"] / coarse_timestep_factor))
+        if coarse_compress:
+            config["compress"] = True
+    return config
+
+# One experiment for one candidate, returns the times and values of the variables it has observations of, or None if the pre-screen rules it out
+def run_experiment(task):
+    candidate, name, values, engine, variables = task
+    if name is None:
+        return candidate, name, run_yields(values, variables)
+    model_path, config = _worker["experiments"][name]
+    config = engine_config(config, engine)
+    config["kinetics"] = candidate_kinetics(config["kinetics"], _worker["parameters"], values)
+    models = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    status, reason = dFBA_engine.prescreen(models, config)
+    if not dFBA_engine.should_simulate(status, config):
+        return candidate, name, None
+    if _worker["store"] is not None:
+        tracking, summary = result_store.cached_run(model_path, config, _worker["store"], models)
+    else:
+        tracking = dFBA_engine.simulate(models, config)
+    return candidate, name, {x: (tracking["Time"], tracking[x]) for x in variables}
+
+# Biomass yields for one candidate; variables is the list of yield file substrate names
+def run_yields(values, variables):
+    models = dFBA_engine.get_models(yield_model_path, "yield")
+    kinetics = candidate_kinetics(dFBA_engine.default_kinetics, _worker["parameters"], values)
+    return {x: dFBA_engine.biomass_yield(models, {yield_substrates[x]: 1.0}, kinetics)[0] for x in variables}
+
+
+##############
+# Misfit
+
+# Columns that ended early have None (NaN from a result store) after their last value
+def predict(prediction, times):
+    run_times = numpy.asarray(prediction[0], dtype = float)
+    values = numpy.asarray(prediction[1], dtype = float)
+    length = min(len(run_times), len(values))
+    kept = numpy.isfinite(run_times[:length]) & numpy.isfinite(values[:length])
+    return numpy.interp(times, run_times[:length][kept], values[:length][kept])
+
+def misfit(predictions, observations, yields):
+    total = 0.0
+    for name, group in observations.groupby("experiment"):
+        if predictions[name] is None:
+            return float("inf")
+        for variable, rows in group.groupby("variable"):
+            predicted = predict(predictions[name][variable], rows["Time"].to_numpy(dtype = float))
+            total += float((((predicted - rows["value"].to_numpy()) / rows["sd"].to_numpy()) ** 2).sum())
+    if yields is not None:
+        for index, row in yields.iterrows():
+            total += ((predictions[None][row["Substrate"]] - row["Yield"]) / row["sd"]) ** 2
+    return total if math.isfinite(total) else float("inf")
+
+
+##############
+# Fit
+
+# Scores candidates with one engine, all experiments of all candidates in one pool
+# scored holds every candidate already scored, so repeated candidates aren't run again
+def score(pool, candidates, engine, observations, yields, scored):
+    keys = [(engine, tuple(round(float(x), 12) for x in values)) for values in candidates]
+    tasks = []
+    new = []
+    for candidate, (key, values) in enumerate(zip(keys, candidates)):
+        if key in scored or key in new:
+            continue
+        new.append(key)
+        for name, group in observations.groupby("experiment"):
+            tasks.append((candidate, name, list(values), engine, sorted(set(group["variable"]))))
+        if yields is not None:
+            tasks.append((candidate, None, list(values), engine, list(yields["Substrate"])))
+
+    predictions = {}
+    for candidate, name, prediction in pool.imap_unordered(run_experiment, tasks):
+        predictions.setdefault(candidate, {})[name] = prediction
+    for candidate in predictions:
+        scored[keys[candidate]] = (misfit(predictions[candidate], observations, yields), predictions[candidate])
+    return [scored[key][0] for key in keys]
+
+# Cross-entropy search on the log scale: each generation is drawn around the mean of the last one's best candidates
+# Returns the best values, their misfit and predictions with the full engine, and the history table
+def fit(parameters, experiments, observations, yields = None, processes = processes, seed = seed, store_path = store_path):
+    if full_generations < 1:
+        raise ValueError("full_generations must be at least 1, the best parameter set is the best one scored with the full engine")
+    rng = numpy.random.default_rng(seed)
+    low = numpy.log(parameters["low"].to_numpy(dtype = float))
+    high = numpy.log(parameters["high"].to_numpy(dtype = float))
+    mean = numpy.log(starting_values(parameters))
+    spread = (high - low) / 4
+    names = [row["class"] + "_" + row["parameter"] for index, row in parameters.iterrows()]
+    scored = {}
+    history = []
+    best = None
+    leader = None
+
+    with multiprocessing.Pool(processes, initializer = init_worker, initargs = (experiments, parameters, store_path)) as pool:
+        for generation in range(coarse_generations + full_generations):
+            engine = "coarse" if generation < coarse_generations else "full"
+            # The mean and the best candidate so far are always in the generation, the best one isn't run again if it was scored with this engine
+            kept = [mean] if leader is None else [mean, leader]
+            draws = numpy.clip(mean + spread * rng.standard_normal((population - len(kept), len(mean))), low, high)
+            candidates = numpy.exp(numpy.vstack(kept + [draws]))
+            misfits = score(pool, candidates, engine, observations, yields, scored)
+            for values, value in zip(candidates, misfits):
+                history.append([generation, engine] + list(values) + [value])
+                if engine == "full" and (best is None or value < best[1]):
+                    best = (values, value)
+
+            order = numpy.argsort(misfits)[:elite]
+            elite_values = numpy.log(candidates[order])
+            leader = elite_values[0]
+            mean = smoothing * elite_values.mean(axis = 0) + (1 - smoothing) * mean
+            spread = numpy.maximum(smoothing * elite_values.std(axis = 0) + (1 - smoothing) * spread, (high - low) / 100)
+            print("Generation ", generation + 1, " (", engine, " engine): best misfit ", misfits[order[0]], ", ",
+                  dict(zip(names, numpy.round(candidates[order[0]], 4))))
+
+    key = ("full", tuple(round(float(x), 12) for x in best[0]))
+    history = pandas.DataFrame(history, columns = ["generation", "engine"] + names + ["misfit"])
+    return best[0], best[1], scored[key][1], history
+
+# Measured and predicted values side by side
+def prediction_table(predictions, observations, yields):
+    rows = []
+    for index, row in observations.iterrows():
+        prediction = predictions[row["experiment"]]
+        predicted = float("nan") if prediction is None else float(predict(prediction[row["variable"]], [row["Time"]])[0])
+        rows.append([row["experiment"], row["Time"], row["variable"], row["value"], row["sd"], predicted])
+    if yields is not None:
+        for index, row in yields.iterrows():
+            rows.append(["yield", float("nan"), row["Substrate"], row["Yield"], row["sd"], predictions[None][row["Substrate"]]])
+    return pandas.DataFrame(rows, columns = ["experiment", "Time", "variable", "measured", "sd", "predicted"])
+
+
+if __name__ == "__main__":
+    parameters = read_parameters(sys.argv[1])
+    experiments = read_experiments(sys.argv[2])
+    observations = read_observations(sys.argv[3], experiments)
+    yields = read_yields(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    values, value, predictions, history = fit(parameters, experiments, observations, yields)
+    history.to_csv(output_path + "history.csv", index = False)
+    fitted = parameters[["class", "parameter"]].copy()
+    fitted["value"] = values
+    fitted.to_csv(output_path + "parameters.csv", index = False)
+    prediction_table(predictions, observations, yields).to_csv(output_path + "predictions.csv", index = False)
+
+    print("Best misfit: ", value)
+    print(fitted.to_string(index = False))
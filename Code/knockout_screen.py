@@ -0,0 +1,180 @@
+###################
+# knockout_screen.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script screens single (and optionally double) gene knockouts for their effect on a dFBA productivity metric
+# It replaces editing the gene_deletions list in PDC_dFBA.py or bioproduct_dFBA.py one gene at a time
+# Its output is a table with one line per knockout, its status, and the metric compared to the unmodified model
+###################
+
+# Import packages
+import sys
+import os
+import itertools
+import multiprocessing
+import pandas
+import dFBA_engine
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes
+growth_threshold = 1e-9			# biomass flux below this counts as no growth
+flux_threshold = 1e-12			# reactions with a flux below this in every step of the reference run count as unused
+solver_timeout = 30				# seconds allowed per solve, GLPK can stall on some knockouts
+output_path = "knockout_screen_results.csv"
+
+# Usage:
+# > python knockout_screen.py <single or double> <metric> <scenario> <arguments of the scenario's script>
+# The metric is one of the summary values from dFBA_engine.summarize():
+#	g_L_hr, mmol_L_hr, max_product (PDC and bioproduct scenarios), final_biomass, max_biomass, time_to_depletion
+# For example:
+# > python knockout_screen.py single g_L_hr PDC iNovo_base_2022.xml exVA 3.0 exC00031 2.0
+# > python knockout_screen.py double g_L_hr bioproduct iNovo_engineered_2022.xml C00033 0.6
+#
+# Knockouts are made in the base model (for the PDC scenario, on top of the PDC strain deletions), inside a model context so the shared model is restored after each one
+# The reactions each knockout disables are found for all knockouts at once from the compiled gene rules (see gpr_index.py), without touching the model
+# Most knockouts never reach dFBA:
+#	no effect - every reaction the knockout disables is unused in every step of the reference run, so the run can't change
+#	lethal - the static FBA pre-screen at the starting conditions rules the run out (see dFBA_engine.prescreen_skip: infeasible, or can't grow outside the PDC scenario,
+#		or the solver timed out), with its reason
+#	no growth - run anyway: the PDC strain can't grow at the start but can once the wild type has grown (the scenario's pre-screen doesn't skip it)
+#	same as - the knockout disables exactly the same reactions as one that was already run (genes in the same complex, for example)
+# Double knockouts are only tried for pairs of non-lethal genes that share a reaction (isozymes) or that both have an effect on their own
+
+
+##############
+# Workers
+
+_worker = {}
+
+def init_worker(model_path, config):
+    _worker["models"] = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    _worker["config"] = config
+
+# Run the unmodified model and record which reactions of the knockout model ever carry flux
+def reference_run(dummy):
+    active = set()
+    def record(i, key, fluxes):
+        if key == "model":
+            active.update(fluxes.index[fluxes.abs() > flux_threshold])
+    tracking = dFBA_engine.simulate(_worker["models"], _worker["config"], flux_callback = record)
+    return dFBA_engine.summarize(tracking, _worker["config"]), active
+
+def prescreen(genes):
+    config = dict(_worker["config"])
+    config["gene_deletions"] = list(genes)
+    return genes, dFBA_engine.prescreen(_worker["models"], config, growth_threshold)
+
+def run_knockout(genes):
+    config = dict(_worker["config"])
+    config["gene_deletions"] = list(genes)
+    tracking = dFBA_engine.simulate(_worker["models"], config)
+    return genes, dFBA_engine.summarize(tracking, config)
+
+
+##############
+# Screen
+
+class KnockoutScreen:
+    def __init__(self, pool, config, metric, index):
+        self.pool = pool
+        self.config = config
+        self.index = index
+        self.metric = metric
+        self.results = {}		# gene tuple: [status, disabled reactions, metric]
+        self.by_reactions = {}	# disabled reaction set: metric, so identical knockouts are only run once
+        self.first_run = {}		# disabled reaction set: the knockout that was run for it
+        self.prescreened = {}	# gene tuple: pre-screen status of the knockouts that were run
+
+    def reference(self):
+        summary, self.active = self.pool.map(reference_run, [0])[0]
+        if self.metric not in summary:
+            raise ValueError("Metric " + self.metric + " is not available for this scenario")
+        self.reference_value = summary[self.metric]
+        self.by_reactions[frozenset()] = self.reference_value
+        self.first_run[frozenset()] = ()
+        print("Reference ", self.metric, ": ", self.reference_value, ", reactions used: ", len(self.active))
+
+    def screen(self, gene_sets):
+        # Reactions whose gene rules are no longer satisfied, for every gene set at once
+        disabled = dict(zip(gene_sets, self.index.disabled(gene_sets)))
+
+        # No effect if nothing the reference run used is disabled
+        to_check = []
+        for genes in gene_sets:
+            if len(disabled[genes] & self.active) == 0:
+                self.results[genes] = ["no effect", disabled[genes], self.reference_value]
+            else:
+                to_check.append(genes)
+
+        # Static FBA pre-screen for lethal knockouts
+        to_run = []
+        for genes, (status, reason) in self.pool.imap_unordered(prescreen, to_check, chunksize = 4):
+            if dFBA_engine.should_simulate(status, self.config):
+                self.prescreened[genes] = status
+                to_run.append(genes)
+            else:
+                self.results[genes] = ["lethal (" + status + ", " + reason + ")", disabled[genes], float("nan")]
+
+        # dFBA for the rest, once per distinct set of disabled reactions
+        unique = {}
+        for genes in to_run:
+            unique.setdefault(disabled[genes] & self.active, []).append(genes)
+        print("Knockouts: ", len(gene_sets), ", no effect or lethal: ", len(gene_sets) - len(to_run), ", dFBA runs: ", len([x for x in unique if x not in self.by_reactions]))
+
+        tasks = [unique[x][0] for x in unique if x not in self.by_reactions]
+        for count, (genes, summary) in enumerate(self.pool.imap_unordered(run_knockout, tasks)):
+            self.by_reactions[disabled[genes] & self.active] = summary[self.metric]
+            self.first_run[disabled[genes] & self.active] = genes
+            if (count + 1) % 10 == 0:
+                print("Finished dFBA runs: ", count + 1, " of ", len(tasks))
+
+        for key in unique:
+            for genes in unique[key]:
+                status = self.prescreened[genes] if genes == self.first_run[key] else "same as " + " ".join(self.first_run[key])
+                self.results[genes] = [status, disabled[genes], self.by_reactions[key]]
+        return disabled
+
+    def to_dataframe(self):
+        rows = []
+        for genes in self.results:
+            status, disabled, value = self.results[genes]
+            rows.append([" ".join(genes), len(genes), status, " ".join(sorted(disabled)), value, value - self.reference_value])
+        df = pandas.DataFrame(rows, columns = ["genes", "number_of_genes", "status", "disabled_reactions", self.metric, "change"])
+        return df.sort_values(["number_of_genes", self.metric], ascending = [True, False], na_position = "last")
+
+# Pairs worth a dFBA run: neither gene is lethal alone, and the genes either share a reaction or both change the metric on their own
+def candidate_pairs(screen, singles):
+    usable = [g for g in singles if not screen.results[(g,)][0].startswith("lethal")]
+    effective = set(g for g in usable if screen.results[(g,)][0] != "no effect" and screen.results[(g,)][2] != screen.reference_value)
+    pairs = []
+    for a, b in itertools.combinations(usable, 2):
+        if (a in effective and b in effective) or len(screen.index.gene_reactions[a] & screen.index.gene_reactions[b]) > 0:
+            pairs.append((a, b))
+    return pairs
+
+def run_screen(model_path, config, metric, double = False, processes = processes):
+    index = dFBA_engine.get_gpr_index(dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product")))
+    singles = [g for g in index.genes if g not in config.get("gene_deletions", [])]
+
+    config = dict(config)
+    config["solver_timeout"] = solver_timeout
+    with multiprocessing.Pool(processes, initializer = init_worker, initargs = (model_path, config)) as pool:
+        screen = KnockoutScreen(pool, config, metric, index)
+        screen.reference()
+        screen.screen([(g,) for g in singles])
+        if double:
+            pairs = candidate_pairs(screen, singles)
+            print("Double knockouts to screen: ", len(pairs))
+            screen.screen(pairs)
+    return screen.to_dataframe()
+
+
+if __name__ == "__main__":
+    double = sys.argv[1] == "double"
+    metric = sys.argv[2]
+    model_path, config = dFBA_engine.config_from_args(sys.argv[3], sys.argv[4:])
+
+    df = run_screen(model_path, config, metric, double)
+    df.to_csv(output_path, index = False)
+    print(df.head(20))
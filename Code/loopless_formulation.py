@@ -0,0 +1,139 @@
+###################
+# loopless_formulation.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This file is a drop-in replacement for cobra's loopless_solution() that keeps the parts of the problem that only depend on the network
+# loopless_solution() (CycleFreeFlux) is called at every timestep and rebuilds its objective from symbolic expressions every time,
+# and its model context then rebuilds the original objective the same way, which takes more time than the two solves themselves
+# Here the internal and boundary reactions, their variables, and the growth objective's coefficients are found once per model,
+# and each step only changes objective coefficients and variable bounds, making exactly the same changes to the LP as loopless_solution()
+###################
+
+# Import packages
+import math
+import weakref
+import pandas
+from optlang.symbolics import Zero
+
+# The model and its reactions are only referenced weakly, so a formulation kept in _formulations doesn't keep its model alive
+class LooplessFormulation:
+    def __init__(self, model):
+        self.model = weakref.ref(model)
+        self.reaction_count = len(model.reactions)
+        # (reaction, forward variable, reverse variable), looking the variables up through cobra every step is slow
+        self.boundary = [(weakref.proxy(r), r.forward_variable, r.reverse_variable) for r in model.reactions if r.boundary]
+        self.internal = [(weakref.proxy(r), r.forward_variable, r.reverse_variable) for r in model.reactions if not r.boundary]
+        self.objective_coefficients = objective_coefficients(model)
+        self.direction = model.objective.direction
+
+    # The formulation is only valid while the model has the same reactions and objective
+    def matches(self, model):
+        return (model is self.model() and len(model.reactions) == self.reaction_count and model.objective.direction == self.direction
+                and objective_coefficients(model) == self.objective_coefficients)
+
+    # Same as cobra.flux_analysis.loopless.loopless_solution(model)
+    # duals, if given, is (reaction IDs, constraint names): the reduced costs and shadow prices of those from the first (growth) LP are
+    # put in the solution's reduced_costs and shadow_prices, since the duals of the loopless LP say nothing about growth. They're None if the growth LP wasn't optimal
+    def solve(self, duals=None):
+        model = self.model()
+        model.slim_optimize()
+        # Without a first solution there's nothing to remove loops from, and no duals
+        if model.solver.status != "optimal":
+            solution = model.optimize(objective_sense = None)
+            if duals is not None:
+                solution.reduced_costs = None
+                solution.shadow_prices = None
+            return solution
+        primals = model.solver.primal_values
+        if duals is not None:
+            reduced_costs, shadow_prices = growth_duals(model, *duals)
+
+        # Row that tracks the growth objective, as in loopless_solution (it also keeps the LP the same shape, so GLPK takes the same path)
+        # Added to the solver directly, since model.add_cons_vars() would record it in the model context simulate() has open
+        constraint = model.problem.Constraint(Zero, lb = -1e32, name = "loopless_obj_constraint")
+        model.solver.add(constraint)
+        model.solver.update()
+        constraint.set_linear_coefficients(self.objective_coefficients)
+
+        objective = model.solver.objective
+        objective.set_linear_coefficients({v: 0 for v in self.objective_coefficients})
+        objective.direction = "min"
+
+        # Boundary fluxes are fixed and internal fluxes can't change direction, the objective is the total internal flux
+        # Setting a variable to the bounds it already has doesn't change the LP, so only reactions whose bounds change are touched
+        changed = []
+        for rxn, forward, reverse in self.boundary:
+            flux = primals[forward.name] - primals[reverse.name]
+            lower, upper = rxn.lower_bound, rxn.upper_bound
+            if (lower, upper) != (flux, flux):
+                changed.append((forward, reverse, lower, upper))
+                _set_variable_bounds(forward, reverse, flux, flux)
+        loopless_variables = []
+        for rxn, forward, reverse in self.internal:
+            flux = primals[forward.name] - primals[reverse.name]
+            lower, upper = rxn.lower_bound, rxn.upper_bound
+            if flux >= 0:
+                new_lower, new_upper = max(0, lower), max(flux, upper)
+                loopless_variables.append(forward)
+            else:
+                new_lower, new_upper = min(flux, lower), min(0, upper)
+                loopless_variables.append(reverse)
+            if (lower, upper) != (new_lower, new_upper):
+                changed.append((forward, reverse, lower, upper))
+                _set_variable_bounds(forward, reverse, new_lower, new_upper)
+        objective.set_linear_coefficients({v: 1.0 for v in loopless_variables})
+
+        try:
+            solution = model.optimize(objective_sense = None)
+            solution.objective_value = constraint.primal
+            if duals is not None:
+                solution.reduced_costs = reduced_costs
+                solution.shadow_prices = shadow_prices
+        finally:
+            # Undo in reverse order, as a model context would
+            for forward, reverse, lower, upper in reversed(changed):
+                _set_variable_bounds(forward, reverse, lower, upper)
+            objective.set_linear_coefficients({v: 0 for v in loopless_variables})
+            objective.set_linear_coefficients(self.objective_coefficients)
+            objective.direction = self.direction
+            model.solver.remove(constraint)
+        return solution
+
+# Reduced costs of reactions' net flux (the forward variable's; cobra's Solution.reduced_costs subtracts the reverse variable's too, which doubles it)
+# and shadow prices of constraints, in the model's last solution. Reactions and constraints the model doesn't have are left out
+def growth_duals(model, reaction_IDs, constraint_names):
+    reduced_costs = {x: model.reactions.get_by_id(x).forward_variable.dual for x in reaction_IDs if x in model.reactions}
+    shadow_prices = {x: model.constraints[x].dual for x in constraint_names if x in model.constraints}
+    return pandas.Series(reduced_costs, dtype = float, name = "reduced_costs"), pandas.Series(shadow_prices, dtype = float, name = "shadow_prices")
+
+# Set the solver bounds of a reaction's variables the way cobra's Reaction.bounds does, without recording it in an open model context
+# The reaction's own bounds are left alone, so its attributes keep the values they had before the step
+def _set_variable_bounds(forward, reverse, lower, upper):
+    lower = None if math.isinf(lower) else lower
+    upper = None if math.isinf(upper) else upper
+    if lower is not None and lower > 0:
+        forward.set_bounds(lb = lower, ub = upper)
+        reverse.set_bounds(lb = 0, ub = 0)
+    elif upper is not None and upper < 0:
+        forward.set_bounds(lb = 0, ub = 0)
+        reverse.set_bounds(lb = -upper, ub = None if lower is None else -lower)
+    else:
+        forward.set_bounds(lb = 0, ub = upper)
+        reverse.set_bounds(lb = 0, ub = None if lower is None else -lower)
+
+# The growth objective's coefficients, by solver variable
+def objective_coefficients(model):
+    return model.objective.get_linear_coefficients(model.objective.variables)
+
+# One formulation per model object, dropped with the model
+_formulations = weakref.WeakKeyDictionary()
+
+def get_formulation(model):
+    formulation = _formulations.get(model)
+    if formulation is None or not formulation.matches(model):
+        formulation = LooplessFormulation(model)
+        _formulations[model] = formulation
+    return formulation
+
+def loopless_solution(model, duals=None):
+    return get_formulation(model).solve(duals)
@@ -0,0 +1,162 @@
+###################
+# mixture_screen.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script screens substrate mixtures for co-metabolism: which substrates are used up, in what order, and how much biomass each mixture gives
+# cometabolism_dFBA.py runs one mixture at a time and feeds every substrate at 1 mM; depolymerized lignin mixes many substrates at different concentrations
+# Mixtures come from a table of compositions, or are every combination of k substrates from a list
+# Its output is a table with one line per mixture, its status, and its consumption times, consumption order, and biomass
+###################
+
+# Import packages
+import sys
+import os
+import itertools
+import multiprocessing
+import numpy
+import pandas
+import dFBA_engine
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes
+concentration = 1.0				# mmol/L of each substrate in the combinations of k substrates, as in cometabolism_dFBA.py
+growth_threshold = 1e-9			# biomass flux below this counts as no growth
+consumed_threshold = 0.0000001	# mmol/L, a substrate below this counts as used up (the dFBA loop sets it to 0 there)
+digits = 9						# significant digits of the concentrations when telling mixtures apart
+solver_timeout = 30				# seconds allowed per solve
+output_path = "mixture_screen_results.csv"
+
+# Usage:
+# > python mixture_screen.py <model> <mixtures CSV>
+# > python mixture_screen.py <model> subsets <k> <substrate> <substrate> [<substrate> ...]
+# The mixtures CSV has one row per mixture, an optional mixture column with its name, and one column per substrate with its mmol/L (blank or 0 if it's not in the mixture)
+# Substrate IDs are the ones cometabolism_dFBA.py takes (dFBA_engine.all_substrates), e.g. exVA, expHBA, exSA, exC00031 (glucose), exRRGGE
+# k can be one number or a comma-separated list (1,2,3), and every combination of k of the substrates is fed at concentration mmol/L each
+# For example:
+# > python mixture_screen.py iNovo_base_2022.xml example_mixtures.csv
+# > python mixture_screen.py iNovo_base_2022.xml subsets 1,2 expHBA exSA exVA exFA
+#
+# Most mixtures never reach dFBA:
+#	same as - the mixture has the same substrates at the same concentrations as one that was already run, whatever their order or names
+#	infeasible or no growth - the static FBA pre-screen at the starting conditions (see dFBA_engine.prescreen), with its reason
+# Output columns:
+#	mixture, substrates (ID=mmol/L), number_of_substrates, status, final_biomass and max_biomass (g/L), time_to_depletion (minutes until every substrate is used up),
+#	consumption_order (substrates in the order they were used up, those used up in the same step joined by =), not_consumed (substrates left at the end),
+#	and <substrate>_consumed, the minutes until that substrate was used up (NaN if it wasn't, or isn't in the mixture)
+
+
+##############
+# Mixtures
+
+# One list of (name, {substrate: mmol/L}) per source; substrates with no concentration are left out
+def read_mixtures(path):
+    df = pandas.read_csv(path)
+    names = df["mixture"].astype(str).to_list() if "mixture" in df.columns else ["mixture" + str(k + 1) for k in range(len(df))]
+    columns = [x for x in df.columns if x != "mixture"]
+    unknown = [x for x in columns if x not in dFBA_engine.all_substrates]
+    if len(unknown) > 0:
+        raise ValueError("Not substrates the model can be fed: " + ", ".join(unknown))
+    if (df[columns] < 0).any().any():
+        raise ValueError("Concentrations can't be negative")
+    mixtures = []
+    for name, (index, row) in zip(names, df[columns].iterrows()):
+        mixtures.append((name, {x: float(row[x]) for x in columns if pandas.notna(row[x]) and row[x] > 0}))
+    return mixtures
+
+def subset_mixtures(substrates, sizes, concentration = concentration):
+    unknown = [x for x in substrates if x not in dFBA_engine.all_substrates]
+    if len(unknown) > 0:
+        raise ValueError("Not substrates the model can be fed: " + ", ".join(unknown))
+    mixtures = []
+    for k in sizes:
+        for subset in itertools.combinations(dict.fromkeys(substrates), k):
+            mixtures.append(("+".join(subset), {x: concentration for x in subset}))
+    return mixtures
+
+# Mixtures with the same substrates at the same concentrations get the same key
+def mixture_key(composition):
+    return tuple(sorted((x, float(numpy.format_float_positional(c, precision = digits, unique = False, fractional = False))) for x, c in composition.items()))
+
+
+##############
+# Workers
+
+_worker = {}
+
+def init_worker(model_path):
+    _worker["models"] = dFBA_engine.get_models(model_path, "cometabolism")
+
+def mixture_config(key):
+    return dFBA_engine.make_config("cometabolism", dict(key), solver_timeout = solver_timeout)
+
+def prescreen(key):
+    return key, dFBA_engine.prescreen(_worker["models"], mixture_config(key), growth_threshold)
+
+# Runs one mixture and returns its key, summary, and the minutes until each of its substrates was used up (NaN if it wasn't)
+def run_mixture(key):
+    config = mixture_config(key)
+    tracking = dFBA_engine.simulate(_worker["models"], config)
+    consumed = {}
+    for x in config["substrates"]:
+        used_up = [t for t, c in zip(tracking["Time"], tracking[x]) if c is not None and c <= consumed_threshold]
+        consumed[x] = float(used_up[0]) if len(used_up) > 0 else float("nan")
+    return key, dFBA_engine.summarize(tracking, config), consumed
+
+
+##############
+# Screen
+
+# Substrates in the order they were used up, ties joined by =, and the ones that weren't
+def consumption_order(consumed):
+    times = sorted(set(t for t in consumed.values() if not numpy.isnan(t)))
+    order = " > ".join(" = ".join(sorted(x for x in consumed if consumed[x] == t)) for t in times)
+    return order, " ".join(sorted(x for x in consumed if numpy.isnan(consumed[x])))
+
+def run_screen(model_path, mixtures, processes = processes):
+    unique = {}
+    for name, composition in mixtures:
+        unique.setdefault(mixture_key(composition), []).append(name)
+    print("Mixtures: ", len(mixtures), ", distinct: ", len(unique))
+
+    results = {}		# key: [status, summary, consumed]
+    with multiprocessing.Pool(processes, initializer = init_worker, initargs = (model_path,)) as pool:
+        # Static FBA pre-screen for mixtures that can't grow
+        to_run = []
+        for key, (status, reason) in pool.imap_unordered(prescreen, list(unique), chunksize = 4):
+            if dFBA_engine.should_simulate(status, mixture_config(key)):
+                to_run.append(key)
+            else:
+                results[key] = [status + " (" + reason + ")", dFBA_engine.skipped_summary(mixture_config(key)), {x: float("nan") for x, c in key}]
+        print("Pre-screened out: ", len(unique) - len(to_run), ", dFBA runs: ", len(to_run))
+
+        for count, (key, summary, consumed) in enumerate(pool.imap_unordered(run_mixture, to_run)):
+            results[key] = ["viable", summary, consumed]
+            if (count + 1) % 10 == 0:
+                print("Finished dFBA runs: ", count + 1, " of ", len(to_run))
+
+    substrates = [x for x in dFBA_engine.all_substrates if any(x in composition for name, composition in mixtures)]
+    rows = []
+    for name, composition in mixtures:
+        key = mixture_key(composition)
+        status, summary, consumed = results[key]
+        if name != unique[key][0]:
+            status = "same as " + unique[key][0]
+        order, not_consumed = consumption_order(consumed)
+        rows.append([name, " ".join(x + "=" + str(c) for x, c in key), len(key), status, summary["final_biomass"], summary["max_biomass"], summary["time_to_depletion"], order, not_consumed]
+                    + [consumed.get(x, float("nan")) for x in substrates])
+    df = pandas.DataFrame(rows, columns = ["mixture", "substrates", "number_of_substrates", "status", "final_biomass", "max_biomass", "time_to_depletion", "consumption_order", "not_consumed"]
+                          + [x + "_consumed" for x in substrates])
+    return df.sort_values("final_biomass", ascending = False, na_position = "last", kind = "stable")
+
+
+if __name__ == "__main__":
+    model_path = sys.argv[1]
+    if sys.argv[2] == "subsets":
+        mixtures = subset_mixtures(sys.argv[4:], [int(x) for x in sys.argv[3].split(",")])
+    else:
+        mixtures = read_mixtures(sys.argv[2])
+
+    df = run_screen(model_path, mixtures)
+    df.to_csv(output_path, index = False)
+    print(df.head(20).to_string(index = False))
@@ -0,0 +1,211 @@
+###################
+# model_compression.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This file builds a smaller version of a prepared model for one medium, for use in the dFBA loop
+# With only a few exchanges open (vanillic acid plus the mineral base, for example), many of the ~600 reactions can't carry flux, and many others form unbranched chains
+# Blocked reactions are removed (found with flux variability analysis) and each unbranched chain is lumped into one reaction
+# Every reaction of the full model maps back to one reaction of the compressed model times a coefficient (or to zero if it was blocked), so full-model fluxes can be rebuilt exactly
+###################
+
+# Import packages
+import os
+import copy
+import json
+import hashlib
+import multiprocessing
+import pandas
+from cobra.flux_analysis import find_blocked_reactions
+from cobra.util.solver import linear_reaction_coefficients
+
+###############
+# Settings
+cache_dir = "compressed_models"		# compressions are saved here as json, set to None to only keep them in memory
+open_bound = 1000.					# bound given to open medium exchanges while looking for blocked reactions, simulate() only ever sets smaller ones
+zero_cutoff = 1e-12					# stoichiometric coefficients smaller than this are treated as zero after lumping
+
+
+##############
+# Compression
+
+class Compression:
+    # blocked is a list of reaction IDs, mapping is a dictionary of full-model reaction ID: [compressed reaction ID, coefficient]
+    def __init__(self, reactions, blocked, mapping):
+        self.reactions = reactions
+        self.blocked = set(blocked)
+        self.mapping = mapping
+
+    # The compressed reaction a full-model reaction is part of, or None if it was blocked
+    def reaction_for(self, rxn_ID):
+        if rxn_ID in self.blocked:
+            return None
+        return self.mapping[rxn_ID][0]
+
+    # Full-model fluxes from a compressed solution: each reaction's flux is its coefficient times the flux of the lumped reaction it's part of
+    def expand(self, fluxes):
+        values = [0.0 if x in self.blocked else self.mapping[x][1] * fluxes[self.mapping[x][0]] for x in self.reactions]
+        return pandas.Series(values, index = self.reactions, name = "fluxes")
+
+    def to_dict(self):
+        return {"reactions": self.reactions, "blocked": sorted(self.blocked), "mapping": self.mapping}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["reactions"], d["blocked"], d["mapping"])
+
+# Reactions that must keep their identity: exchanges and demands (their bounds are set every step), the objective,
+# reactions in extra constraints like SA_flux and OE_flux, and anything else the caller needs by name (the PDC aromatic transports)
+def protected_reactions(model, extra=()):
+    protected = set(r.id for r in model.boundary)
+    protected.update(r.id for r in linear_reaction_coefficients(model))
+    protected.update(extra)
+    metabolite_IDs = set(m.id for m in model.metabolites)
+    variables = {}
+    for r in model.reactions:
+        variables[r.forward_variable.name] = r.id
+        variables[r.reverse_variable.name] = r.id
+    for constraint in model.constraints:
+        if constraint.name not in metabolite_IDs:
+            protected.update(variables[v.name] for v in constraint.variables if v.name in variables)
+    return protected
+
+# Reactions that can't carry flux when only the given exchanges are open
+# Extra constraints (OE_flux, for example) are opened first, since their coefficients change from run to run
+def medium_blocked_reactions(model, exchange_bounds, free_constraints=(), processes=None):
+    # Worker processes of a pool can't start their own, so FVA runs in one process there
+    if multiprocessing.current_process().daemon:
+        processes = 1
+    freed = [model.constraints[x] for x in free_constraints if x in model.constraints]
+    saved = [(x.lb, x.ub) for x in freed]
+    try:
+        with model:
+            for constraint in freed:
+                constraint.lb = None
+                constraint.ub = None
+            for rxn_ID in exchange_bounds:
+                rxn = model.reactions.get_by_id(rxn_ID)
+                rxn.bounds = (-open_bound, open_bound) if exchange_bounds[rxn_ID] > 0 else (0, 0)
+            blocked = find_blocked_reactions(model, processes = processes)
+    finally:
+        for constraint, (lb, ub) in zip(freed, saved):
+            constraint.lb = None
+            constraint.ub = ub
+            constraint.lb = lb
+    return [r.id if hasattr(r, "id") else r for r in blocked]
+
+# Lump unbranched chains: a metabolite made by one reaction and used by one other fixes the ratio of their fluxes,
+# so the two are replaced by their sum (scaled by that ratio) and the metabolite disappears. Repeats until no such metabolite is left
+def lump_chains(model, blocked, protected):
+    blocked = set(blocked)
+    stoichiometry = {r.id: {m.id: c for m, c in r.metabolites.items()} for r in model.reactions if r.id not in blocked}
+    mapping = {x: [x, 1.0] for x in stoichiometry}
+    members = {x: [x] for x in stoichiometry}
+    reactions_of = {}
+    for x in stoichiometry:
+        for m in stoichiometry[x]:
+            reactions_of.setdefault(m, set()).add(x)
+
+    changed = True
+    while changed:
+        changed = False
+        for m in list(reactions_of.keys()):
+            if m not in reactions_of or len(reactions_of[m]) != 2:
+                continue
+            r1, r2 = sorted(reactions_of[m])
+            if r1 in protected or r2 in protected:
+                continue
+            # Steady state for m: a * v1 + b * v2 = 0, so v2 = k * v1
+            k = -stoichiometry[r1][m] / stoichiometry[r2][m]
+            for x in members[r2]:
+                mapping[x] = [r1, mapping[x][1] * k]
+            members[r1] = members[r1] + members.pop(r2)
+            for met, c in stoichiometry.pop(r2).items():
+                reactions_of[met].discard(r2)
+                stoichiometry[r1][met] = stoichiometry[r1].get(met, 0.0) + k * c
+                reactions_of[met].add(r1)
+            for met in list(stoichiometry[r1].keys()):
+                if met == m or abs(stoichiometry[r1][met]) < zero_cutoff:
+                    del stoichiometry[r1][met]
+                    reactions_of[met].discard(r1)
+            for met in [x for x in reactions_of if len(reactions_of[x]) == 0]:
+                del reactions_of[met]
+            changed = True
+    return mapping
+
+# Build the compressed cobra model from a compression, on a copy of the full model
+def build(model, compression):
+    compressed = copy.deepcopy(model)
+    compressed.remove_reactions([compressed.reactions.get_by_id(x) for x in compression.blocked], remove_orphans = True)
+
+    groups = {}
+    for x in compression.mapping:
+        if x not in compression.blocked:
+            groups.setdefault(compression.mapping[x][0], []).append(x)
+
+    to_remove = []
+    for rep in groups:
+        if len(groups[rep]) == 1:
+            continue
+        lumped = compressed.reactions.get_by_id(rep)
+        stoichiometry = {}
+        lower, upper = -float("inf"), float("inf")
+        for x in groups[rep]:
+            rxn = compressed.reactions.get_by_id(x)
+            c = compression.mapping[x][1]
+            for m, coefficient in rxn.metabolites.items():
+                stoichiometry[m] = stoichiometry.get(m, 0.0) + c * coefficient
+            # v_member = c * v_lumped has to stay inside the member's bounds
+            low, high = (rxn.lower_bound / c, rxn.upper_bound / c) if c > 0 else (rxn.upper_bound / c, rxn.lower_bound / c)
+            lower, upper = max(lower, low), min(upper, high)
+            if x != rep:
+                to_remove.append(rxn)
+        lumped.subtract_metabolites(lumped.metabolites)
+        lumped.add_metabolites({m: c for m, c in stoichiometry.items() if abs(c) >= zero_cutoff})
+        lumped.bounds = (lower, upper)
+    compressed.remove_reactions(to_remove, remove_orphans = True)
+    return compressed
+
+
+##############
+# Caching
+
+# Hash of the parts of a model that the compression depends on
+def model_hash(model):
+    h = hashlib.sha256()
+    for r in model.reactions:
+        h.update((r.id + ":" + r.build_reaction_string() + ":" + str(r.bounds) + "\n").encode())
+    for constraint in model.constraints:
+        h.update((constraint.name + ":" + str(constraint.lb) + ":" + str(constraint.ub) + "\n").encode())
+    return h.hexdigest()
+
+_cache = {}
+
+# The compressed model for a prepared model and medium
+# exchange_bounds is a dictionary of exchange reaction ID: maximum rate, as from dFBA_engine.initial_exchange_bounds(), only which ones are zero matters
+# Returns (compressed model, Compression), from memory or cache_dir if this model and medium were compressed before
+def compress(model, exchange_bounds, free_constraints=(), protect=(), processes=None):
+    closed = sorted(x for x in exchange_bounds if exchange_bounds[x] <= 0)
+    opened = sorted(x for x in exchange_bounds if exchange_bounds[x] > 0)
+    key = hashlib.sha256((model_hash(model) + "|" + ",".join(closed) + "|" + ",".join(opened) + "|" + ",".join(sorted(free_constraints)) + "|" + ",".join(sorted(protect))).encode()).hexdigest()
+    if key in _cache:
+        return _cache[key]
+
+    compression = None
+    path = None if cache_dir is None else os.path.join(cache_dir, key[:32] + ".json")
+    if path is not None and os.path.exists(path):
+        with open(path) as f:
+            compression = Compression.from_dict(json.load(f))
+    if compression is None:
+        blocked = medium_blocked_reactions(model, exchange_bounds, free_constraints, processes)
+        protected = protected_reactions(model, protect)
+        blocked = [x for x in blocked if x not in protected]
+        compression = Compression([r.id for r in model.reactions], blocked, lump_chains(model, blocked, protected))
+        if path is not None:
+            # Write to a temporary file first so other processes never read half a file
+            os.makedirs(cache_dir, exist_ok = True)
+            with open(path + "." + str(os.getpid()), "w") as f:
+                json.dump(compression.to_dict(), f)
+            os.replace(path + "." + str(os.getpid()), path)
+
+    _cache[key] = (build(model, compression), compression)
+    return _cache[key]
@@ -0,0 +1,66 @@
+###################
+# multi_model_dFBA.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script runs one dFBA scenario on several model versions at the same time, one worker process per model
+# It replaces running cometabolism_dFBA.py once per model by hand, which overwrites dFBA_results.csv every time
+# Its output is a single long-format dataframe keyed by model that can be plotted with a separate script
+###################
+
+# Import packages
+import sys
+import os
+import multiprocessing
+import pandas
+import dFBA_engine
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes, no more than one per model is used
+output_path = "multi_model_dFBA_results.csv"
+
+# Usage:
+# > python multi_model_dFBA.py <scenario> <comma-separated list of models> <remaining arguments of the scenario's script>
+# The scenario is cometabolism, PDC, or bioproduct. The remaining arguments are the ones the matching script takes after the model
+# For example, the comparison behind the *_SA_VA_pHBA_dFBA_results-2022.csv files:
+# > python multi_model_dFBA.py cometabolism iNovo_base_2022.xml,iNovo_vanAB_2022.xml,iNovo_hypo_demeth_2022.xml exSA exVA expHBA
+
+
+# Run the scenario on one model and return its results in long format
+def run_model(task):
+    model_path, config = task
+    models = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    tracking = dFBA_engine.simulate(models, config)
+    summary = dFBA_engine.summarize(tracking, config)
+
+    df = dFBA_engine.tracking_to_dataframe(tracking)
+    df.index.name = "timepoint"
+    df = df.reset_index().melt(id_vars = ["timepoint", "Time"], var_name = "compound", value_name = "concentration")
+    df.insert(0, "model", os.path.basename(model_path))
+    return model_path, df, summary
+
+# Run every model and return one long dataframe with the models in the order they were given
+def run_models(model_paths, config, processes = processes):
+    tasks = [(x, config) for x in model_paths]
+    results = {}
+    summaries = {}
+    with multiprocessing.Pool(min(processes, len(tasks))) as pool:
+        for model_path, df, summary in pool.imap_unordered(run_model, tasks):
+            print("Finished: ", model_path)
+            results[model_path] = df
+            summaries[model_path] = summary
+    df = pandas.concat([results[x] for x in model_paths], ignore_index = True)
+    return df, summaries
+
+
+if __name__ == "__main__":
+    scenario = sys.argv[1]
+    model_paths = [x for x in sys.argv[2].split(",") if x != ""]
+    # The model path is only a placeholder here, each worker gets its own
+    model_path, config = dFBA_engine.config_from_args(scenario, [model_paths[0]] + sys.argv[3:])
+
+    df, summaries = run_models(model_paths, config)
+    df.to_csv(output_path, index = False)
+
+    for model_path in model_paths:
+        print(model_path, summaries[model_path])
@@ -0,0 +1,170 @@
+###################
+# optimize_PDC_ratio.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script searches for the aromatic:glucose ratio (and optionally the total substrate loading) that gives the best PDC production rate in g/L/hr
+# It runs the same simulation as PDC_dFBA.py, but instead of a fixed grid of ratios it zooms in on the optimum
+# Its output is a table of every point evaluated and a printout of the best one
+###################
+
+# Import packages
+import sys
+import os
+import multiprocessing
+import numpy
+import pandas
+import dFBA_engine
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes
+points_per_round = 5			# aromatic fractions evaluated per round of the 1-D search; each round runs them in parallel, so more than this many cores sit idle
+fraction_bounds = [0.05, 0.95]	# aromatic fraction of the total loading to search between
+fraction_precision = 0.01		# stop once the aromatic fraction is known to this precision
+total_precision = 0.1			# same for the total loading, in mmol/L (only used when searching total loading)
+compress_model = False			# solve a compressed model for the medium (see model_compression.py), faster but degenerate steps can pick a different optimum
+output_path = "PDC_ratio_optimization.csv"
+
+# Usage:
+# > python optimize_PDC_ratio.py <model> <aromatic compound ID> <total loading in mmol/L>
+# searches the ratio at a fixed total loading, for example 3:2 VA:glucose in the paper is 5 mmol/L total:
+# > python optimize_PDC_ratio.py iNovo_base_2022.xml exVA 5.0
+# Giving the total loading as low:high searches both the ratio and the total loading:
+# > python optimize_PDC_ratio.py iNovo_base_2022.xml exVA 2.0:10.0
+#
+# Note that the PDC rate is calculated from the timepoint when PDC peaks, so it moves in steps of one timepoint_interval
+# The search assumes there is a single best ratio, which is what the fixed-grid results in Model_results/ show
+# Every point gets a static FBA pre-screen first, and points whose starting conditions are infeasible are not run (their rate is left empty)
+
+
+##############
+# Evaluating points
+
+_worker = {}
+
+def init_worker(model_path):
+    _worker["models"] = dFBA_engine.get_models(model_path, "PDC")
+
+# point is (aromatic compound ID, aromatic fraction, total loading)
+# Points the static FBA pre-screen rules out get no rate
+def evaluate_point(point):
+    aromatic, fraction, total = point
+    config = dFBA_engine.make_config("PDC", {aromatic: fraction * total, "exC00031": (1 - fraction) * total}, compress = compress_model)
+    status, reason = dFBA_engine.prescreen(_worker["models"], config)
+    if not dFBA_engine.should_simulate(status, config):
+        return point, float("nan"), status + ": " + reason
+    tracking = dFBA_engine.simulate(_worker["models"], config)
+    return point, dFBA_engine.summarize(tracking, config)["g_L_hr"], status
+
+# Keeps every evaluation, so points that come up again in a later round are not re-run
+# Candidate points are snapped to the precision grid, which makes repeats more likely
+class PDCObjective:
+    def __init__(self, pool, aromatic):
+        self.pool = pool
+        self.aromatic = aromatic
+        self.results = {}
+        self.prescreen = {}
+        self.order = []
+
+    def key(self, fraction, total):
+        fraction = round(round(fraction / fraction_precision) * fraction_precision, 10)
+        total = round(round(total / total_precision) * total_precision, 10)
+        return (self.aromatic, fraction, total)
+
+    # Evaluate a list of (fraction, total) points in parallel and return their rates
+    def evaluate(self, points, round_number):
+        keys = [self.key(f, t) for f, t in points]
+        missing = []
+        for k in keys:
+            if k not in self.results and k not in missing:
+                missing.append(k)
+        for point, rate, status in self.pool.imap_unordered(evaluate_point, missing):
+            self.results[point] = rate
+            self.prescreen[point] = status
+            self.order.append((round_number, point))
+        return [(k[1], k[2], self.results[k]) for k in keys]
+
+    def best(self):
+        k = max(self.results, key = lambda x: -numpy.inf if numpy.isnan(self.results[x]) else self.results[x])
+        return k[1], k[2], self.results[k]
+
+    def to_dataframe(self):
+        rows = []
+        for round_number, point in self.order:
+            aromatic, fraction, total = point
+            rows.append([round_number, aromatic, fraction, total, fraction * total, (1 - fraction) * total, self.prescreen[point], self.results[point]])
+        return pandas.DataFrame(rows, columns = ["round", "aromatic", "aromatic_fraction", "total_mM", "aromatic_mM", "glucose_mM", "prescreen", "g/L/hr"])
+
+
+##############
+# Searches
+
+# 1-D: evaluate evenly spaced points across the bracket in parallel, then shrink the bracket to the neighbors of the best point
+def search_fraction(objective, total, points_per_round):
+    low, high = fraction_bounds
+    round_number = 0
+    while True:
+        round_number += 1
+        candidates = sorted(set(objective.key(f, total)[1] for f in numpy.linspace(low, high, points_per_round)))
+        results = objective.evaluate([(f, total) for f in candidates], round_number)
+        rates = [-numpy.inf if numpy.isnan(r) else r for f, t, r in results]
+        best = int(numpy.argmax(rates))
+        print("Round ", round_number, ": best aromatic fraction ", candidates[best], ", g/L/hr ", rates[best])
+        if high - low <= 2 * fraction_precision or len(candidates) < 3:
+            break
+        low = candidates[max(best - 1, 0)]
+        high = candidates[min(best + 1, len(candidates) - 1)]
+
+# 2-D: compass search with every poll point evaluated in parallel
+# Move to the best poll point if it improves on the center, otherwise halve the step sizes
+def search_fraction_and_total(objective, total_bounds):
+    fraction = objective.key(numpy.mean(fraction_bounds), 0)[1]
+    total = objective.key(0, numpy.mean(total_bounds))[2]
+    fraction_step = (fraction_bounds[1] - fraction_bounds[0]) / 4
+    total_step = (total_bounds[1] - total_bounds[0]) / 4
+    # A center the pre-screen ruled out has no rate, so any poll point with one is better
+    center_rate = objective.evaluate([(fraction, total)], 0)[0][2]
+    center_rate = -numpy.inf if numpy.isnan(center_rate) else center_rate
+    round_number = 0
+
+    while fraction_step >= fraction_precision or total_step >= total_precision:
+        round_number += 1
+        polls = []
+        for df, dt in [(fraction_step, 0), (-fraction_step, 0), (0, total_step), (0, -total_step)]:
+            f = min(max(fraction + df, fraction_bounds[0]), fraction_bounds[1])
+            t = min(max(total + dt, total_bounds[0]), total_bounds[1])
+            polls.append((f, t))
+        results = [x for x in objective.evaluate(polls, round_number) if not numpy.isnan(x[2])]
+        best = max(results, key = lambda x: x[2]) if len(results) > 0 else None
+        if best is not None and best[2] > center_rate:
+            fraction, total, center_rate = best
+        else:
+            fraction_step = fraction_step / 2 if fraction_step >= fraction_precision else fraction_step
+            total_step = total_step / 2 if total_step >= total_precision else total_step
+        print("Round ", round_number, ": aromatic fraction ", fraction, ", total ", total, " mM, g/L/hr ", center_rate)
+
+def optimize(model_path, aromatic, total, processes = processes):
+    with multiprocessing.Pool(processes, initializer = init_worker, initargs = (model_path,)) as pool:
+        objective = PDCObjective(pool, aromatic)
+        if isinstance(total, (list, tuple)):
+            search_fraction_and_total(objective, total)
+        else:
+            search_fraction(objective, total, points_per_round)
+    return objective
+
+
+if __name__ == "__main__":
+    model_path = sys.argv[1]
+    aromatic = sys.argv[2]
+    if ":" in sys.argv[3]:
+        total = [float(x) for x in sys.argv[3].split(":")]
+    else:
+        total = float(sys.argv[3])
+
+    objective = optimize(model_path, aromatic, total)
+    objective.to_dataframe().to_csv(output_path, index = False)
+
+    fraction, best_total, rate = objective.best()
+    print("dFBA runs: ", len(objective.results))
+    print("Best aromatic:glucose ", round(fraction * best_total, 4), ":", round((1 - fraction) * best_total, 4), " mmol/L")
+    print("g/L/hr PDC produced: ", rate)
@@ -0,0 +1,181 @@
+###################
+# phase_plane_PDC.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script maps growth and PDC production of the PDC strain over a grid of aromatic and glucose uptake rates (a phenotype phase plane)
+# Each point is a static FBA in two parts, as in each dFBA step: the wild type sets the aromatic transport fluxes, and the strain is solved with them held
+# It's cheap next to PDC_dFBA.py runs, so it can show which aromatic:glucose feeds are worth a full dFBA sweep
+# Rows of the grid are solved in parallel, and each point in a row starts the solver from the basis of the point before it
+###################
+
+# Import packages
+import sys
+import os
+import contextlib
+import multiprocessing
+import numpy
+import pandas
+import dFBA_engine
+import bound_updates
+import loopless_formulation
+import sensitivity_dFBA
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes
+points = 21						# grid points along each axis, from 0 to the maximum rate
+max_aromatic_rate = 0.05		# mmol/gDW/min, the largest aromatic uptake rate on the grid
+max_glucose_rate = 0.05			# mmol/gDW/min, the largest glucose uptake rate on the grid
+gene_deletions = []				# more gene deletions in the wild type model, as in PDC_dFBA.py
+digits = 6						# significant digits of the shadow prices when telling regions apart
+output_path = "PDC_phase_plane.csv"
+
+# Usage:
+# > python phase_plane_PDC.py <model> <aromatic compound ID> [<max aromatic rate> <max glucose rate> <points>]
+# For example:
+# > python phase_plane_PDC.py iNovo_base_2022.xml exVA
+# > python phase_plane_PDC.py iNovo_base_2022.xml exSA 0.02 0.04 41
+#
+# The rates are upper limits on uptake, set the way the dFBA loop sets them (lower bound -rate, upper bound rate), on both models
+# Minerals and the environment exchanges get the bounds of the first step of a PDC run (see dFBA_engine.initial_exchange_bounds)
+# Output file, one row per grid point:
+#	aromatic_rate, glucose_rate - the uptake limits of the point
+#	status - optimal, or the solver status of the model that couldn't be solved
+#	wild_type_growth, growth - biomass flux (1/min) of the wild type and of the PDC strain
+#	PDC - the strain's PDC flux (mmol/gDW/min)
+#	aromatic_price, glucose_price - growth gained per unit more uptake allowed, from the wild type's reduced costs (0 where that uptake doesn't limit growth)
+#	aromatic_slope, glucose_slope - the same for the strain's growth, from the differences between neighbouring grid points
+#	region - points with the same shadow prices are in the same region, numbered from 1 in order of first appearance; 0 where the point couldn't be solved
+#	limiting - which uptake limits the wild type's growth: aromatic, glucose, both, or neither (a mineral does)
+# Shadow prices come from the wild type because the strain can't change its aromatic uptake: its transports are held to the wild type's fluxes
+# Growth and shadow prices are the same whichever optimum the solver finds; PDC can differ between optima with equal growth
+
+
+##############
+# Grid rows
+
+_worker = {}
+
+def init_worker(model_path):
+    _worker["models"] = dFBA_engine.get_models(model_path, "PDC")
+
+# Solves one row of the grid: one aromatic rate and every glucose rate
+# task is (aromatic compound ID, aromatic rate, glucose rates, gene deletions); returns a dictionary of arrays, one value per glucose rate
+def solve_row(task):
+    aromatic, aromatic_rate, glucose_rates, deletions = task
+    models = _worker["models"]
+    model = models["model"]
+    model2 = models["model2"]
+    config = dFBA_engine.make_config("PDC", {})
+    bounds = dFBA_engine.initial_exchange_bounds(config)
+    exchanges = list(bounds)
+    index = {x: j for j, x in enumerate(exchanges)}
+    names = ["EX_" + aromatic, "EX_exC00031"]
+    row = {x: numpy.full(len(glucose_rates), numpy.nan) for x in ["wild_type_growth", "growth", "PDC", "aromatic_price", "glucose_price"]}
+    row["status"] = []
+
+    with contextlib.ExitStack() as stack:
+        for m in (model, model2):
+            stack.enter_context(m)
+            # Each row starts from the standard basis, so results don't depend on which worker solves it
+            dFBA_engine.reset_solver_basis(m)
+        dFBA_engine.apply_gene_deletions(models, deletions)
+        updaters = [bound_updates.BoundUpdater(m, exchanges) for m in (model, model2)]
+        transports = bound_updates.BoundUpdater(model2, dFBA_engine.aromatic_transport_rxns)
+        for updater in updaters + [transports]:
+            stack.callback(updater.restore)
+
+        lower, upper = updaters[0].bounds()
+        for x in exchanges:
+            lower[index[x]] = -1 * bounds[x]
+            upper[index[x]] = bounds[x]
+        lower[index["EX_" + aromatic]] = -1 * aromatic_rate
+        upper[index["EX_" + aromatic]] = aromatic_rate
+
+        for k, glucose_rate in enumerate(glucose_rates):
+            lower[index["EX_exC00031"]] = -1 * glucose_rate
+            upper[index["EX_exC00031"]] = glucose_rate
+            for updater in updaters:
+                updater.push(lower, upper)
+
+            solution = model.optimize()
+            if solution.status != "optimal":
+                row["status"].append(solution.status)
+                continue
+            row["wild_type_growth"][k] = solution.fluxes["biomass"]
+            reduced_costs, shadow_prices = loopless_formulation.growth_duals(model, names, [])
+            prices = [sensitivity_dFBA.resource_value(x, solution.fluxes[x], lower[index[x]], upper[index[x]], reduced_costs[x]) + 0.0 for x in names]
+            row["aromatic_price"][k], row["glucose_price"][k] = prices
+
+            transport_fluxes = solution.fluxes[dFBA_engine.aromatic_transport_rxns].to_numpy(dtype = float)
+            transports.push(transport_fluxes, transport_fluxes)
+            solution = model2.optimize()
+            row["status"].append(solution.status)
+            if solution.status == "optimal":
+                row["growth"][k] = solution.fluxes["biomass"]
+                row["PDC"][k] = solution.fluxes["DM_PDC"]
+    return aromatic_rate, row
+
+
+##############
+# Phase plane
+
+# Returns the aromatic rates, glucose rates, and a dictionary of 2-D arrays (aromatic rate x glucose rate): status, wild_type_growth, growth, PDC,
+# aromatic_price, glucose_price, aromatic_slope, glucose_slope, region, and limiting, as described in the notes above
+def phase_plane(model_path, aromatic, aromatic_rates, glucose_rates, deletions = gene_deletions, processes = processes):
+    aromatic_rates = numpy.asarray(aromatic_rates, dtype = float)
+    glucose_rates = numpy.asarray(glucose_rates, dtype = float)
+    tasks = [(aromatic, x, glucose_rates, list(deletions)) for x in aromatic_rates]
+    rows = {}
+    with multiprocessing.Pool(processes, initializer = init_worker, initargs = (model_path,)) as pool:
+        for aromatic_rate, row in pool.imap_unordered(solve_row, tasks):
+            rows[aromatic_rate] = row
+    arrays = {x: numpy.array([rows[a][x] for a in aromatic_rates]) for x in rows[aromatic_rates[0]]}
+
+    # Slopes of the strain's growth along each axis; numpy.gradient needs at least two points on an axis
+    for name, axis, rates in (("aromatic_slope", 0, aromatic_rates), ("glucose_slope", 1, glucose_rates)):
+        arrays[name] = numpy.gradient(arrays["growth"], rates, axis = axis) if len(rates) > 1 else numpy.full(arrays["growth"].shape, numpy.nan)
+
+    solved = ~numpy.isnan(arrays["aromatic_price"])
+    prices = numpy.stack([arrays["aromatic_price"], arrays["glucose_price"]], axis = -1)
+    regions = {}
+    arrays["region"] = numpy.zeros(solved.shape, dtype = int)
+    for i, k in zip(*numpy.nonzero(solved)):
+        key = tuple(float(numpy.format_float_positional(x, precision = digits, unique = False, fractional = False)) for x in prices[i, k])
+        arrays["region"][i, k] = regions.setdefault(key, len(regions) + 1)
+    limited = prices > 0
+    arrays["limiting"] = numpy.where(limited[..., 0] & limited[..., 1], "both",
+                         numpy.where(limited[..., 0], "aromatic", numpy.where(limited[..., 1], "glucose", "neither")))
+    arrays["limiting"][~solved] = ""
+    return aromatic_rates, glucose_rates, arrays
+
+# One row per grid point, for plotting
+def phase_plane_table(aromatic_rates, glucose_rates, arrays):
+    A, G = numpy.meshgrid(aromatic_rates, glucose_rates, indexing = "ij")
+    df = pandas.DataFrame({"aromatic_rate": A.ravel(), "glucose_rate": G.ravel()})
+    for x in ["status", "wild_type_growth", "growth", "PDC", "aromatic_price", "glucose_price", "aromatic_slope", "glucose_slope", "region", "limiting"]:
+        df[x] = arrays[x].ravel()
+    return df
+
+
+if __name__ == "__main__":
+    model_path = sys.argv[1]
+    aromatic = sys.argv[2]
+    if len(sys.argv) > 3:
+        max_aromatic_rate = float(sys.argv[3])
+        max_glucose_rate = float(sys.argv[4])
+        points = int(sys.argv[5])
+
+    aromatic_rates, glucose_rates, arrays = phase_plane(model_path, aromatic, numpy.linspace(0, max_aromatic_rate, points), numpy.linspace(0, max_glucose_rate, points))
+    df = phase_plane_table(aromatic_rates, glucose_rates, arrays)
+    df.to_csv(output_path, index = False)
+
+    # Where the strain grows and makes the most PDC
+    solved = df[df["status"] == "optimal"]
+    print("Points solved: ", len(solved), " of ", len(df))
+    for x in ["growth", "PDC"]:
+        if solved[x].notna().any():
+            best = solved.loc[solved[x].idxmax()]
+            print("Most ", x, ": ", best[x], " at aromatic ", best["aromatic_rate"], ", glucose ", best["glucose_rate"], " mmol/gDW/min")
+    print("Regions: ")
+    print(df[df["region"] > 0].groupby(["region", "limiting"]).agg(points = ("region", "size"), aromatic_price = ("aromatic_price", "first"), glucose_price = ("glucose_price", "first")).to_string())
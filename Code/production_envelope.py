@@ -0,0 +1,133 @@
+###################
+# production_envelope.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script traces the production envelope of each bioproduct: the largest and smallest product flux the model allows at each biomass flux
+# bioproduct_dFBA.py sets the trade-off between growth and product with a fixed OE_amount and needs a run for every amount; the envelope shows the whole trade-off at once
+# Each product's envelope is a sweep over biomass flux on one solver problem: the objective is set to the product once, then only the biomass bounds
+# and the direction change, and each solve starts from the basis of the one before. Products are run in parallel
+###################
+
+# Import packages
+import sys
+import os
+import multiprocessing
+import numpy
+import pandas
+import dFBA_engine
+import bound_updates
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes
+points = 21						# biomass fluxes on each envelope, from 0 to the maximum
+substrates = {"exVA": 5.0}		# mmol/L, the uptake limits are the ones at the start of a bioproduct run with these concentrations
+output_path = "envelope_"		# prefix for the output files
+
+# Usage:
+# > python production_envelope.py <model> [bioproduct compound IDs]
+# Uses every bioproduct in the molecular_weights table of dFBA_engine.py when no compound IDs are given
+# For example:
+# > python production_envelope.py iNovo_engineered_2022.xml
+# > python production_envelope.py iNovo_engineered_2022.xml C00033 C00158
+#
+# The OE_flux constraint that bioproduct_dFBA.py uses to force production is left open, so the envelope covers every OE_amount
+# Output files:
+#	<output_path>points.csv - one row per product and biomass flux: biomass (1/min), product_min and product_max (mmol/gDW/min),
+#		product_max_g (g/gDW/hr), and OE_amount_max, the largest OE_amount that allows that growth (product per vanillic acid taken up, only with exVA in substrates)
+#	<output_path>summary.csv - one row per product: max_growth, the most product at no growth and at max growth, and coupled,
+#		True if the model has to make the product when it grows as fast as it can (product_min at max growth above 0)
+# The biomass flux is held exactly at each value, so product_min is the product the model can't avoid making at that growth
+
+
+##############
+# Envelopes
+
+_worker = {}
+
+def init_worker(model_path):
+    _worker["model_path"] = model_path
+
+def product_config(product):
+    return dFBA_engine.make_config("bioproduct", substrates, desired_product = product, OE_amount = 0.0)
+
+# Solve the problem as it is, NaN if it isn't optimal
+def _optimum(model):
+    value = model.slim_optimize(error_value = float("nan"))
+    return value if model.solver.status == "optimal" else float("nan")
+
+# The envelope of one product; returns the product and a dataframe of its points
+def product_envelope(product):
+    models = dFBA_engine.get_models(_worker["model_path"], "bioproduct", product)
+    model = models["model"]
+    config = product_config(product)
+    bounds = dFBA_engine.initial_exchange_bounds(config)
+    OE_flux = models["OE_flux"]
+    saved = (OE_flux.lb, OE_flux.ub)
+    biomass = bound_updates.BoundUpdater(model, ["biomass"])
+    exchanges = bound_updates.BoundUpdater(model, list(bounds))
+
+    # Constraint bounds aren't tracked by model contexts, so they're put back by hand, and so are the bounds set through the updaters
+    try:
+        with model:
+            dFBA_engine.reset_solver_basis(model)
+            lower, upper = exchanges.bounds()
+            for j, rxn_ID in enumerate(exchanges.rxn_IDs):
+                lower[j] = -1 * bounds[rxn_ID]
+                upper[j] = bounds[rxn_ID]
+            exchanges.push(lower, upper)
+            OE_flux.lb = None
+            OE_flux.ub = None
+
+            max_growth = _optimum(model)
+            growth = numpy.linspace(0, max_growth, points) if max_growth > 0 else numpy.zeros(1)
+            model.objective = model.reactions.get_by_id("DM_" + product)
+            results = {}
+            # All the largest values first, then all the smallest, so each solve starts from a basis for the same direction
+            for direction in ("max", "min"):
+                model.objective_direction = direction
+                values = []
+                for mu in growth:
+                    biomass.push(numpy.array([mu]), numpy.array([mu]))
+                    values.append(_optimum(model))
+                results[direction] = values
+    finally:
+        biomass.restore()
+        exchanges.restore()
+        OE_flux.lb = None
+        OE_flux.ub = saved[1]
+        OE_flux.lb = saved[0]
+
+    df = pandas.DataFrame({"product": product, "biomass": growth, "product_min": results["min"], "product_max": results["max"]})
+    df["product_max_g"] = df["product_max"] * 60 * dFBA_engine.molecular_weights.get(product, float("nan")) / 1000
+    if "EX_exVA" in bounds and bounds["EX_exVA"] > 0:
+        df["OE_amount_max"] = df["product_max"] / bounds["EX_exVA"]
+    return product, df
+
+def summarize(df):
+    rows = []
+    for product, points in df.groupby("product", sort = False):
+        first = points.iloc[0]
+        last = points.iloc[-1]
+        rows.append([product, last["biomass"], first["product_max"], last["product_max"], last["product_min"], last["product_min"] > 1e-9])
+    return pandas.DataFrame(rows, columns = ["product", "max_growth", "max_product_no_growth", "max_product_max_growth", "min_product_max_growth", "coupled"])
+
+# Envelopes of several products, in parallel; returns one dataframe of all their points, in the order the products were given
+def envelopes(model_path, products, processes = processes):
+    found = {}
+    with multiprocessing.Pool(min(processes, len(products)), initializer = init_worker, initargs = (model_path,)) as pool:
+        for product, df in pool.imap_unordered(product_envelope, products):
+            found[product] = df
+            print("Finished ", product)
+    return pandas.concat([found[x] for x in products], ignore_index = True)
+
+
+if __name__ == "__main__":
+    model_path = sys.argv[1]
+    products = sys.argv[2:] if len(sys.argv) > 2 else list(dFBA_engine.molecular_weights.keys())
+
+    df = envelopes(model_path, products)
+    summary = summarize(df)
+    df.to_csv(output_path + "points.csv", index = False)
+    summary.to_csv(output_path + "summary.csv", index = False)
+    print(summary.to_string(index = False))
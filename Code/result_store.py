@@ -0,0 +1,272 @@
+###################
+# result_store.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script keeps the results of every dFBA run in one SQLite file, so a run that was already done comes back from the file instead of being simulated again
+# The scripts write to fixed file names (dFBA_results.csv, PDC_dFBA_results.csv...), so each run overwrites the last one and identical runs are repeated
+# Each run is saved under a key made from its config (less the solve cache file), the contents of the model file, and the engine version, so a changed model or engine never returns an old result
+# The results tables are saved column by column as arrays of doubles, and the settings and summary metrics as one row per value, so sweeps can be gathered with one query
+###################
+
+# Import packages
+import sys
+import os
+import json
+import math
+import time
+import array
+import hashlib
+import sqlite3
+import run_metrics
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+store_path = "iNovo_results.sqlite"		# made in the folder the scripts are run in if it doesn't exist
+
+# Usage:
+# > python result_store.py list [<scenario>]
+# > python result_store.py runs <output csv> [<scenario>]
+# > python result_store.py export <run key> <output csv>
+# > python result_store.py remove-old
+# list prints the saved runs, runs writes one line per run with its settings and summary metrics (for sweeps and iNovo_figures.R)
+# export writes the results table of one run, the same file the matching script would have written
+# remove-old deletes runs saved by an older engine version (see engine_version in dFBA_engine.py)
+# Run keys can be shortened to their first few characters, as long as only one run starts with them
+#
+# In Python, cached_run(model_path, config, store) returns the saved results if the run is in the store, and otherwise simulates and saves it
+# inovo.py (--store) and simulation_server.py (result_store_path) use it when they're given a store
+
+schema = """
+CREATE TABLE IF NOT EXISTS runs (run_key TEXT PRIMARY KEY, config_hash TEXT, model_hash TEXT, engine_version TEXT, model_path TEXT,
+                                 scenario TEXT, desired_product TEXT, config TEXT, steps INTEGER, seconds REAL, created TEXT);
+CREATE TABLE IF NOT EXISTS settings (run_key TEXT, name TEXT, value REAL, PRIMARY KEY (run_key, name));
+CREATE TABLE IF NOT EXISTS metrics (run_key TEXT, position INTEGER, name TEXT, value REAL, PRIMARY KEY (run_key, name));
+CREATE TABLE IF NOT EXISTS columns (run_key TEXT, position INTEGER, name TEXT, length INTEGER, data BLOB, PRIMARY KEY (run_key, name));
+"""
+
+
+##############
+# Keys
+
+# Settings that can't change a run's results, left out of the key so the same run is found whichever of them it was given
+# solve_cache is only where solutions are kept; solve_cache_digits, compress (degenerate steps can pick another optimum), and solver_timeout
+# (a timed-out solve counts as infeasible) can all change the results, so they stay in
+non_result_settings = ["solve_cache"]
+
+def config_hash(config):
+    text = json.dumps({x: config[x] for x in config if x not in non_result_settings}, sort_keys = True, separators = (",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+# The contents of a model file, not its name, so a rebuilt model with the same name gets new results
+# Hashes are kept until the file changes
+_model_hashes = {}
+
+def model_hash(model_path):
+    stat = os.stat(model_path)
+    key = (os.path.abspath(model_path), stat.st_mtime_ns, stat.st_size)
+    if key not in _model_hashes:
+        sha = hashlib.sha256()
+        with open(model_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        _model_hashes[key] = sha.hexdigest()
+    return _model_hashes[key]
+
+# The cobra and optlang versions are part of it too, since a different solver interface can give different solutions
+def current_engine_version():
+    import cobra
+    import optlang
+    import dFBA_engine
+    return dFBA_engine.engine_version + " cobra " + cobra.__version__ + " optlang " + optlang.__version__
+
+def run_key(config_digest, model_digest, engine_version):
+    return hashlib.sha256((config_digest + model_digest + engine_version).encode()).hexdigest()
+
+# Settings that are numbers, one row each, for gathering sweeps
+# Substrates are saved by compound ID, and kinetic parameters only where they differ from the scenario's defaults, as e.g. G_Vm
+def flat_settings(config):
+    import dFBA_engine
+    settings = {}
+    for x in config:
+        if isinstance(config[x], (int, float)) and not isinstance(config[x], bool):
+            settings[x] = float(config[x])
+    for x in config["substrates"]:
+        settings[x] = float(config["substrates"][x])
+    defaults = dict(dFBA_engine.default_kinetics)
+    defaults.update(dFBA_engine.scenario_defaults[config["scenario"]]["kinetics"])
+    for x in config["kinetics"]:
+        if list(config["kinetics"][x]) != list(defaults.get(x, [])):
+            for name, value in zip(["Vm", "Ks", "Ki"], config["kinetics"][x]):
+                settings[x + "_" + name] = float(value)
+    return settings
+
+
+##############
+# Columns
+
+# None (columns that ended early) and NaN are both saved as NaN, and the arrays are little-endian so R's readBin() can read them
+def pack(values):
+    data = array.array("d", [float("nan") if x is None else float(x) for x in values])
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+def unpack(blob):
+    data = array.array("d")
+    data.frombytes(blob)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tolist()
+
+def _number(value):
+    return None if value is None or (isinstance(value, float) and math.isnan(value)) else float(value)
+
+
+##############
+# Store
+
+class ResultStore:
+    # Several worker processes can share one store; writes wait for each other for up to timeout seconds
+    def __init__(self, path = store_path, timeout = 60):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout = timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(schema)
+        self.engine_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Key of a run in this store, for the engine version in use
+    def key(self, model_path, config):
+        if self.engine_version is None:
+            self.engine_version = current_engine_version()
+        return run_key(config_hash(config), model_hash(model_path), self.engine_version)
+
+    # Saved results as (tracking, summary), or None if the run isn't in the store
+    def get(self, model_path, config):
+        key = self.key(model_path, config)
+        found = self.connection.execute("SELECT 1 FROM runs WHERE run_key = ?", (key,)).fetchone()
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.load(key)
+
+    def put(self, model_path, config, tracking, summary, seconds = None):
+        key = self.key(model_path, config)
+        with self.connection:
+            self.connection.execute("DELETE FROM runs WHERE run_key = ?", (key,))
+            for table in ("settings", "metrics", "columns"):
+                self.connection.execute("DELETE FROM " + table + " WHERE run_key = ?", (key,))
+            self.connection.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (key, config_hash(config), model_hash(model_path), self.engine_version, model_path, config["scenario"],
+                                     config.get("desired_product"), json.dumps(config, sort_keys = True), len(tracking["Time"]), seconds,
+                                     time.strftime("%Y-%m-%d %H:%M:%S")))
+            settings = flat_settings(config)
+            self.connection.executemany("INSERT INTO settings VALUES (?, ?, ?)", [(key, x, settings[x]) for x in settings])
+            self.connection.executemany("INSERT INTO metrics VALUES (?, ?, ?, ?)",
+                                        [(key, position, x, _number(summary[x])) for position, x in enumerate(summary)])
+            self.connection.executemany("INSERT INTO columns VALUES (?, ?, ?, ?, ?)",
+                                        [(key, position, x, len(tracking[x]), pack(tracking[x])) for position, x in enumerate(tracking)])
+        return key
+
+    # Full run key from the start of one
+    def find(self, prefix):
+        keys = [x[0] for x in self.connection.execute("SELECT run_key FROM runs WHERE run_key LIKE ?", (prefix + "%",))]
+        if len(keys) != 1:
+            raise KeyError(("No run" if len(keys) == 0 else "More than one run") + " starts with " + prefix)
+        return keys[0]
+
+    def load(self, key):
+        tracking = {}
+        for name, blob in self.connection.execute("SELECT name, data FROM columns WHERE run_key = ? ORDER BY position", (key,)):
+            tracking[name] = unpack(blob)
+        summary = {}
+        for name, value in self.connection.execute("SELECT name, value FROM metrics WHERE run_key = ? ORDER BY position", (key,)):
+            summary[name] = float("nan") if value is None else value
+        return tracking, summary
+
+    def config(self, key):
+        return json.loads(self.connection.execute("SELECT config FROM runs WHERE run_key = ?", (key,)).fetchone()[0])
+
+    # The results table of one run, the dataframe the scripts write
+    def results(self, key):
+        import pandas
+        tracking, summary = self.load(key)
+        return pandas.DataFrame.from_dict(tracking, orient = "index").transpose()
+
+    # One row per run with its settings and summary metrics, for gathering sweeps
+    # Filter by scenario, model file name, product, or engine version (e.g. current_engine_version()); settings and metrics that a run doesn't have are NaN
+    def runs(self, scenario = None, model_path = None, desired_product = None, engine_version = None):
+        import pandas
+        filters = {"scenario": scenario, "model_path": model_path, "desired_product": desired_product, "engine_version": engine_version}
+        where = " AND ".join(x + " = ?" for x in filters if filters[x] is not None)
+        values = [filters[x] for x in filters if filters[x] is not None]
+        query = "SELECT run_key, scenario, model_path, desired_product, engine_version, steps, seconds, created FROM runs"
+        runs = pandas.read_sql_query(query + (" WHERE " + where if where else "") + " ORDER BY created, run_key", self.connection, params = values)
+        for table, order in (("settings", "name"), ("metrics", "position")):
+            long = pandas.read_sql_query("SELECT run_key, name, value FROM " + table + " ORDER BY " + order, self.connection)
+            long = long[long["run_key"].isin(runs["run_key"])]
+            if len(long) > 0:
+                names = list(dict.fromkeys(long["name"]))
+                wide = long.pivot(index = "run_key", columns = "name", values = "value")[names].reset_index()
+                runs = runs.merge(wide, on = "run_key", how = "left")
+        return runs
+
+    def remove(self, keys):
+        with self.connection:
+            for key in keys:
+                for table in ("runs", "settings", "metrics", "columns"):
+                    self.connection.execute("DELETE FROM " + table + " WHERE run_key = ?", (key,))
+
+
+##############
+# Cached runs
+
+# Results of a run from the store, or simulated and saved if it isn't there yet
+# models are the prepared models for the run if the caller already has them; returns tracking, summary
+def cached_run(model_path, config, store, models = None, verbose = False):
+    import dFBA_engine
+    saved = store.get(model_path, config)
+    run_metrics.add({"store_lookups": 1, "store_hits": int(saved is not None)})
+    if saved is not None:
+        if verbose:
+            print("Results from ", store.path)
+        return saved
+    if models is None:
+        models = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    start = time.time()
+    tracking = dFBA_engine.simulate(models, config, verbose)
+    summary = dFBA_engine.summarize(tracking, config)
+    store.put(model_path, config, tracking, summary, time.time() - start)
+    return tracking, summary
+
+
+if __name__ == "__main__":
+    command = sys.argv[1]
+    with ResultStore() as store:
+        if command == "list":
+            runs = store.runs(scenario = sys.argv[2] if len(sys.argv) > 2 else None)
+            print(runs[["run_key", "scenario", "model_path", "desired_product", "steps", "created"]].to_string(index = False))
+        elif command == "runs":
+            runs = store.runs(scenario = sys.argv[3] if len(sys.argv) > 3 else None)
+            runs.to_csv(sys.argv[2], index = False)
+            print(len(runs), " runs written to ", sys.argv[2])
+        elif command == "export":
+            store.results(store.find(sys.argv[2])).to_csv(sys.argv[3])
+        elif command == "remove-old":
+            engine_version = current_engine_version()
+            old = [x[0] for x in store.connection.execute("SELECT run_key FROM runs WHERE engine_version != ?", (engine_version,))]
+            store.remove(old)
+            print("Removed ", len(old), " runs from older engine versions")
+        else:
+            print("Unknown command: ", command, ", use list, runs, export, or remove-old")
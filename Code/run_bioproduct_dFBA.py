@@ -18,8 +18,9 @@ logging.basicConfig()
 cobra_config = cobra.Configuration()
 cobra_config.solver = "glpk_exact"
 
-model_path = "/Users/Alex/Desktop/iNovo/Model_builds/Models/engineered_iNovo.xml"
-output_path = "/Users/Alex/Desktop/iNovo/Model_results/bioproduct_"
+# Paths are relative to the folder the script is run in; a different model can be given as the 4th argument
+model_path = sys.argv[4] if len(sys.argv) > 4 else "iNovo_engineered_2022.xml"
+output_path = "bioproduct_"
 
 # Some warnings you may see
 # "Solver status infeasible" - happens when a constraint cannot be meant. Most often when no S compounds are being consumed
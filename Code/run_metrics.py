@@ -0,0 +1,180 @@
+###################
+# run_metrics.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This file keeps a metrics file up to date while a sweep or ensemble runs, so its progress can be followed without reading the printed lines
+# dFBA_engine.simulate() and batch_dFBA.simulate_batch() add what each run cost to counters kept in every process (steps, time in the solver, solves with
+# no solution, solve cache lookups), workers send back how much their counters grew with each job, and the runner adds that to the file
+# The file is JSON, or Prometheus text format when its name ends in .prom, and is replaced in one step each time, so a reader never sees half of it
+###################
+
+# Import packages
+import os
+import math
+import json
+import time
+
+###############
+# Settings
+write_interval = 5		# seconds between rewrites of the metrics file; the last one is always written
+prefix = "inovo_"		# prefix of the metric names in Prometheus format
+
+# Metrics in the file, with their descriptions (the # HELP lines in Prometheus format):
+descriptions = {
+    "jobs_total": "jobs in the sweep or ensemble",
+    "jobs_done": "jobs finished, including those skipped by the pre-screen and those that failed",
+    "jobs_pending": "jobs not finished yet",
+    "jobs_running": "jobs claimed by a worker (work queues only)",
+    "jobs_skipped": "jobs the static FBA pre-screen ruled out",
+    "jobs_failed": "jobs that raised an exception (work queues only)",
+    "elapsed_seconds": "seconds since the runner started, or since the first job of a work queue finished",
+    "jobs_per_hour": "finished jobs per hour",
+    "eta_seconds": "seconds until every job is finished, at jobs_per_hour",
+    "runs": "dFBA runs simulated",
+    "steps": "dFBA steps simulated, over all runs",
+    "mean_step_seconds": "mean wall time of a dFBA step",
+    "solver_time_share": "share of the dFBA wall time spent in LP solves, including solve cache lookups",
+    "solves": "LP solves of dFBA steps",
+    "infeasible_solves": "solves whose growth LP had no solution",
+    "solve_cache_lookups": "solves looked up in the solve cache (see solve_cache.py)",
+    "solve_cache_hit_rate": "share of solve cache lookups that found a solution",
+    "result_store_lookups": "runs looked up in the result store (see result_store.py)",
+    "result_store_hit_rate": "share of result store lookups that found the run",
+    "updated_timestamp": "time this file was written, in seconds since the epoch"}
+
+
+##############
+# Counters
+
+# Totals of this process's dFBA runs; each worker process has its own
+def empty_counters():
+    return {"runs": 0, "steps": 0, "run_seconds": 0.0, "solves": 0, "solve_seconds": 0.0, "infeasible_solves": 0,
+            "cache_lookups": 0, "cache_hits": 0, "store_lookups": 0, "store_hits": 0}
+
+counters = empty_counters()
+
+def add(values, to = None):
+    to = counters if to is None else to
+    for x in values:
+        to[x] = to.get(x, 0) + values[x]
+
+# A solve of a dFBA step; a solution without an objective value is one whose growth LP had no solution
+# (the status of loopless solutions can't tell, since the loopless LP is often reported infeasible even when it succeeded)
+def add_solve(seconds, solution):
+    counters["solves"] += 1
+    counters["solve_seconds"] += seconds
+    if solution.objective_value is None or math.isnan(solution.objective_value):
+        counters["infeasible_solves"] += 1
+
+# Solve cache lookups between two SolveCache.stats()
+def cache_counters(before, after):
+    hits = after["memory_hits"] + after["file_hits"] - before["memory_hits"] - before["file_hits"]
+    return {"cache_lookups": hits + after["misses"] + after["skipped"] - before["misses"] - before["skipped"], "cache_hits": hits}
+
+# How much the counters grew since snapshot() returned before
+def snapshot():
+    return dict(counters)
+
+def since(before):
+    return {x: counters[x] - before.get(x, 0) for x in counters}
+
+
+##############
+# Metrics file
+
+def _ratio(a, b):
+    return a / b if b > 0 else float("nan")
+
+# The metrics from job counts and summed counters
+def metrics(total, done, skipped, failed, running, elapsed, rate, totals):
+    pending = total - done
+    return {"jobs_total": total, "jobs_done": done, "jobs_pending": pending, "jobs_running": running, "jobs_skipped": skipped, "jobs_failed": failed,
+            "elapsed_seconds": elapsed, "jobs_per_hour": rate * 3600, "eta_seconds": pending / rate if rate > 0 else float("nan"),
+            "runs": totals["runs"], "steps": totals["steps"], "mean_step_seconds": _ratio(totals["run_seconds"], totals["steps"]),
+            "solver_time_share": _ratio(totals["solve_seconds"], totals["run_seconds"]), "solves": totals["solves"], "infeasible_solves": totals["infeasible_solves"],
+            "solve_cache_lookups": totals["cache_lookups"], "solve_cache_hit_rate": _ratio(totals["cache_hits"], totals["cache_lookups"]),
+            "result_store_lookups": totals["store_lookups"], "result_store_hit_rate": _ratio(totals["store_hits"], totals["store_lookups"]),
+            "updated_timestamp": time.time()}
+
+def prometheus_text(values):
+    lines = []
+    for x in values:
+        value = values[x]
+        lines.append("# HELP " + prefix + x + " " + descriptions[x])
+        lines.append("# TYPE " + prefix + x + " " + ("counter" if x in ("jobs_done", "jobs_skipped", "jobs_failed", "runs", "steps", "solves", "infeasible_solves") else "gauge"))
+        lines.append(prefix + x + " " + ("NaN" if value is None or math.isnan(value) else repr(float(value)) if isinstance(value, float) else str(value)))
+    return "\n".join(lines) + "\n"
+
+# JSON has no NaN, so values that can't be computed yet are null
+def write_metrics(path, values):
+    temporary = path + ".tmp." + str(os.getpid())
+    with open(temporary, "w") as f:
+        if path.endswith(".prom"):
+            f.write(prometheus_text(values))
+        else:
+            json.dump({x: None if isinstance(values[x], float) and math.isnan(values[x]) else values[x] for x in values}, f, indent = 1)
+    os.replace(temporary, path)
+
+# Metrics of a runner that hands out the jobs itself (a process pool); call job_done() as each job comes back and close() at the end
+class RunMetrics:
+    def __init__(self, path, total):
+        self.path = path
+        self.total = total
+        self.started = time.time()
+        self.done = 0
+        self.skipped = 0
+        self.totals = empty_counters()
+        self.written = 0
+        self.write()
+
+    # counters is what the job's worker counters grew by (see since()); skipped is True for jobs the pre-screen ruled out
+    def job_done(self, counters = None, skipped = False):
+        self.done += 1
+        self.skipped += int(skipped)
+        if counters is not None:
+            add(counters, self.totals)
+        if time.time() - self.written >= write_interval:
+            self.write()
+
+    # Jobs a worker runs together (a batch) share one counters entry
+    def jobs_done(self, count, counters = None, skipped = 0):
+        self.done += count - 1
+        self.skipped += skipped
+        self.job_done(counters)
+
+    def values(self):
+        elapsed = time.time() - self.started
+        return metrics(self.total, self.done, self.skipped, 0, 0, elapsed, _ratio(self.done, elapsed), self.totals)
+
+    def write(self):
+        if self.path is not None:
+            write_metrics(self.path, self.values())
+        self.written = time.time()
+
+    def close(self):
+        self.write()
+
+# Metrics of a work queue folder, from its progress and the counters its workers saved with each result (see work_queue.py)
+# Result files don't change once they're written, so each is read once and added to running totals; only new ones are read at each values()
+class QueueMetrics:
+    def __init__(self, queue):
+        self.queue = queue
+        self.seen = set()
+        self.finished = []		# status and finish time of each result, all progress() needs
+        self.first_finished = None
+        self.skipped = 0
+        self.totals = empty_counters()
+
+    def values(self):
+        for result in self.queue.new_results(self.seen):
+            add(result.get("metrics", {}), self.totals)
+            self.skipped += int(result.get("skipped", False))
+            self.finished.append({"status": result["status"], "finished": result["finished"]})
+            self.first_finished = result["finished"] if self.first_finished is None else min(self.first_finished, result["finished"])
+        progress = self.queue.progress(self.finished)
+        elapsed = time.time() - self.first_finished if self.first_finished is not None else 0.0
+        total = progress["pending"] + progress["running"] + progress["done"]
+        return metrics(total, progress["done"], self.skipped, progress["errors"], progress["running"], elapsed, progress["jobs_per_hour"] / 3600, self.totals)
+
+def queue_metrics(queue):
+    return QueueMetrics(queue).values()
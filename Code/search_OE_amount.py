@@ -0,0 +1,153 @@
+###################
+# search_OE_amount.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script finds, for each bioproduct, the largest overexpression amount that still allows growth and the amount that gives the best g/L/hr
+# It replaces bracketing OE_amount by hand with lists of bioproduct_dFBA.py runs (C00033 0.5, C00033 0.6, ...)
+# Its output is a table with one line per bioproduct plus a table of every dFBA run it made
+###################
+
+# Import packages
+import sys
+import os
+import multiprocessing
+import numpy
+import pandas
+import dFBA_engine
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+processes = os.cpu_count()		# number of worker processes
+OE_precision = 0.001			# bisection stops once the largest feasible OE amount is known to this precision
+OE_start = 1.0					# first upper bracket for the bisection, doubled until the model can no longer grow
+OE_limit = 64.0					# give up doubling past this amount
+growth_threshold = 1e-9			# biomass flux below this counts as no growth
+refinement_rounds = 2			# rounds of dFBA runs between 0 and the largest feasible amount
+output_path = "OE_search_"		# prefix for the output files
+
+# Usage:
+# > python search_OE_amount.py <model> [bioproduct compound IDs]
+# Uses every bioproduct in the molecular_weights table of dFBA_engine.py when no compound IDs are given
+# For example:
+# > python search_OE_amount.py iNovo_engineered_2022.xml
+# > python search_OE_amount.py iNovo_engineered_2022.xml C00033 C00158
+#
+# The substrate and medium are the same as in bioproduct_dFBA.py (5 mmol/L vanillic acid)
+# Step 1 uses static FBA at the starting conditions, which is cheap, to bisect for the largest OE amount with growth
+# The same solver problem is used for every bisection step, only the OE_flux coefficient changes
+# Step 2 runs a few dFBA simulations at and below that amount, narrowing in on the amount with the best g/L/hr
+
+
+##############
+# Workers
+
+_worker = {}
+
+def init_worker(model_path):
+    _worker["model_path"] = model_path
+
+def product_config(product, OE_amount):
+    return dFBA_engine.make_config("bioproduct", {"exVA": 5.0}, desired_product = product, OE_amount = OE_amount)
+
+# One static FBA solve at the starting conditions (dFBA_engine.prescreen() would add the solves that explain an infeasible one)
+def grows(models, config):
+    config = dict(config)
+    config["solver_timeout"] = dFBA_engine.prescreen_timeout
+    solution = dFBA_engine.static_solution(models, config)
+    return solution.status == "optimal" and solution.fluxes["biomass"] > growth_threshold
+
+# Bisect for the largest OE amount where the model can still grow at the starting conditions
+def max_feasible_OE(product):
+    models = dFBA_engine.get_models(_worker["model_path"], "bioproduct", product)
+    config = product_config(product, 0.0)
+    if not grows(models, config):
+        return product, float("nan"), 1
+
+    solves = 1
+    low = 0.0
+    high = OE_start
+    while True:
+        config["OE_amount"] = high
+        solves += 1
+        if not grows(models, config):
+            break
+        low = high
+        high = high * 2
+        if high > OE_limit:
+            return product, low, solves
+
+    while high - low > OE_precision:
+        middle = (low + high) / 2
+        config["OE_amount"] = middle
+        solves += 1
+        if grows(models, config):
+            low = middle
+        else:
+            high = middle
+    return product, low, solves
+
+def run_dFBA(task):
+    product, OE_amount = task
+    models = dFBA_engine.get_models(_worker["model_path"], "bioproduct", product)
+    config = product_config(product, OE_amount)
+    tracking = dFBA_engine.simulate(models, config)
+    return product, OE_amount, dFBA_engine.summarize(tracking, config)
+
+
+##############
+# Search
+
+def search(model_path, products, processes = processes):
+    evaluations = {}
+    limits = {}
+    points_per_round = max(processes, 4)
+
+    with multiprocessing.Pool(processes, initializer = init_worker, initargs = (model_path,)) as pool:
+        for product, limit, solves in pool.imap_unordered(max_feasible_OE, products):
+            print(product, ": largest feasible OE amount ", limit, " (", solves, " static solves)")
+            limits[product] = limit
+
+        # Narrow in on the best g/L/hr, all products at once so the pool stays busy
+        brackets = {x: [0.0, limits[x]] for x in products if not numpy.isnan(limits[x]) and limits[x] > 0}
+        for round_number in range(refinement_rounds):
+            tasks = []
+            for product in brackets:
+                low, high = brackets[product]
+                for OE_amount in numpy.linspace(low, high, points_per_round + 1)[1:]:
+                    OE_amount = round(OE_amount, 6)
+                    if (product, OE_amount) not in evaluations:
+                        tasks.append((product, OE_amount))
+            for product, OE_amount, summary in pool.imap_unordered(run_dFBA, tasks):
+                evaluations[(product, OE_amount)] = summary
+
+            for product in brackets:
+                tried = sorted(x[1] for x in evaluations if x[0] == product)
+                rates = [evaluations[(product, x)]["g_L_hr"] for x in tried]
+                rates = [-numpy.inf if numpy.isnan(x) else x for x in rates]
+                best = int(numpy.argmax(rates))
+                brackets[product] = [tried[best - 1] if best > 0 else 0.0, tried[min(best + 1, len(tried) - 1)]]
+
+    rows = []
+    for product in products:
+        tried = [x[1] for x in evaluations if x[0] == product]
+        if len(tried) > 0:
+            best = max(tried, key = lambda x: -numpy.inf if numpy.isnan(evaluations[(product, x)]["g_L_hr"]) else evaluations[(product, x)]["g_L_hr"])
+            summary = evaluations[(product, best)]
+            rows.append([product, limits[product], best, summary["mmol_L_hr"], summary["g_L_hr"]])
+        else:
+            rows.append([product, limits[product], float("nan"), float("nan"), float("nan")])
+    results = pandas.DataFrame(rows, columns = ["product", "max_feasible_OE", "best_OE", "mmol/L/hr", "g/L/hr"])
+
+    runs = pandas.DataFrame([[x[0], x[1], evaluations[x]["mmol_L_hr"], evaluations[x]["g_L_hr"], evaluations[x]["final_biomass"]] for x in sorted(evaluations)],
+                            columns = ["product", "OE_amount", "mmol/L/hr", "g/L/hr", "final_biomass"])
+    return results, runs
+
+
+if __name__ == "__main__":
+    model_path = sys.argv[1]
+    products = sys.argv[2:] if len(sys.argv) > 2 else list(dFBA_engine.molecular_weights.keys())
+
+    results, runs = search(model_path, products)
+    results.to_csv(output_path + "results.csv", index = False)
+    runs.to_csv(output_path + "runs.csv", index = False)
+    print(results)
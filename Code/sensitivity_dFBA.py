@@ -0,0 +1,133 @@
+###################
+# sensitivity_dFBA.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script runs one dFBA simulation and records the duals of the growth LP at every step: reduced costs on the exchanges and shadow prices on SA_flux and OE_flux
+# From them it builds first-order sensitivity trajectories, how much more biomass (and PDC or bioproduct) there would be at every timepoint if one resource were a little less limiting
+# Finding that out by re-running the simulation with changed inputs takes at least one more run per resource; here one run covers all of them
+###################
+
+# Import packages
+import sys
+import pandas
+import dFBA_engine
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+output_path = "sensitivity_"		# prefix for the output files
+tolerance = 1e-9				# a flux this close to one of its bounds (relative to the bound, or absolute below 1) is at that bound
+
+# Usage:
+# > python sensitivity_dFBA.py <scenario> <arguments of the scenario's script>
+# For example:
+# > python sensitivity_dFBA.py PDC iNovo_base_2022.xml exVA 3.0 exC00031 2.0
+# > python sensitivity_dFBA.py cometabolism iNovo_base_2022.xml exSA exVA expHBA
+#
+# Output files:
+#	<output_path>dFBA_results.csv - the usual results table
+#	<output_path>duals.csv - every step's duals: timepoint, model, name, flux, lower_bound, upper_bound, dual, value
+#	<output_path>trajectories.csv - Time, Biomass, and for each resource that limited growth at some step, d Biomass / d resource (and d product / d resource)
+#
+# dual is the reduced cost of a reaction's net flux, or the shadow price of a constraint, in the growth LP of that step
+# value is how much faster growth (1/min) would be per unit of the resource (mmol/gDW/min), 0 where it doesn't limit growth:
+#	exchanges (EX_): more uptake allowed, if the uptake is at its limit (for a compound that isn't in the medium, what adding a little of it would be worth)
+#	outfluxes (DM_): more secretion allowed, if the secretion is at its limit
+#	reactions held to a flux (the PDC strain's aromatic transports): more flux through them
+#	SA_flux and OE_flux: a larger right-hand side
+# The trajectories are first order and hold each resource's extra capacity constant over the run: the biomass sensitivity follows
+# dX(i) = dX(i-1) * (1 + growth(i) * timepoint_interval) + X(i-1) * value(i) * timepoint_interval
+# and the product sensitivity assumes product made per biomass doesn't change, so it only follows the extra biomass
+# Changes in the substrate concentrations that the extra growth would cause are left out, so they're most accurate before a substrate runs out
+# In the PDC scenario biomass comes from the PDC strain, so its duals are used; the aromatics reach it through the transports it's held to
+
+
+##############
+# Duals
+
+def at_bound(flux, bound):
+    return abs(flux - bound) <= tolerance * max(1.0, abs(bound))
+
+# Growth gained per unit of a resource, see the notes above
+def resource_value(name, flux, lower_bound, upper_bound, dual):
+    if name.startswith("EX_"):
+        return max(-dual, 0.0) if at_bound(flux, lower_bound) else 0.0
+    if name.startswith("DM_"):
+        return max(dual, 0.0) if at_bound(flux, upper_bound) else 0.0
+    return dual
+
+# Runs the simulation and returns the tracking dictionary and the duals table
+def run(model_path, config):
+    models = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+    rows = []
+
+    # Called after every solve, while the model still has the bounds of this step
+    def record(i, key, solution):
+        # Steps whose growth LP couldn't be solved have no duals
+        if solution.reduced_costs is None:
+            return
+        model = models[key]
+        for name, dual in solution.reduced_costs.items():
+            rxn = model.reactions.get_by_id(name)
+            flux = solution.fluxes[name]
+            rows.append([i, key, name, flux, rxn.lower_bound, rxn.upper_bound, dual, resource_value(name, flux, rxn.lower_bound, rxn.upper_bound, dual)])
+        for name, dual in solution.shadow_prices.items():
+            constraint = model.constraints[name]
+            rows.append([i, key, name, constraint.primal, constraint.lb, constraint.ub, dual, dual])
+
+    tracking = dFBA_engine.simulate(models, config, dual_callback = record)
+    duals = pandas.DataFrame(rows, columns = ["timepoint", "model", "name", "flux", "lower_bound", "upper_bound", "dual", "value"])
+    return tracking, duals
+
+
+##############
+# Sensitivity trajectories
+
+def product_name(config):
+    if config["scenario"] == "PDC":
+        return "PDC"
+    return config.get("desired_product")
+
+# First-order sensitivities of biomass and product at every timepoint to each resource that limited growth at some step
+def trajectories(tracking, duals, config):
+    timepoint_interval = config["timepoint_interval"]
+    biomass = tracking["Biomass"]
+    product = product_name(config)
+    model_key = "model2" if config["scenario"] == "PDC" else "model"
+    values = duals[duals["model"] == model_key].pivot(index = "timepoint", columns = "name", values = "value")
+    resources = [x for x in values.columns if (values[x].abs() > 0).any()]
+
+    df = pandas.DataFrame({"Time": tracking["Time"], "Biomass": biomass})
+    if product is not None:
+        df[product] = tracking[product]
+    for resource in resources:
+        dX = [0.0]
+        dP = [0.0]
+        for i in range(1, len(biomass)):
+            growth = (biomass[i] - biomass[i - 1]) / (biomass[i - 1] * timepoint_interval)
+            value = values[resource].get(i, 0.0)
+            value = 0.0 if pandas.isna(value) else value
+            dX.append(dX[i - 1] * (1 + growth * timepoint_interval) + biomass[i - 1] * value * timepoint_interval)
+            if product is not None:
+                # Product made per biomass in this step, times the extra biomass there was to make it
+                rate = (tracking[product][i] - tracking[product][i - 1]) / (biomass[i - 1] * timepoint_interval)
+                dP.append(dP[i - 1] + rate * dX[i - 1] * timepoint_interval)
+        df["dBiomass/d" + resource] = dX
+        if product is not None:
+            df["d" + product + "/d" + resource] = dP
+    return df
+
+
+if __name__ == "__main__":
+    model_path, config = dFBA_engine.config_from_args(sys.argv[1], sys.argv[2:])
+
+    tracking, duals = run(model_path, config)
+    sensitivities = trajectories(tracking, duals, config)
+    dFBA_engine.tracking_to_dataframe(tracking).to_csv(output_path + "dFBA_results.csv")
+    duals.to_csv(output_path + "duals.csv", index = False)
+    sensitivities.to_csv(output_path + "trajectories.csv", index = False)
+
+    # The resources final biomass depends on most
+    final = sensitivities.iloc[-1]
+    print("Final biomass sensitivity, g/L per mmol/gDW/min of extra capacity:")
+    for x in sorted([x for x in sensitivities.columns if x.startswith("dBiomass/d")], key = lambda x: -abs(final[x])):
+        print(x[len("dBiomass/d"):], ": ", final[x])
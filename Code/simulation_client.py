@@ -0,0 +1,108 @@
+###################
+# simulation_client.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script sends simulation jobs to a running simulation_server.py and saves the results
+# It takes the same arguments as the stand-alone scripts and writes the same output files, but the models are already loaded in the server
+# It only uses the Python standard library, so it starts in a fraction of a second
+###################
+
+# Import packages
+import sys
+import csv
+import json
+import http.client
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+host = "127.0.0.1"
+port = 8765
+
+# Usage:
+# > python simulation_client.py status
+# > python simulation_client.py yield iNovo_base_2022.xml exVA
+# > python simulation_client.py cometabolism iNovo_base_2022.xml exSA exVA expHBA
+# > python simulation_client.py PDC iNovo_base_2022.xml exVA 3.0 exC00031 2.0
+# > python simulation_client.py bioproduct iNovo_engineered_2022.xml C00033 0.6
+# > python simulation_client.py jobs <json file with a list of jobs>
+# The arguments after the job type are the ones calculate_biomass_yield.py, cometabolism_dFBA.py, PDC_dFBA.py, or bioproduct_dFBA.py take
+# Results are written to the same files those scripts write (Model_fluxes.csv, dFBA_results.csv, PDC_dFBA_results.csv, bioproduct_dFBA_results.csv)
+# In a jobs file (see simulation_server.py for the format), each job can name its own output file with "output", otherwise it gets job<number>_ in front of the usual name
+
+output_names = {"yield": "Model_fluxes.csv", "cometabolism": "dFBA_results.csv", "PDC": "PDC_dFBA_results.csv", "bioproduct": "bioproduct_dFBA_results.csv"}
+
+
+##############
+# Requests
+
+def get_status(host = host, port = port):
+    connection = http.client.HTTPConnection(host, port)
+    connection.request("GET", "/status")
+    return json.loads(connection.getresponse().read())
+
+# Send jobs and yield each result as soon as the server sends it back
+def submit(jobs, host = host, port = port):
+    connection = http.client.HTTPConnection(host, port)
+    connection.request("POST", "/jobs", body = json.dumps(jobs), headers = {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    if response.status != 200:
+        raise RuntimeError("Server error " + str(response.status) + ": " + response.read().decode())
+    while True:
+        line = response.readline()
+        if not line:
+            break
+        yield json.loads(line)
+    connection.close()
+
+
+##############
+# Output
+
+# Write a tracking table the way the dFBA scripts write theirs with pandas, with the row number first and every value as a decimal
+def write_results(results, path):
+    columns = list(results.keys())
+    rows = max(len(results[x]) for x in columns)
+    with open(path, "w", newline = "") as f:
+        writer = csv.writer(f, lineterminator = "\n")
+        writer.writerow([""] + columns)
+        for i in range(rows):
+            row = [i]
+            for x in columns:
+                value = results[x][i] if i < len(results[x]) else None
+                row.append("" if value is None else repr(float(value)))
+            writer.writerow(row)
+
+def write_fluxes(fluxes, path):
+    with open(path, "w", newline = "") as f:
+        writer = csv.writer(f, lineterminator = "\n")
+        writer.writerow(["", "fluxes"])
+        for x in fluxes:
+            writer.writerow([x, "" if fluxes[x] is None else repr(float(fluxes[x]))])
+
+def save(result, path):
+    if result["status"] != "done":
+        print("Job ", result["job"], " failed: ", result["message"])
+        return
+    if result["type"] == "yield":
+        write_fluxes(result["fluxes"], path)
+        print("Job ", result["job"], " biomass yield, mgDW/mmol: ", result["yield"], " (fluxes in ", path, ")")
+    else:
+        write_results(result["results"], path)
+        print("Job ", result["job"], " ", result["summary"], " (results in ", path, ")")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1]
+    if command == "status":
+        print(json.dumps(get_status(), indent = 1))
+    elif command == "jobs":
+        with open(sys.argv[2]) as f:
+            jobs = json.load(f)
+        for result in submit(jobs):
+            job = jobs[result["job"]]
+            save(result, job.get("output", "job" + str(result["job"]) + "_" + output_names.get(job.get("type"), "results.csv")))
+    elif command in output_names:
+        for result in submit({"type": command, "args": sys.argv[2:]}):
+            save(result, output_names[command])
+    else:
+        print("Unknown job type: ", command, ", use status, jobs, or one of ", ", ".join(output_names))
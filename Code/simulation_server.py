@@ -0,0 +1,191 @@
+###################
+# simulation_server.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script runs a local simulation service that keeps the iNovo models loaded between queries
+# Every stand-alone script imports cobra and reads the SBML model again, which takes several seconds before anything is simulated
+# Here a pool of worker processes loads the four models once, and jobs (biomass yield, cometabolism, PDC, bioproduct) are sent to it over HTTP
+# Results are streamed back as one line of json per job as soon as each one finishes. simulation_client.py is a small command line client for it
+###################
+
+# Import packages
+import sys
+import os
+import json
+import math
+import threading
+import queue
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import dFBA_engine
+import result_store
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+host = "127.0.0.1"		# only accept connections from this computer
+port = 8765
+processes = os.cpu_count()		# number of worker processes, each keeps its own copy of the models
+model_paths = ["iNovo_base_2022.xml", "iNovo_engineered_2022.xml", "iNovo_hypo_demeth_2022.xml", "iNovo_vanAB_2022.xml"]
+preload_scenarios = ["yield", "cometabolism", "PDC"]	# prepared for every model when a worker starts, bioproduct models are prepared for each product the first time it's asked for
+result_store_path = None		# a SQLite file (see result_store.py) to save every dFBA result in and answer repeated jobs from, or None to always simulate
+
+# Usage:
+# > python simulation_server.py
+# Then send jobs with simulation_client.py, or POST them to http://127.0.0.1:8765/jobs from any other program
+#
+# A job is a json object with a type (yield, cometabolism, PDC, or bioproduct) and either
+#	args: the same command line arguments the matching script takes, e.g. {"type": "PDC", "args": ["iNovo_base_2022.xml", "exVA", "3.0", "exC00031", "2.0"]}
+#	model and substrates: {"type": "cometabolism", "model": "iNovo_base_2022.xml", "substrates": {"exVA": 1.0, "exSA": 1.0}}
+#	  plus any dFBA_engine.make_config() settings as "settings": {"n": 300, "desired_product": "C00033", "OE_amount": 0.6}
+# The body of the POST is one job or a list of jobs. The response has one json line per job, in the order they finish, each with the job's position in the list
+# With a result_store_path, "cached" in the response says whether a dFBA job's results came from the store
+# GET /status returns the number of workers, the loaded models, and how many jobs are queued and finished
+# Model paths are relative to the folder the server is started in
+
+
+##############
+# Workers
+
+# Each worker opens the result store itself, a connection can't be shared between processes
+_store = {}
+
+def init_worker():
+    if result_store_path is not None:
+        _store["store"] = result_store.ResultStore(result_store_path)
+    for model_path in model_paths:
+        if os.path.exists(model_path):
+            for scenario in preload_scenarios:
+                dFBA_engine.get_models(model_path, scenario)
+
+# The model path and config of a dFBA job
+def job_config(job):
+    scenario = job["type"]
+    settings = job.get("settings", {})
+    if "args" in job:
+        return dFBA_engine.config_from_args(scenario, job["args"], **settings)
+    return job["model"], dFBA_engine.make_config(scenario, job["substrates"], **settings)
+
+# NaN and infinity aren't valid json, so they're sent as null
+def _clean(value):
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    return value
+
+def run_job(task):
+    number, job = task
+    try:
+        if job.get("type") == "yield":
+            if "args" in job:
+                model_path, substrates = job["args"][0], {x: 1.0 for x in job["args"][1:]}
+            else:
+                model_path, substrates = job["model"], job["substrates"]
+            models = dFBA_engine.get_models(model_path, "yield")
+            value, fluxes = dFBA_engine.biomass_yield(models, substrates)
+            return {"job": number, "status": "done", "type": "yield", "yield": _clean(value),
+                    "fluxes": {x: _clean(fluxes[x]) for x in fluxes.index}}
+
+        model_path, config = job_config(job)
+        models = dFBA_engine.get_models(model_path, config["scenario"], config.get("desired_product"))
+        cached = False
+        if "store" in _store:
+            hits = _store["store"].hits
+            tracking, summary = result_store.cached_run(model_path, config, _store["store"], models)
+            cached = _store["store"].hits > hits
+        else:
+            tracking = dFBA_engine.simulate(models, config)
+            summary = dFBA_engine.summarize(tracking, config)
+        return {"job": number, "status": "done", "type": config["scenario"], "cached": cached,
+                "summary": {x: _clean(float(summary[x])) for x in summary},
+                "results": {x: [_clean(y) for y in tracking[x]] for x in tracking}}
+    except Exception as e:
+        return {"job": number, "status": "error", "type": job.get("type"), "message": type(e).__name__ + ": " + str(e)}
+
+
+##############
+# Server
+
+class SimulationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, pool, processes):
+        super().__init__(address, SimulationHandler)
+        self.pool = pool
+        self.processes = processes
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.finished = 0
+        self.failed = 0
+
+class SimulationHandler(BaseHTTPRequestHandler):
+    def _send_json(self, code, value):
+        body = (json.dumps(value) + "\n").encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._send_json(404, {"error": "unknown path " + self.path})
+            return
+        server = self.server
+        with server.lock:
+            self._send_json(200, {"processes": server.processes, "models": [x for x in model_paths if os.path.exists(x)],
+                                  "queued": server.queued, "finished": server.finished, "failed": server.failed})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self._send_json(404, {"error": "unknown path " + self.path})
+            return
+        try:
+            jobs = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError as e:
+            self._send_json(400, {"error": "could not read the jobs: " + str(e)})
+            return
+        if isinstance(jobs, dict):
+            jobs = [jobs]
+
+        # Results come back from the pool on its own thread, and are passed to this one to be written
+        server = self.server
+        results = queue.Queue()
+        with server.lock:
+            server.queued += len(jobs)
+        for number, job in enumerate(jobs):
+            server.pool.apply_async(run_job, ((number, job),), callback = results.put)
+
+        # One json line per job, written as soon as it's done; the response ends when the connection closes
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for count in range(len(jobs)):
+            result = results.get()
+            with server.lock:
+                server.queued -= 1
+                server.finished += 1
+                if result["status"] == "error":
+                    server.failed += 1
+            try:
+                self.wfile.write((json.dumps(result) + "\n").encode())
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # The client left, the rest of its jobs still finish and are counted
+                pass
+
+    def log_message(self, format, *args):
+        sys.stderr.write(self.address_string() + " " + (format % args) + "\n")
+
+def serve(host = host, port = port, processes = processes):
+    with multiprocessing.Pool(processes, initializer = init_worker) as pool:
+        server = SimulationServer((host, port), pool, processes)
+        print("Serving on http://" + host + ":" + str(port) + " with ", processes, " workers, press Ctrl-C to stop")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,221 @@
+###################
+# solve_cache.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This file caches the solutions of the loopless solves made at each dFBA timestep
+# Runs in a sweep often solve the same LP: the first steps of runs that start with the same biomass and minerals,
+# or late steps where only minerals that aren't limiting change a little, and each of those solves takes two LPs
+# Each solve is keyed on the model, its extra constraints, and its reaction bounds (the exchange bounds can be rounded to a number of significant digits),
+# and a repeated key returns the saved fluxes. Worker processes on one computer can share the solutions through a SQLite file
+###################
+
+# Import packages
+import os
+import sys
+import math
+import time
+import socket
+import sqlite3
+import hashlib
+import weakref
+import collections
+import numpy
+import pandas
+from cobra import Solution
+from loopless_formulation import loopless_solution, objective_coefficients
+
+###############
+# Defaults, can be changed for each run in the config (see dFBA_engine.make_config)
+default_digits = None		# significant digits of the exchange bounds in the key, None to use the exact bounds
+						# Rounded keys reuse solutions of nearby LPs, whose fluxes don't quite match the run's own bounds; near depletion that can shift a whole
+						# trajectory (a cometabolism run with 1.0000001 mmol/L exVA reusing the 1.0 mmol/L run's solutions at 6 digits ended with 4% more biomass)
+default_size = 20000		# solutions kept in memory in each process, the least recently used are dropped first
+file_size = 1000000		# solutions kept in a shared file, the oldest are dropped first
+
+# Solutions with other statuses (time limits, for example) depend on more than the LP, and are solved again every time
+cached_statuses = ["optimal", "infeasible"]
+
+schema = """
+CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, status TEXT, objective_value REAL, fluxes BLOB);
+CREATE TABLE IF NOT EXISTS stats (host TEXT, pid INTEGER, started REAL, memory_hits INTEGER, file_hits INTEGER, misses INTEGER, skipped INTEGER,
+                                  PRIMARY KEY (host, pid, started));
+"""
+
+
+##############
+# Keys
+
+# Round to significant digits, so bounds that differ only past them give the same key
+def quantize(value, digits):
+    if digits is None or value == 0 or math.isinf(value):
+        return value
+    return round(value, digits - 1 - math.floor(math.log10(abs(value))))
+
+# What a prepared model is, independent of the process it's in: its reactions and objective
+# Kept per model object, and made again if reactions are added or removed or the objective changes
+class ModelKey:
+    def __init__(self, model):
+        self.reaction_count = len(model.reactions)
+        self.reaction_IDs = [r.id for r in model.reactions]
+        self.boundary = [r.boundary for r in model.reactions]
+        self.direction = model.objective.direction
+        self.objective = objective = objective_coefficients(model)
+        text = model.id + "|" + ";".join(r.id + ":" + r.reaction for r in model.reactions)
+        text += "|" + model.objective.direction + ";".join(sorted(v.name + ":" + repr(objective[v]) for v in objective))
+        self.digest = hashlib.sha256(text.encode()).hexdigest()
+        # Constraints that aren't mass balances (SA_flux, OE_flux) are part of every key, their coefficients can change between runs
+        # The row loopless_solution() adds for the length of a solve isn't one of them
+        self.extra_constraints = [c for c in model.constraints if c.name not in model.metabolites and c.name != "loopless_obj_constraint"]
+
+    def matches(self, model):
+        return (len(model.reactions) == self.reaction_count and model.objective.direction == self.direction
+                and objective_coefficients(model) == self.objective)
+
+    def key(self, model, digits):
+        parts = [self.digest]
+        for c in self.extra_constraints:
+            coefficients = c.get_linear_coefficients(c.variables)
+            parts.append(c.name + repr((c.lb, c.ub)) + repr(sorted((v.name, coefficients[v]) for v in coefficients)))
+        # Exchange bounds are rounded, the bounds of all other reactions (knockouts, the PDC model's transport fluxes) are used as they are
+        bounds = []
+        for rxn, boundary in zip(model.reactions, self.boundary):
+            if boundary:
+                bounds.append((quantize(rxn.lower_bound, digits), quantize(rxn.upper_bound, digits)))
+            else:
+                bounds.append(rxn.bounds)
+        parts.append(repr(bounds))
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+##############
+# Cache
+
+class SolveCache:
+    # path is a SQLite file shared by every process that uses it, or None to keep solutions in this process only
+    # digits is the number of significant digits of the exchange bounds in the key, None for exact bounds
+    def __init__(self, path = None, digits = default_digits, size = default_size, timeout = 60):
+        self.path = path
+        self.digits = digits
+        self.size = size
+        self.memory = collections.OrderedDict()
+        self.model_keys = weakref.WeakKeyDictionary()		# model: ModelKey, dropped with the model
+        self.memory_hits = 0
+        self.file_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.started = time.time()
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, timeout = timeout)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(schema)
+
+    def model_key(self, model):
+        model_key = self.model_keys.get(model)
+        if model_key is None or not model_key.matches(model):
+            model_key = ModelKey(model)
+            self.model_keys[model] = model_key
+        return model_key
+
+    # Same as loopless_formulation.loopless_solution(model), from the cache when the same LP was solved before
+    def solve(self, model):
+        model_key = self.model_key(model)
+        key = model_key.key(model, self.digits)
+
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+            self.memory_hits += 1
+            return self._solution(model_key, entry)
+        if self.connection is not None:
+            row = self.connection.execute("SELECT status, objective_value, fluxes FROM solutions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                entry = (row[0], row[1], numpy.frombuffer(row[2], dtype = "<f8"))
+                self._remember(key, entry)
+                self.file_hits += 1
+                return self._solution(model_key, entry)
+
+        solution = loopless_solution(model)
+        if solution.status not in cached_statuses:
+            self.skipped += 1
+            return solution
+        self.misses += 1
+        objective_value = solution.objective_value
+        entry = (solution.status, float("nan") if objective_value is None else float(objective_value), solution.fluxes.to_numpy(dtype = "<f8").copy())
+        self._remember(key, entry)
+        if self.connection is not None:
+            with self.connection:
+                self.connection.execute("INSERT OR IGNORE INTO solutions VALUES (?, ?, ?, ?)", (key, entry[0], entry[1], entry[2].tobytes()))
+        return solution
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        if len(self.memory) > self.size:
+            self.memory.popitem(last = False)
+
+    def _solution(self, model_key, entry):
+        status, objective_value, fluxes = entry
+        return Solution(objective_value, status, pandas.Series(fluxes, index = model_key.reaction_IDs, name = "fluxes"))
+
+    def stats(self):
+        hits = self.memory_hits + self.file_hits
+        solves = hits + self.misses + self.skipped
+        return {"memory_hits": self.memory_hits, "file_hits": self.file_hits, "misses": self.misses, "skipped": self.skipped,
+                "hit_rate": hits / solves if solves > 0 else float("nan")}
+
+    # Write this process's counts to the shared file, so a sweep's hit rate can be added up from all its workers
+    # Also drops the oldest solutions once the file holds more than file_size of them
+    def save_stats(self):
+        if self.connection is None:
+            return
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (socket.gethostname(), os.getpid(), self.started, self.memory_hits, self.file_hits, self.misses, self.skipped))
+            count = self.connection.execute("SELECT max(rowid) - min(rowid) FROM solutions").fetchone()[0]
+            if count is not None and count > file_size:
+                self.connection.execute("DELETE FROM solutions WHERE rowid < (SELECT max(rowid) FROM solutions) - ?", (file_size,))
+
+    def close(self):
+        self.save_stats()
+        if self.connection is not None:
+            self.connection.close()
+
+
+# Counts from every process that used a cache file since a time (time.time()), added up
+def file_stats(path, since = 0):
+    connection = sqlite3.connect(path, timeout = 60)
+    connection.executescript(schema)
+    row = connection.execute("SELECT sum(memory_hits), sum(file_hits), sum(misses), sum(skipped), count(*) FROM stats WHERE started >= ?", (since,)).fetchone()
+    entries = connection.execute("SELECT count(*) FROM solutions").fetchone()[0]
+    connection.close()
+    memory_hits, file_hits, misses, skipped = [x or 0 for x in row[:4]]
+    solves = memory_hits + file_hits + misses + skipped
+    return {"processes": row[4], "memory_hits": memory_hits, "file_hits": file_hits, "misses": misses, "skipped": skipped,
+            "hit_rate": (memory_hits + file_hits) / solves if solves > 0 else float("nan"), "saved_solutions": entries}
+
+# One cache per setting in each process, so every run in a worker adds to the same one
+_caches = {}
+
+def get_cache(path = None, digits = default_digits, size = default_size):
+    key = (path, digits, size)
+    if key not in _caches:
+        _caches[key] = SolveCache(path, digits, size)
+    return _caches[key]
+
+# The cache a run's config asks for, or None
+# "solve_cache": True for one in this process only, or the path of a file to share; "solve_cache_digits": significant digits or None for exact bounds
+def cache_for_config(config):
+    setting = config.get("solve_cache")
+    if setting is None or setting is False:
+        return None
+    path = None if setting is True else setting
+    return get_cache(path, config.get("solve_cache_digits", default_digits), config.get("solve_cache_size", default_size))
+
+
+if __name__ == "__main__":
+    # Usage:
+    # > python solve_cache.py <cache file>
+    # Prints the hit counts of every process that used the file, and how many solutions it holds
+    stats = file_stats(sys.argv[1])
+    for x in stats:
+        print(x, ": ", stats[x])
@@ -0,0 +1,382 @@
+###################
+# work_queue.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This file runs sweeps on more than one computer through a folder on a shared filesystem, with no server or message broker
+# Each job is a small JSON file. A worker claims a job by renaming its file into the claimed folder, which only one worker can do,
+# and keeps touching the claimed file while the job runs. Results are written to a temporary file and then renamed into place,
+# so a result file is either complete or not there at all. Jobs whose worker stopped touching them (it died, or its computer did) go back in the queue
+# Job names come from the run's config and model file, so submitting the same sweep again only adds the jobs that aren't done yet
+###################
+
+# Import packages
+import sys
+import os
+import json
+import time
+import random
+import socket
+import threading
+import traceback
+
+###############
+# Settings
+heartbeat_interval = 30		# seconds between touches of a running job's claimed file
+stale_after = 300			# seconds without a touch before a running job is put back in the queue
+						# Has to be longer than the slowest filesystem delay between computers, not than a run; runs of any length keep touching their file
+max_attempts = 3			# a job whose worker died this many times is recorded as an error instead of being tried again
+poll_interval = 10			# seconds a worker waits before looking again when the other workers have all the remaining jobs
+
+# Queue folder layout:
+#	queue.json - the sweep: the grid names and the settings every job shares
+#	jobs/<job>.json - jobs waiting for a worker
+#	claimed/<job>@<worker>.json - jobs being run, <worker> is the computer name and process ID
+#	results/<job>.json - finished jobs: the grid point, pre-screen status, summary metrics, and the run counters for run_metrics.py
+# A job that raised an exception is finished too, with status "error" and the exception as the reason, so one bad point doesn't stop a sweep
+
+
+##############
+# Files
+
+# Write a file so that other workers only ever see it complete
+def write_json(path, data):
+    temporary = path + ".tmp." + worker_name()
+    with open(temporary, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def worker_name():
+    return socket.gethostname() + "-" + str(os.getpid())
+
+# Folder entries that are finished files (not temporary ones being written), as name without .json: path
+def _entries(folder):
+    entries = {}
+    for name in os.listdir(folder):
+        if name.endswith(".json"):
+            entries[name[:-len(".json")]] = os.path.join(folder, name)
+    return entries
+
+
+##############
+# Queue
+
+class WorkQueue:
+    def __init__(self, path):
+        self.path = path
+        self.jobs = os.path.join(path, "jobs")
+        self.claimed = os.path.join(path, "claimed")
+        self.results = os.path.join(path, "results")
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, "queue.json"))
+
+    # Make the folders and save the sweep's shared settings; an existing queue keeps its own settings
+    def create(self, settings):
+        for folder in (self.path, self.jobs, self.claimed, self.results):
+            os.makedirs(folder, exist_ok = True)
+        if not self.exists():
+            write_json(os.path.join(self.path, "queue.json"), settings)
+
+    def settings(self):
+        return read_json(os.path.join(self.path, "queue.json"))
+
+    def claimed_jobs(self):
+        claimed = {}
+        for name, path in _entries(self.claimed).items():
+            job_ID, worker = name.split("@", 1)
+            claimed[job_ID] = (worker, path)
+        return claimed
+
+    # Add jobs (dictionaries with an "id") that aren't waiting, running, or done yet; returns how many were added and how many were already done
+    def submit(self, jobs):
+        pending = _entries(self.jobs)
+        claimed = self.claimed_jobs()
+        done = _entries(self.results)
+        added = 0
+        skipped = 0
+        for job in jobs:
+            if job["id"] in done:
+                skipped += 1
+            elif job["id"] not in pending and job["id"] not in claimed:
+                job.setdefault("attempts", 0)
+                write_json(os.path.join(self.jobs, job["id"] + ".json"), job)
+                added += 1
+        return added, skipped
+
+    # Take a waiting job, or None if there are none; jobs are tried in random order so workers starting together don't all go for the same one
+    def claim(self, worker):
+        pending = list(_entries(self.jobs).items())
+        random.shuffle(pending)
+        done = _entries(self.results)
+        for job_ID, path in pending:
+            target = os.path.join(self.claimed, job_ID + "@" + worker + ".json")
+            try:
+                os.rename(path, target)
+                # Renaming keeps the time the job was submitted, which would make it look stale to the other workers
+                os.utime(target)
+                job = read_json(target)
+            except FileNotFoundError:
+                # Another worker got there first
+                continue
+            if job_ID in done:
+                # Submitted again while its first copy was finishing
+                os.remove(target)
+                continue
+            return job, target
+        return None
+
+    def complete(self, job, claimed_path, result):
+        write_json(os.path.join(self.results, job["id"] + ".json"), result)
+        try:
+            os.remove(claimed_path)
+        except FileNotFoundError:
+            # It was put back in the queue while this worker was too slow to touch it; the other copy will find the result and stop
+            pass
+
+    # Put jobs whose worker stopped touching them back in the queue, returns how many
+    # A worker on this computer whose process is gone counts as stopped right away
+    def requeue_stale(self):
+        now = time.time()
+        host = socket.gethostname()
+        done = _entries(self.results)
+        requeued = 0
+        for job_ID, (worker, path) in self.claimed_jobs().items():
+            try:
+                age = now - os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            worker_host, pid = worker.rsplit("-", 1)
+            if age < stale_after and not (worker_host == host and not _process_exists(int(pid))):
+                continue
+            # Whoever renames it first does the requeue
+            taken = path + ".requeue." + worker_name()
+            try:
+                os.rename(path, taken)
+            except FileNotFoundError:
+                continue
+            job = read_json(taken)
+            job["attempts"] = job.get("attempts", 0) + 1
+            if job_ID in done:
+                pass
+            elif job["attempts"] >= max_attempts:
+                write_json(os.path.join(self.results, job_ID + ".json"),
+                           error_result(job, "worker stopped " + str(job["attempts"]) + " times, last was " + worker))
+            else:
+                write_json(os.path.join(self.jobs, job_ID + ".json"), job)
+                requeued += 1
+            os.remove(taken)
+        return requeued
+
+    # Counts of waiting, running, and finished jobs, the running ones by worker, and throughput and time left from the finish times of results
+    # results is every finished job's result (only status and finished are used), for callers that already have them; otherwise they're read from the folder
+    def progress(self, results = None):
+        pending = len(_entries(self.jobs))
+        claimed = self.claimed_jobs()
+        results = self.read_results() if results is None else results
+        workers = {}
+        for worker, path in claimed.values():
+            workers[worker] = workers.get(worker, 0) + 1
+        errors = len([x for x in results if x["status"] == "error"])
+        finished = sorted(x["finished"] for x in results)
+        # Throughput over the last hour of results, so a resumed sweep isn't averaged over the time it sat stopped
+        recent = [x for x in finished if x >= time.time() - 3600]
+        rate = float("nan")
+        if len(recent) > 1 and recent[-1] > recent[0]:
+            rate = (len(recent) - 1) / (recent[-1] - recent[0])
+        remaining = pending + len(claimed)
+        return {"pending": pending, "running": len(claimed), "done": len(results), "errors": errors, "workers": workers,
+                "jobs_per_hour": rate * 3600, "hours_left": remaining / rate / 3600 if rate > 0 else float("nan")}
+
+    def finished(self):
+        return len(_entries(self.jobs)) == 0 and len(self.claimed_jobs()) == 0
+
+    def read_results(self):
+        return [read_json(path) for path in _entries(self.results).values()]
+
+    # Results of the finished jobs whose names aren't in seen yet, which they're added to; for readers that keep running totals
+    def new_results(self, seen):
+        results = []
+        for job_ID, path in _entries(self.results).items():
+            if job_ID not in seen:
+                results.append(read_json(path))
+                seen.add(job_ID)
+        return results
+
+# A killed process that its parent hasn't collected yet still has a process ID; on Linux, /proc shows it as a zombie (Z)
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    try:
+        with open("/proc/" + str(pid) + "/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
+        return True
+
+def error_result(job, reason):
+    return {"id": job["id"], "point": job["point"], "status": "error", "reason": reason, "summary": {}, "worker": worker_name(),
+            "seconds": float("nan"), "finished": time.time()}
+
+
+##############
+# Workers
+
+# Touches the claimed file of the running job until stopped
+class Heartbeat:
+    def __init__(self, path):
+        self.path = path
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+
+    def run(self):
+        while not self.stopped.wait(heartbeat_interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+
+# One sweep point: the same pre-screen and run as inovo sweep's workers
+def run_job(job, settings):
+    import dFBA_engine
+    config = job["config"]
+    models = dFBA_engine.get_models(job["model_path"], config["scenario"], config.get("desired_product"))
+    status, reason = dFBA_engine.prescreen(models, config)
+    if not dFBA_engine.should_simulate(status, config):
+        return status, reason, dFBA_engine.skipped_summary(config)
+    if settings.get("store") is not None:
+        import result_store
+        if "store" not in _stores:
+            _stores["store"] = result_store.ResultStore(settings["store"])
+        tracking, summary = result_store.cached_run(job["model_path"], config, _stores["store"], models)
+        return status, reason, summary
+    tracking = dFBA_engine.simulate(models, config)
+    return status, reason, dFBA_engine.summarize(tracking, config)
+
+_stores = {}
+
+# Claim and run jobs until the queue is finished
+# With wait, a worker that runs out of jobs while others are still running keeps looking, to pick up the jobs of any worker that dies
+def work(path, wait = True, verbose = True):
+    queue = WorkQueue(path)
+    settings = queue.settings()
+    worker = worker_name()
+    count = 0
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is None:
+            if queue.requeue_stale() > 0:
+                continue
+            if queue.finished() or not wait:
+                return count
+            time.sleep(poll_interval)
+            continue
+        job, claimed_path = claimed
+        start = time.time()
+        with Heartbeat(claimed_path):
+            try:
+                import dFBA_engine
+                import run_metrics
+                before = run_metrics.snapshot()
+                status, reason, summary = run_job(job, settings)
+                # How much this worker's run counters grew, for the metrics file (see run_metrics.py)
+                result = {"id": job["id"], "point": job["point"], "status": status, "reason": reason, "summary": summary,
+                          "worker": worker, "seconds": time.time() - start, "finished": time.time(),
+                          "skipped": not dFBA_engine.should_simulate(status, job["config"]), "metrics": run_metrics.since(before)}
+            except Exception:
+                result = error_result(job, traceback.format_exc(limit = 2).strip().splitlines()[-1])
+        queue.complete(job, claimed_path, result)
+        count += 1
+        if verbose:
+            print(worker, " finished ", dict(zip(settings["names"], job["point"])), " ", result["status"])
+
+def _work_process(path, wait, verbose):
+    work(path, wait, verbose)
+
+# Run workers in this many processes on this computer, returns when the queue is finished
+# With metrics_path, this process keeps a metrics file of the whole queue up to date while they work (see run_metrics.py)
+def work_processes(path, processes, wait = True, verbose = True, metrics_path = None):
+    import multiprocessing
+    import multiprocessing.connection
+    workers = [multiprocessing.Process(target = _work_process, args = (path, wait, verbose)) for i in range(processes)]
+    for process in workers:
+        process.start()
+    if metrics_path is not None:
+        import run_metrics
+        metrics = run_metrics.QueueMetrics(WorkQueue(path))
+        while any(process.is_alive() for process in workers):
+            run_metrics.write_metrics(metrics_path, metrics.values())
+            multiprocessing.connection.wait([process.sentinel for process in workers if process.is_alive()], timeout = run_metrics.write_interval)
+        run_metrics.write_metrics(metrics_path, metrics.values())
+    for process in workers:
+        process.join()
+
+
+##############
+# Sweeps
+
+# The jobs of a sweep from (point, config) tasks; a job's name comes from its config and the contents of its model file, as in result_store.py
+def sweep_jobs(model_path, tasks):
+    import result_store
+    model_path = os.path.abspath(model_path)
+    model_digest = result_store.model_hash(model_path)
+    jobs = []
+    for point, config in tasks:
+        job_ID = result_store.run_key(result_store.config_hash(config), model_digest, "")[:24]
+        jobs.append({"id": job_ID, "point": list(point), "model_path": model_path, "config": config})
+    return jobs
+
+# The finished jobs as the table inovo sweep writes: grid values, pre-screen status and reason, and summary metrics
+def merge(path):
+    import pandas
+    queue = WorkQueue(path)
+    names = queue.settings()["names"]
+    rows = []
+    metric_names = []
+    for result in queue.read_results():
+        rows.append(dict(zip(names, result["point"]), prescreen = result["status"], prescreen_reason = result["reason"], **result["summary"]))
+        for x in result["summary"]:
+            if x not in metric_names:
+                metric_names.append(x)
+    df = pandas.DataFrame(rows, columns = names + ["prescreen", "prescreen_reason"] + metric_names)
+    return df.sort_values(names).reset_index(drop = True)
+
+def print_progress(path):
+    progress = WorkQueue(path).progress()
+    total = progress["pending"] + progress["running"] + progress["done"]
+    print(progress["done"], " of ", total, " jobs done (", progress["errors"], " errors), ", progress["running"], " running, ", progress["pending"], " waiting")
+    for worker in sorted(progress["workers"]):
+        print("   ", worker, ": ", progress["workers"][worker], " running")
+    print("Jobs per hour: ", round(progress["jobs_per_hour"], 1), ", hours left: ", round(progress["hours_left"], 2))
+
+
+if __name__ == "__main__":
+    # Usage:
+    # > python work_queue.py work <queue folder> [<processes>]
+    # > python work_queue.py progress <queue folder>
+    # > python work_queue.py merge <queue folder> <output csv>
+    # The same as inovo worker, inovo queue, and inovo queue --merge (see inovo.py)
+    command = sys.argv[1]
+    if command == "work":
+        work_processes(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count())
+    elif command == "progress":
+        print_progress(sys.argv[2])
+    elif command == "merge":
+        merge(sys.argv[2]).to_csv(sys.argv[3], index = False)
+    else:
+        print("Unknown command: ", command, ", use work, progress, or merge")
@@ -0,0 +1,168 @@
+###################
+# balance_audit.py
+# Copyright 2022, Alexandra Linz, Daniel Noguera, and Timothy Donohue
+#
+# This script checks that every reaction in the reaction files is mass balanced, for all model variants at once
+# The formulas in the compounds file are turned into an element matrix (elements x compounds), and the reactions of every variant into one
+# stoichiometric matrix (compounds x reactions), so a single matrix product gives the element balance of every reaction in every variant
+# Unbalanced reactions can make free-energy loops, which slow down the loopless solves and can let biomass run in reverse
+# build_iNovo.py runs it on the reactions file it builds from, and on any other variants it's given to compare with
+###################
+
+# Import packages
+import sys
+import os
+import re
+import ast
+import numpy
+import pandas
+
+###############
+# EDIT THIS SECTION BEFORE RUNNING
+tolerance = 1e-6					# element imbalances smaller than this are rounding in the coefficients
+expected_unbalanced = ["biomass"]	# pseudo-reactions that aren't meant to balance; they're reported separately
+output_path = "balance_audit.csv"	# where the comparison table is written when run on its own
+
+# Usage:
+# > python balance_audit.py <compounds file> <reactions file> [<reactions file> ...]
+# For example, all four variants:
+# > python balance_audit.py Input_files/minimal_compounds_2022-03-03.csv Input_files/minimal_reactions_2022-02-11.txt Input_files/vanAB_minimal_reactions_2022-03-02.txt Input_files/hypothetical_demethylation_minimal_reactions_2022-03-02.txt Input_files/engineered_minimal_reactions_2022-03-02.txt
+# Prints the unbalanced reactions of each variant, and writes a table of every unbalanced reaction with its imbalance in each variant to output_path
+# The imbalance is products minus reactants, e.g. "H: -2" means two hydrogens are lost going forward
+# The compounds file has no charges, so charge balance can't be checked; a reaction that is only off in H is most likely a protonation state difference
+# R (protein-bound groups) and Z (cytochrome carriers) in the formulas are counted like elements, so they must balance too
+
+
+##############
+# Input files
+
+# Read the same way build_iNovo.py reads them
+def read_compounds(path):
+    compounds = pandas.read_csv(path, sep = ",", header = None)
+    compounds.columns = ["cpdID", "Formula", "Name", "compartment"]
+    compounds["cpdID"] = compounds["cpdID"].str.strip()
+    return compounds
+
+def read_reactions(path):
+    reactions = pandas.read_csv(path, sep = "\t", header = None)
+    reactions.columns = ["rxnID", "reversibility", "cpds", "names", "genes", "sbo"]
+    reactions["rxnID"] = reactions["rxnID"].str.strip()
+    reactions["names"] = reactions["names"].str.strip()
+    reactions["cpds"] = reactions["cpds"].str.strip()
+    return reactions
+
+# Short name of a variant from its reactions file, e.g. vanAB from vanAB_minimal_reactions_2022-03-02.txt
+def variant_name(path):
+    name = os.path.basename(path).split("minimal_reactions")[0].strip("_")
+    return name if name != "" else "base"
+
+
+##############
+# Matrices
+
+# Elements x compounds, from the formulas; a compound listed twice keeps its first formula, as in the model
+# Compounds without a formula get NaN, so reactions that use them show up as unknown instead of balanced
+def element_matrix(compounds):
+    compounds = compounds.drop_duplicates("cpdID")
+    counts = []
+    for formula in compounds["Formula"]:
+        if pandas.isna(formula) or str(formula).strip() == "":
+            counts.append(None)
+            continue
+        count = {}
+        for element, number in re.findall(r"([A-Z][a-z]*)(\d*)", str(formula)):
+            count[element] = count.get(element, 0) + (int(number) if number else 1)
+        counts.append(count)
+    elements = sorted(set(x for count in counts if count is not None for x in count))
+    matrix = numpy.full((len(elements), len(counts)), numpy.nan)
+    for j, count in enumerate(counts):
+        if count is not None:
+            matrix[:, j] = [count.get(x, 0) for x in elements]
+    return pandas.DataFrame(matrix, index = elements, columns = compounds["cpdID"].to_list())
+
+# Compounds x reactions of all variants side by side, with (variant, reaction) columns
+# variants is a dictionary of variant name: reactions table
+def stoichiometric_matrix(variants):
+    rows = []
+    for variant in variants:
+        for index, row in variants[variant].iterrows():
+            for cpd_ID, coefficient in ast.literal_eval("{" + row["cpds"] + "}").items():
+                rows.append((cpd_ID, variant, row["rxnID"], float(coefficient)))
+    entries = pandas.DataFrame(rows, columns = ["cpdID", "variant", "rxnID", "coefficient"])
+    columns = pandas.MultiIndex.from_tuples(list(dict.fromkeys(zip(entries["variant"], entries["rxnID"]))), names = ["variant", "rxnID"])
+    compound_IDs = list(dict.fromkeys(entries["cpdID"]))
+    matrix = numpy.zeros((len(compound_IDs), len(columns)))
+    row_index = {x: i for i, x in enumerate(compound_IDs)}
+    column_index = {x: j for j, x in enumerate(columns)}
+    for cpd_ID, variant, rxn_ID, coefficient in entries.itertuples(index = False):
+        matrix[row_index[cpd_ID], column_index[(variant, rxn_ID)]] += coefficient
+    return pandas.DataFrame(matrix, index = compound_IDs, columns = columns)
+
+
+##############
+# Audit
+
+def imbalance_text(elements, values):
+    return ", ".join(x + ": " + str(round(v, 6)) for x, v in zip(elements, values) if abs(v) > tolerance)
+
+# Element balance of every reaction of every variant, from one product of the two matrices
+# Returns one row per unbalanced reaction: variant, rxnID, name, status (unbalanced, expected, or unknown formula), imbalance, and one column per element
+def audit(compounds, variants):
+    elements = element_matrix(compounds)
+    S = stoichiometric_matrix(variants)
+    missing = [x for x in S.index if x not in elements.columns]
+    E = elements.reindex(columns = S.index).to_numpy()
+    # A compound that isn't in the compounds file, or has no formula, makes the balance of its reactions unknown
+    unknown = (numpy.isnan(E).any(axis = 0).astype(float) @ (S.to_numpy() != 0)) > 0
+    balance = numpy.nan_to_num(E) @ S.to_numpy()
+
+    names = {(variant, row["rxnID"]): row["names"] for variant in variants for index, row in variants[variant].iterrows()}
+    rows = []
+    for j in numpy.flatnonzero(unknown | (numpy.abs(balance) > tolerance).any(axis = 0)):
+        variant, rxn_ID = S.columns[j]
+        if unknown[j]:
+            status = "unknown formula"
+        elif rxn_ID in expected_unbalanced:
+            status = "expected"
+        else:
+            status = "unbalanced"
+        rows.append([variant, rxn_ID, names[(variant, rxn_ID)], status, imbalance_text(elements.index, balance[:, j])] + list(balance[:, j]))
+    report = pandas.DataFrame(rows, columns = ["variant", "rxnID", "name", "status", "imbalance"] + list(elements.index))
+    report.attrs["missing_compounds"] = missing
+    return report
+
+# One row per reaction that is unbalanced in any variant, with its imbalance in each variant
+# "balanced" where it balances in a variant and "absent" where the variant doesn't have it; same is True if it's the same in every variant that has it
+def compare(report, variants):
+    reactions = list(dict.fromkeys(report["rxnID"]))
+    table = pandas.DataFrame({"rxnID": reactions})
+    for variant in variants:
+        present = set(variants[variant]["rxnID"])
+        found = report[report["variant"] == variant].set_index("rxnID")
+        table[variant] = [found.loc[x, "imbalance"] if x in found.index else ("balanced" if x in present else "absent") for x in reactions]
+    table["same"] = [len(set(x for x in row if x != "absent")) == 1 for row in table[list(variants)].itertuples(index = False)]
+    return table
+
+def print_report(report, variants):
+    if len(report.attrs.get("missing_compounds", [])) > 0:
+        print("Compounds in the reactions that aren't in the compounds file: ", ", ".join(report.attrs["missing_compounds"]))
+    for variant in variants:
+        rows = report[report["variant"] == variant]
+        problems = rows[rows["status"] != "expected"]
+        print(variant, ": ", len(problems), " unbalanced reactions of ", len(variants[variant]), " (", len(rows) - len(problems), " expected)")
+        for index, row in problems.iterrows():
+            print("   ", row["rxnID"], " (", row["name"], "), ", row["status"], ": ", row["imbalance"])
+    if len(variants) > 1:
+        table = compare(report, variants)
+        different = table[~table["same"]]
+        print("Reactions whose balance differs between variants: ", len(different))
+        for index, row in different.iterrows():
+            print("   ", row["rxnID"], ": ", "; ".join(x + " " + row[x] for x in variants))
+
+
+if __name__ == "__main__":
+    compounds = read_compounds(sys.argv[1])
+    variants = {variant_name(x): read_reactions(x) for x in sys.argv[2:]}
+    report = audit(compounds, variants)
+    print_report(report, variants)
+    compare(report, variants).to_csv(output_path, index = False)
@@ -12,11 +12,13 @@ logging.basicConfig() # COBRApy uses this to report errors
 import pandas
 import ast # Used for interpreting literal strings
 import cobra
+import balance_audit # Element balance of every reaction, see balance_audit.py
 
 # Set file paths
 cpd_path = sys.argv[1]	# 1st argument is the path to the file of compound IDs
 rxn_path = sys.argv[2]	# 2nd argument is the path to the file of reaction IDs
 output_path = sys.argv[3]	# 3rd argument is the path and name of the model to output
+compare_paths = sys.argv[4:]	# Optional: reaction files of other model variants, whose mass balance is checked alongside this one's
 
 # Set up model object
 model = cobra.Model('Novo')
@@ -83,9 +85,12 @@ for g in model.genes:
 
 model.objective = model.reactions.get_by_id("biomass")
 
-# Optional: use these statements to check the mass balance of specific reactions
-#print("engR00449: ", model.reactions.get_by_id("engR00449").check_mass_balance())
-#print("engR02273: ", model.reactions.get_by_id("engR02273").check_mass_balance())
+# Check the mass balance of every reaction, and of the other variants if any were given, and compare them
+# Only biomass is expected to be unbalanced; anything else listed here should be fixed in the reactions file
+variants = {balance_audit.variant_name(rxn_path): reactions}
+for path in compare_paths:
+    variants[balance_audit.variant_name(path)] = balance_audit.read_reactions(path)
+balance_audit.print_report(balance_audit.audit(compounds, variants), variants)
 
 # Add exchanges for the following substrates, but set them to zero for now.
 